@@ -0,0 +1,52 @@
+'''
+cold-start benchmark: wall time of `import kan` (and of a forward pass) in fresh interpreters,
+plus the heavy optional dependencies that ended up in sys.modules.
+
+Usage:
+    python benchmarks/import_time.py [--repeat 5] [--forward]
+    python -X importtime -c "import kan" 2> importtime.log   # per-module breakdown
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY = ['sympy', 'matplotlib', 'pandas', 'sklearn', 'yaml', 'tqdm', 'scipy']
+
+SNIPPET = '''
+import json, sys, time
+t0 = time.perf_counter()
+import kan
+t1 = time.perf_counter()
+if {forward}:
+    import torch
+    model = kan.KAN(width=[2,5,1], grid=5, k=3, seed=0, auto_save=False)
+    model(torch.rand(100, 2))
+t2 = time.perf_counter()
+print(json.dumps({{'import': t1 - t0, 'forward': t2 - t1, 'loaded': [m for m in {heavy} if m in sys.modules]}}))
+'''
+
+
+def run_once(forward):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    code = SNIPPET.format(forward=forward, heavy=HEAVY)
+    out = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--forward', action='store_true', help='also time model construction and one forward pass')
+    args = parser.parse_args()
+
+    results = [run_once(args.forward) for _ in range(args.repeat)]
+    import_times = [r['import'] for r in results]
+    print(f"import kan : median {statistics.median(import_times)*1e3:.0f} ms, min {min(import_times)*1e3:.0f} ms over {args.repeat} runs")
+    if args.forward:
+        forward_times = [r['forward'] for r in results]
+        print(f"KAN + forward : median {statistics.median(forward_times)*1e3:.0f} ms")
+    print(f"heavy modules loaded : {results[-1]['loaded']}")
@@ -37,11 +37,17 @@ class KANLayer(nn.Module):
         grid_eps: float in [0,1]
             a hyperparameter used in update_grid_from_samples. When grid_eps = 1, the grid is uniform; when grid_eps = 0, the grid is partitioned using percentiles of samples. 0 < grid_eps < 1 interpolates between the two extremes.
             the id of activation functions that are locked
+        sparse_eval: None or bool
+            whether splines are evaluated on the k+1 active coefficients only (see coef2curve). None means automatic (sparse once the grid has at least 16 intervals, 64 for uniform grids)
+        fused: bool
+            If True, forward uses KANLayerFunction, which only stores the inputs and recomputes the local bases in backward. preacts, postacts and postspline are not returned.
+        grid_uniform: bool
+            whether the grid is uniform (see is_uniform_grid). If True, the knot interval is computed directly and B_batch_uniform is used in forward. Updated whenever the grid changes.
         device: str
             device
     """
 
-    def __init__(self, in_dim=3, out_dim=2, num=5, k=3, noise_scale=0.5, scale_base_mu=0.0, scale_base_sigma=1.0, scale_sp=1.0, base_fun=torch.nn.SiLU(), grid_eps=0.02, grid_range=[-1, 1], sp_trainable=True, sb_trainable=True, save_plot_data = True, device='cpu', sparse_init=False):
+    def __init__(self, in_dim=3, out_dim=2, num=5, k=3, noise_scale=0.5, scale_base_mu=0.0, scale_base_sigma=1.0, scale_sp=1.0, base_fun=torch.nn.SiLU(), grid_eps=0.02, grid_range=[-1, 1], sp_trainable=True, sb_trainable=True, save_plot_data = True, device='cpu', sparse_init=False, sparse_eval=None, fused=False):
         ''''
         initialize a KANLayer
         
@@ -77,6 +83,10 @@ class KANLayer(nn.Module):
                 device
             sparse_init : bool
                 if sparse_init = True, sparse initialization is applied.
+            sparse_eval : None or bool
+                If True, splines are evaluated on the k+1 active coefficients only; if False, on all G+k coefficients. If None, sparse evaluation is used once the grid has at least 16 intervals (64 for uniform grids). Default: None.
+            fused : bool
+                If True, forward/backward go through KANLayerFunction (activation memory O(batch*in_dim*(k+1)) instead of O(batch*in_dim*out_dim*G)). Default: False.
             
         Returns:
         --------
@@ -114,6 +124,12 @@ class KANLayer(nn.Module):
 
         
         self.grid_eps = grid_eps
+        self.sparse_eval = sparse_eval
+        self.fused = fused
+        self.grid_uniform = is_uniform_grid(self.grid)
+        self.register_load_state_dict_post_hook(update_grid_uniform)
+        # utils.QuantileSketch of the inputs, fed by forward in training mode (see update_grid_from_samples)
+        self.sketch = None
         
         self.to(device)
         
@@ -122,7 +138,7 @@ class KANLayer(nn.Module):
         self.device = device    
         return self
 
-    def forward(self, x):
+    def forward(self, x, fused=None):
         '''
         KANLayer forward given input x
         
@@ -130,6 +146,8 @@ class KANLayer(nn.Module):
         -----
             x : 2D torch.float
                 inputs, shape (number of samples, input dimension)
+            fused : None or bool
+                whether to use KANLayerFunction. If None, self.fused is used. When fused, preacts, postacts and postspline are None.
             
         Returns:
         --------
@@ -150,11 +168,24 @@ class KANLayer(nn.Module):
         >>> y, preacts, postacts, postspline = model(x)
         >>> y.shape, preacts.shape, postacts.shape, postspline.shape
         '''
+        if self.sketch != None and self.training:
+            self.sketch.update(x)
+        if fused == None:
+            fused = self.fused
+        if fused:
+            y = KANLayerFunction.apply(x, self.grid, self.coef, self.scale_base, self.scale_sp, self.mask, self.k, self.base_fun, self.grid_uniform)
+            return y, None, None, None
+        
         batch = x.shape[0]
         preacts = x[:,None,:].clone().expand(batch, self.out_dim, self.in_dim)
             
         base = self.base_fun(x) # (batch, in_dim)
-        y = coef2curve(x_eval=x, grid=self.grid, coef=self.coef, k=self.k)
+        if self.sparse_eval == None:
+            # dense evaluation is cheaper for small grids (and up to larger grids when the bases come from B_batch_uniform)
+            sparse = self.grid.shape[1] - 1 - 2*self.k >= (64 if self.grid_uniform else 16)
+        else:
+            sparse = self.sparse_eval
+        y = coef2curve(x_eval=x, grid=self.grid, coef=self.coef, k=self.k, sparse=sparse, uniform=self.grid_uniform)
         
         postspline = y.clone().permute(0,2,1)
             
@@ -172,8 +203,9 @@ class KANLayer(nn.Module):
         
         Args:
         -----
-            x : 2D torch.float
-                inputs, shape (number of samples, input dimension)
+            x : 2D torch.float or None
+                inputs, shape (number of samples, input dimension). If None, knots and fitting points are read from 
+                the quantiles of self.sketch (all inputs seen by forward since the sketch was attached), without sorting.
             
         Returns:
         --------
@@ -188,18 +220,24 @@ class KANLayer(nn.Module):
         >>> print(model.grid.data)
         '''
         
-        batch = x.shape[0]
-        #x = torch.einsum('ij,k->ikj', x, torch.ones(self.out_dim, ).to(self.device)).reshape(batch, self.size).permute(1, 0)
-        x_pos = torch.sort(x, dim=0)[0]
-        y_eval = coef2curve(x_pos, self.grid, self.coef, self.k)
         num_interval = self.grid.shape[1] - 1 - 2*self.k
+        if x == None:
+            if self.sketch == None:
+                raise Exception('update_grid_from_samples(None) needs a QuantileSketch in self.sketch')
+            # 10 points per interval, with the knot quantiles i/num_interval among them
+            x_pos = self.sketch.quantile(torch.linspace(0, 1, steps=10*num_interval+1)).permute(1,0)
+        else:
+            #x = torch.einsum('ij,k->ikj', x, torch.ones(self.out_dim, ).to(self.device)).reshape(batch, self.size).permute(1, 0)
+            x_pos = torch.sort(x, dim=0)[0]
+        batch = x_pos.shape[0]
+        y_eval = coef2curve(x_pos, self.grid, self.coef, self.k)
         
         def get_grid(num_interval):
             ids = [int(batch / num_interval * i) for i in range(num_interval)] + [-1]
             grid_adaptive = x_pos[ids, :].permute(1,0)
             margin = 0.00
             h = (grid_adaptive[:,[-1]] - grid_adaptive[:,[0]] + 2 * margin)/num_interval
-            grid_uniform = grid_adaptive[:,[0]] - margin + h * torch.arange(num_interval+1,)[None, :].to(x.device)
+            grid_uniform = grid_adaptive[:,[0]] - margin + h * torch.arange(num_interval+1,)[None, :].to(x_pos.device)
             grid = self.grid_eps * grid_uniform + (1 - self.grid_eps) * grid_adaptive
             return grid
         
@@ -212,6 +250,7 @@ class KANLayer(nn.Module):
             y_eval = coef2curve(x_pos, self.grid, self.coef, self.k)
         
         self.grid.data = extend_grid(grid, k_extend=self.k)
+        self.grid_uniform = is_uniform_grid(self.grid)
         #print('x_pos 2', x_pos.shape)
         #print('y_eval 2', y_eval.shape)
         self.coef.data = curve2coef(x_pos, y_eval, self.grid, self.k)
@@ -225,11 +264,15 @@ class KANLayer(nn.Module):
             parent : KANLayer
                 a parent KANLayer (whose grid is usually coarser than the current model)
             x : 2D torch.float
-                inputs, shape (number of samples, input dimension)
+                inputs, shape (number of samples, input dimension). Not used if mode='exact' succeeds.
+            mode : str
+                'sample' or 'grid': fit the coefficients to the parent curves evaluated on samples (or on a dense grid).
+                'exact': compute the coefficients by knot insertion (see spline.refine_coef), without samples. 
+                Only possible when the grids are nested (e.g. G -> 2G) and k is unchanged; nothing is modified otherwise.
             
         Returns:
         --------
-            None
+            None, or (mode='exact') whether the exact refinement was applied
           
         Example
         -------
@@ -242,11 +285,6 @@ class KANLayer(nn.Module):
         >>> print(model.grid.data)
         '''
         
-        batch = x.shape[0]
-        
-        # shrink grid
-        x_pos = torch.sort(x, dim=0)[0]
-        y_eval = coef2curve(x_pos, parent.grid, parent.coef, parent.k)
         num_interval = self.grid.shape[1] - 1 - 2*self.k
         
         
@@ -265,7 +303,7 @@ class KANLayer(nn.Module):
         def get_grid(num_interval):
             x_pos = parent.grid[:,parent.k:-parent.k]
             #print('x_pos', x_pos)
-            sp2 = KANLayer(in_dim=1, out_dim=self.in_dim,k=1,num=x_pos.shape[1]-1,scale_base_mu=0.0, scale_base_sigma=0.0).to(x.device)
+            sp2 = KANLayer(in_dim=1, out_dim=self.in_dim,k=1,num=x_pos.shape[1]-1,scale_base_mu=0.0, scale_base_sigma=0.0).to(parent.grid.device)
 
             #print('sp2_grid', sp2.grid[:,sp2.k:-sp2.k].permute(1,0).expand(-1,self.in_dim))
             #print('sp2_coef_shape', sp2.coef.shape)
@@ -282,6 +320,20 @@ class KANLayer(nn.Module):
         
         grid = get_grid(num_interval)
         
+        if mode == 'exact':
+            grid = extend_grid(grid, k_extend=self.k)
+            coef = refine_coef(parent.grid, parent.coef, parent.k, grid) if parent.k == self.k else None
+            if coef == None:
+                return False
+            self.grid.data = grid
+            self.grid_uniform = is_uniform_grid(self.grid)
+            self.coef.data = coef
+            return True
+        
+        # shrink grid
+        x_pos = torch.sort(x, dim=0)[0]
+        y_eval = coef2curve(x_pos, parent.grid, parent.coef, parent.k)
+        
         if mode == 'grid':
             sample_grid = get_grid(2*num_interval)
             x_pos = sample_grid.permute(1,0)
@@ -289,6 +341,7 @@ class KANLayer(nn.Module):
         
         grid = extend_grid(grid, k_extend=self.k)
         self.grid.data = grid
+        self.grid_uniform = is_uniform_grid(self.grid)
         self.coef.data = curve2coef(x_pos, y_eval, self.grid, self.k)
 
     def get_subset(self, in_id, out_id):
@@ -313,8 +366,9 @@ class KANLayer(nn.Module):
         >>> kanlayer_small.in_dim, kanlayer_small.out_dim
         (2, 3)
         '''
-        spb = KANLayer(len(in_id), len(out_id), self.num, self.k, base_fun=self.base_fun)
+        spb = KANLayer(len(in_id), len(out_id), self.num, self.k, base_fun=self.base_fun, sparse_eval=self.sparse_eval, fused=self.fused)
         spb.grid.data = self.grid[in_id]
+        spb.grid_uniform = is_uniform_grid(spb.grid)
         spb.coef.data = self.coef[in_id][:,out_id]
         spb.scale_base.data = self.scale_base[in_id][:,out_id]
         spb.scale_sp.data = self.scale_sp[in_id][:,out_id]
@@ -362,3 +416,106 @@ class KANLayer(nn.Module):
             swap_(self.scale_sp.data, i1, i2, mode=mode)
             swap_(self.mask.data, i1, i2, mode=mode)
 
+    def to_poly(self, x=None):
+        '''
+        convert the splines to piecewise polynomials (see coef2poly), e.g. for inference with poly2curve
+        
+        Args:
+        -----
+            x : None or 2D torch.float
+                points on which the conversion error is measured, shape (batch, in_dim). If None, points evenly spaced in every knot interval.
+            
+        Returns:
+        --------
+            poly : 4D torch.float
+                shape (in_dim, number of knot intervals, k+1, out_dim)
+            max_error : float
+                maximum absolute difference between poly2curve and coef2curve
+            
+        Example
+        -------
+        >>> from kan.KANLayer import *
+        >>> model = KANLayer(in_dim=3, out_dim=2, num=5, k=3)
+        >>> poly, max_error = model.to_poly()
+        >>> poly.shape
+        torch.Size([3, 11, 4, 2])
+        '''
+        with torch.no_grad():
+            poly = coef2poly(self.grid, self.coef, self.k)
+            max_error = poly_error(self.grid, self.coef, self.k, poly, x_eval=x)
+        return poly, max_error
+
+
+class KANLayerFunction(torch.autograd.Function):
+    '''
+    fused KANLayer: y = sum_i mask * (scale_base * b(x) + scale_sp * spline(x)).
+    Only x and the parameters are saved for backward; the k+1 local bases (and their derivatives) are recomputed there.
+
+    Example
+    -------
+    >>> from kan.KANLayer import *
+    >>> layer = KANLayer(in_dim=3, out_dim=5)
+    >>> x = torch.normal(0,1,size=(100,3))
+    >>> y = KANLayerFunction.apply(x, layer.grid, layer.coef, layer.scale_base, layer.scale_sp, layer.mask, layer.k, layer.base_fun, layer.grid_uniform)
+    >>> y.shape
+    torch.Size([100, 5])
+    '''
+    @staticmethod
+    def forward(ctx, x, grid, coef, scale_base, scale_sp, mask, k, base_fun, uniform):
+        ctx.save_for_backward(x, grid, coef, scale_base, scale_sp, mask)
+        ctx.k = k
+        ctx.base_fun = base_fun
+        ctx.uniform = uniform
+
+        base = base_fun(x)
+        if uniform:
+            values, idx = B_batch_uniform(x, grid, k=k)
+        else:
+            values, idx = B_batch_local(x, grid, k=k)
+        y = base @ (mask * scale_base) + torch.einsum('bio,io->bo', local2curve(values, idx, coef, k), mask * scale_sp)
+        return y
+
+    @staticmethod
+    @torch.autograd.function.once_differentiable
+    def backward(ctx, grad_y):
+        x, grid, coef, scale_base, scale_sp, mask = ctx.saved_tensors
+        k = ctx.k
+        batch, in_dim = x.shape
+        out_dim = coef.shape[1]
+        n_coef = coef.shape[2]
+
+        if ctx.uniform:
+            values, idx, dvalues = B_batch_uniform(x, grid, k=k, derivative=True)
+        else:
+            values, idx, dvalues = B_batch_local(x, grid, k=k, derivative=True)
+        basis_id = torch.clamp(idx[:,:,None] - k + torch.arange(k+1, device=x.device)[None,None,:], 0, n_coef-1)
+        coef_active = coef.permute(0,2,1)[torch.arange(in_dim, device=x.device)[None,:,None], basis_id] # (batch, in_dim, k+1, out_dim)
+
+        w = grad_y[:,None,:] * (mask * scale_sp)[None,:,:] # (batch, in_dim, out_dim)
+
+        grad_x = grad_coef = grad_scale_base = grad_scale_sp = None
+        if ctx.needs_input_grad[0]:
+            # residual branch; b'(x) comes from autograd so that any base_fun works
+            with torch.enable_grad():
+                x_ = x.detach().requires_grad_(True)
+                grad_x = torch.autograd.grad(ctx.base_fun(x_), x_, grad_y @ (mask * scale_base).permute(1,0))[0]
+            # spline branch
+            grad_x = grad_x + torch.einsum('bir,biro,bio->bi', dvalues, coef_active, w)
+        if ctx.needs_input_grad[2]:
+            flat_id = (torch.arange(in_dim, device=x.device)[None,:,None] * n_coef + basis_id).reshape(-1)
+            contrib = (values[:,:,:,None] * w[:,:,None,:]).reshape(-1, out_dim)
+            grad_coef = torch.zeros(in_dim * n_coef, out_dim, device=x.device, dtype=x.dtype).index_add_(0, flat_id, contrib)
+            grad_coef = grad_coef.reshape(in_dim, n_coef, out_dim).permute(0,2,1)
+        if ctx.needs_input_grad[3]:
+            grad_scale_base = mask * (ctx.base_fun(x).permute(1,0) @ grad_y)
+        if ctx.needs_input_grad[4]:
+            grad_scale_sp = mask * torch.einsum('bir,biro,bo->io', values, coef_active, grad_y)
+
+        return grad_x, None, grad_coef, grad_scale_base, grad_scale_sp, None, None, None, None
+
+
+def update_grid_uniform(layer, incompatible_keys):
+    '''
+    load_state_dict post hook of KANLayer: the loaded grid may differ from the one at construction, so grid_uniform is recomputed
+    '''
+    layer.grid_uniform = is_uniform_grid(layer.grid)
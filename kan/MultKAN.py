@@ -7,19 +7,48 @@ from .Symbolic_KANLayer import Symbolic_KANLayer
 from .LBFGS import *
 import os
 import glob
-import matplotlib.pyplot as plt
-from tqdm import tqdm
 import random
 import copy
+import re
 #from .MultKANLayer import MultKANLayer
-import pandas as pd
-from sympy.printing import latex
-from sympy import *
-import sympy
-import yaml
 from .spline import curve2coef
-from .utils import SYMBOLIC_LIB
-from .hypothesis import plot_tree
+from .utils import SYMBOLIC_LIB, BatchLoader, FitCache, LazyModule, QuantileSketch, fit_params_batch, fit_params_parallel
+from . import checkpoint
+from .export import KANInference
+
+# plotting, symbolic and tabular dependencies are only loaded when first used
+plt = LazyModule('matplotlib.pyplot')
+pd = LazyModule('pandas')
+sympy = LazyModule('sympy')
+
+
+class ActCapture:
+    '''
+    activation capture policy of MultKAN.forward (only used when save_act=True)
+
+    Attributes:
+    -----------
+        mode : str
+            'none': nothing is captured.
+            'stats': acts, acts_premult and the std statistics (acts_scale, acts_scale_spline, edge_actscale, subnode_actscale) used by reg() and attribute() are kept, but not the 3D tensors.
+                This bounds what stays on the model after forward to 2D tensors; it does not lower the peak memory of forward itself,
+                since each layer still runs unfused and builds its (batch, out_dim, in_dim) activations to reduce them to the std statistics.
+            'full': additionally keeps spline_preacts, spline_postacts and spline_postsplines (needed by plot(), fix_symbolic(), get_range(), get_fun()).
+        max_samples : None or int
+            if not None, the 3D tensors of 'full' mode are kept for at most max_samples (evenly spaced) samples. Statistics always use the whole batch.
+
+    Example
+    -------
+    >>> from kan import *
+    >>> model = KAN(width=[2,5,1], grid=5, k=3, seed=0)
+    >>> model.act_capture = ActCapture(mode='full', max_samples=1000)
+    '''
+    def __init__(self, mode='full', max_samples=None):
+        if mode not in ['none', 'stats', 'full']:
+            raise Exception(f'act capture mode {mode} not recognized')
+        self.mode = mode
+        self.max_samples = max_samples
+
 
 class MultKAN(nn.Module):
     '''
@@ -73,6 +102,10 @@ class MultKAN(nn.Module):
             indicate whether the overall magnitude of base function is trainable
         save_act : bool
             indicate whether intermediate activations are saved in forward pass
+        act_capture : ActCapture
+            what is saved when save_act=True. Default: ActCapture('full') (everything, for all samples)
+        fit_cache : FitCache
+            LRU cache of symbolic fits used by fit_symbolic_batch (hence suggest_symbolic and auto_symbolic)
         node_scores : None or list of 1D torch.float
             node attribution score
         edge_scores : None or list of 2D torch.float
@@ -92,8 +125,12 @@ class MultKAN(nn.Module):
         round : int
             the number of times rewind() has been called
         device : str
+        ckpt_format : str
+            checkpoint format, 'files', 'objects' or 'single' (see kan.checkpoint.write_checkpoint)
+        fused : None or bool
+            whether forward evaluates the layers with KANLayerFunction when no activations are captured (see __init__)
     '''
-    def __init__(self, width=None, grid=3, k=3, mult_arity = 2, noise_scale=0.3, scale_base_mu=0.0, scale_base_sigma=1.0, base_fun='silu', symbolic_enabled=True, affine_trainable=False, grid_eps=0.02, grid_range=[-1, 1], sp_trainable=True, sb_trainable=True, seed=1, save_act=True, sparse_init=False, auto_save=True, first_init=True, ckpt_path='./model', state_id=0, round=0, device='cpu'):
+    def __init__(self, width=None, grid=3, k=3, mult_arity = 2, noise_scale=0.3, scale_base_mu=0.0, scale_base_sigma=1.0, base_fun='silu', symbolic_enabled=True, affine_trainable=False, grid_eps=0.02, grid_range=[-1, 1], sp_trainable=True, sb_trainable=True, seed=1, save_act=True, sparse_init=False, auto_save=True, first_init=True, ckpt_path='./model', state_id=0, round=0, device='cpu', ckpt_format='files', fused=None):
         '''
         initalize a KAN model
         
@@ -141,6 +178,15 @@ class MultKAN(nn.Module):
             round : int
                 the number of times rewind() has been called
             device : str
+            ckpt_format : str
+                'files': every checkpoint is a config file, a state file and a cache data file.
+                'objects': tensors are stored by content in {ckpt_path}/objects, so unchanged tensors are shared across versions (see prune_ckpt).
+                'single': every checkpoint is a single file, whose tensors are memory-mapped lazily when loaded. Default: 'files'.
+            fused : None or bool
+                If True, forward evaluates the spline layers with the fused KANLayerFunction, which keeps no 3D activations for backward.
+                Fused layers do not produce preacts/postacts, so they run unfused whenever activations are captured
+                (save_act=True and act_capture.mode != 'none'), including the 'stats' capture fit uses for reg() when lamb > 0.
+                If None, each layer's own fused attribute decides. Default: None.
             
         Returns:
         --------
@@ -252,6 +298,8 @@ class MultKAN(nn.Module):
         self.sb_trainable = sb_trainable
         
         self.save_act = save_act
+        self.act_capture = ActCapture()
+        self.fit_cache = FitCache()
             
         self.node_scores = None
         self.edge_scores = None
@@ -259,10 +307,16 @@ class MultKAN(nn.Module):
         
         self.cache_data = None
         self.acts = None
+        # filled by forward (see ActCapture); empty until the first forward pass
+        self.spline_preacts = []
+        self.spline_postsplines = []
+        self.spline_postacts = []
         
         self.auto_save = auto_save
         self.state_id = 0
         self.ckpt_path = ckpt_path
+        self.ckpt_format = ckpt_format
+        self.fused = fused
         self.round = round
         
         self.device = device
@@ -277,10 +331,8 @@ class MultKAN(nn.Module):
                 print('saving model version 0.0')
 
                 history_path = self.ckpt_path+'/history.txt'
-                with open(history_path, 'w') as file:
-                    file.write(f'### Round {self.round} ###' + '\n')
-                    file.write('init => 0.0' + '\n')
-                self.saveckpt(path=self.ckpt_path+'/'+'0.0')
+                checkpoint.writer.append(history_path, f'### Round {self.round} ###' + '\n' + 'init => 0.0' + '\n', 'w')
+                self.saveckpt(path=self.ckpt_path+'/'+'0.0', asynchronous=True)
             else:
                 self.state_id = state_id
             
@@ -366,15 +418,19 @@ class MultKAN(nn.Module):
         else:
             return self.node_scores[0]
 
-    def initialize_from_another_model(self, another_model, x):
+    def initialize_from_another_model(self, another_model, x, exact=False):
         '''
-        initialize from another model of the same width, but their 'grid' parameter can be different. 
+        initialize from another model of the same width, but their 'grid' parameter can be different.
         Note this is equivalent to refine() when we don't want to keep another_model
-        
+
         Args:
         -----
             another_model : MultKAN
             x : 2D torch.float
+                inputs used to fit the splines on the new grids (not needed if the exact refinement applies)
+            exact : bool
+                if True and the grids are nested (e.g. 5 -> 10 -> 20), the spline coefficients are computed exactly
+                by knot insertion, without forward pass or least squares. Otherwise falls back to fitting on x.
 
         Returns:
         --------
@@ -388,19 +444,26 @@ class MultKAN(nn.Module):
         >>> x = torch.rand(100,2)
         >>> model2.initialize_from_another_model(model1, x)
         '''
-        another_model(x)  # get activations
-        batch = x.shape[0]
+        if exact:
+            exact = all([self.act_fun[l].initialize_grid_from_parent(another_model.act_fun[l], None, mode='exact') for l in range(self.depth)])
+            if not exact:
+                print('grids are not nested, refining splines by least squares on samples instead')
 
-        self.initialize_grid_from_another_model(another_model, x)
+        if not exact:
+            act_capture = another_model.act_capture
+            another_model.act_capture = ActCapture('full')
+            another_model(x)  # get activations
+            another_model.act_capture = act_capture
 
-        for l in range(self.depth):
-            spb = self.act_fun[l]
-            #spb_parent = another_model.act_fun[l]
+            self.initialize_grid_from_another_model(another_model, x)
 
-            # spb = spb_parent
-            preacts = another_model.spline_preacts[l]
-            postsplines = another_model.spline_postsplines[l]
-            self.act_fun[l].coef.data = curve2coef(preacts[:,0,:], postsplines.permute(0,2,1), spb.grid, k=spb.k)
+            for l in range(self.depth):
+                spb = self.act_fun[l]
+                preacts = another_model.spline_preacts[l]
+                postsplines = another_model.spline_postsplines[l]
+                self.act_fun[l].coef.data = curve2coef(preacts[:,0,:], postsplines.permute(0,2,1), spb.grid, k=spb.k)
+
+        for l in range(self.depth):
             self.act_fun[l].scale_base.data = another_model.act_fun[l].scale_base.data
             self.act_fun[l].scale_sp.data = another_model.act_fun[l].scale_sp.data
             self.act_fun[l].mask.data = another_model.act_fun[l].mask.data
@@ -421,27 +484,31 @@ class MultKAN(nn.Module):
 
         if self.auto_save:
 
-            # save to log file
+            # save to log file (history and checkpoint are written in the background, see kan.checkpoint)
             #print(func.__name__)
-            with open(self.ckpt_path+'/history.txt', 'a') as file:
-                file.write(str(self.round)+'.'+str(self.state_id)+' => '+ method_name + ' => ' + str(self.round)+'.'+str(self.state_id+1) + '\n')
+            checkpoint.writer.append(self.ckpt_path+'/history.txt', str(self.round)+'.'+str(self.state_id)+' => '+ method_name + ' => ' + str(self.round)+'.'+str(self.state_id+1) + '\n')
 
             # update state_id
             self.state_id += 1
 
             # save to ckpt
-            self.saveckpt(path=self.ckpt_path+'/'+str(self.round)+'.'+str(self.state_id))
+            self.saveckpt(path=self.ckpt_path+'/'+str(self.round)+'.'+str(self.state_id), asynchronous=True)
             print('saving model version '+str(self.round)+'.'+str(self.state_id))
 
     
-    def refine(self, new_grid):
+    def refine(self, new_grid, exact=False):
         '''
         grid refinement
-        
+
         Args:
         -----
             new_grid : init
                 the number of grid intervals after refinement
+            exact : bool
+                if True, refine by knot insertion when new_grid is a multiple of the current grid: no forward pass
+                and no least squares, and the refined splines equal the old ones on the grid range (activations
+                outside the grid range are better served by exact=False, which fits them on cache_data).
+                Falls back to the least squares refinement when the grids are not nested.
 
         Returns:
         --------
@@ -480,9 +547,11 @@ class MultKAN(nn.Module):
                      first_init=False,
                      state_id=self.state_id,
                      round=self.round,
-                     device=self.device)
+                     device=self.device,
+                     ckpt_format=self.ckpt_format,
+                     fused=self.fused)
             
-        model_new.initialize_from_another_model(self, self.cache_data)
+        model_new.initialize_from_another_model(self, self.cache_data, exact=exact)
         model_new.cache_data = self.cache_data
         model_new.grid = new_grid
         
@@ -492,28 +561,24 @@ class MultKAN(nn.Module):
         return model_new.to(self.device)
     
     
-    def saveckpt(self, path='model'):
+    def get_config(self):
         '''
-        save the current model to files (configuration file and state file)
+        configuration of the model (everything needed besides the state dict and cache_data to rebuild it)
         
         Args:
         -----
-            path : str
-                the path where checkpoints are saved
+            None
 
         Returns:
         --------
-            None
+            config : dict
             
         Example
         -------
         >>> from kan import *
-        >>> device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         >>> model = KAN(width=[2,5,1], grid=5, k=3, seed=0)
-        >>> model.saveckpt('./mark')
-        # There will be three files appearing in the current folder: mark_cache_data, mark_config.yml, mark_state
+        >>> model.get_config()['width']
         '''
-    
         model = self
         
         dic = dict(
@@ -532,7 +597,9 @@ class MultKAN(nn.Module):
             auto_save = model.auto_save,
             ckpt_path = model.ckpt_path,
             round = model.round,
-            device = str(model.device)
+            device = str(model.device),
+            ckpt_format = model.ckpt_format,
+            fused = model.fused
         )
         
         if dic["device"].isdigit():
@@ -540,12 +607,45 @@ class MultKAN(nn.Module):
 
         for i in range (model.depth):
             dic[f'symbolic.funs_name.{i}'] = model.symbolic_fun[i].funs_name
+            
+        return dic
+    
+    def saveckpt(self, path='model', asynchronous=False):
+        '''
+        save the current model to files, in the format self.ckpt_format:
+        'files' (configuration file, state file and cache data file), 'objects' (a manifest, tensors stored by content in the objects/ folder)
+        or 'single' (one file {path}.kan), see kan.checkpoint.write_checkpoint
+        
+        Args:
+        -----
+            path : str
+                the path where checkpoints are saved
+            asynchronous : bool
+                if True, tensors are copied to cpu and the files are written by a background thread (see kan.checkpoint.flush);
+                otherwise the files are written before returning
 
-        with open(f'{path}_config.yml', 'w') as outfile:
-            yaml.dump(dic, outfile, default_flow_style=False)
+        Returns:
+        --------
+            None
+            
+        Example
+        -------
+        >>> from kan import *
+        >>> device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        >>> model = KAN(width=[2,5,1], grid=5, k=3, seed=0)
+        >>> model.saveckpt('./mark')
+        # There will be three files appearing in the current folder: mark_cache_data, mark_config.yml, mark_state
+        # (with ckpt_format='single', one file mark.kan)
+        '''
+    
+        model = self
+        dic = model.get_config()
 
-        torch.save(model.state_dict(), f'{path}_state')
-        torch.save(model.cache_data, f'{path}_cache_data')
+        if asynchronous:
+            checkpoint.writer.save(path, dic, model.state_dict(), model.cache_data, model.ckpt_format)
+        else:
+            checkpoint.flush()
+            checkpoint.write_checkpoint(path, dic, model.state_dict(), model.cache_data, model.ckpt_format)
     
     @staticmethod
     def loadckpt(path='model'):
@@ -568,11 +668,35 @@ class MultKAN(nn.Module):
         >>> model.saveckpt('./mark')
         >>> KAN.loadckpt('./mark')
         '''
-        with open(f'{path}_config.yml', 'r') as stream:
-            config = yaml.safe_load(stream)
-
-        state = torch.load(f'{path}_state')
+        checkpoint.flush()
+        config, state, cache_data = checkpoint.read_checkpoint(path)
+        return MultKAN.from_config(config, state, cache_data)
+    
+    @staticmethod
+    def from_config(config, state, cache_data=None):
+        '''
+        build a model from a configuration (see get_config), a state dict and cache data. The round number is incremented.
+        
+        Args:
+        -----
+            config : dict
+                configuration, as returned by get_config
+            state : dict
+                state dict; its tensors are copied into the new model
+            cache_data : None or 2D torch.float
+                cache data (shared, not copied)
 
+        Returns:
+        --------
+            MultKAN
+            
+        Example
+        -------
+        >>> from kan import *
+        >>> model = KAN(width=[2,5,1], grid=5, k=3, seed=0)
+        >>> model2 = KAN.from_config(model.get_config(), model.state_dict(), model.cache_data)
+        '''
+        config = copy.deepcopy(config)
         model_load = MultKAN(width=config['width'], 
                      grid=config['grid'], 
                      k=config['k'], 
@@ -589,10 +713,12 @@ class MultKAN(nn.Module):
                      first_init=False,
                      ckpt_path=config['ckpt_path'],
                      round = config['round']+1,
-                     device = config['device'])
+                     device = config['device'],
+                     ckpt_format = config.get('ckpt_format', 'files'),
+                     fused = config.get('fused', None))
 
         model_load.load_state_dict(state)
-        model_load.cache_data = torch.load(f'{path}_cache_data')
+        model_load.cache_data = cache_data
         
         depth = len(model_load.width) - 1
         for l in range(depth):
@@ -602,20 +728,25 @@ class MultKAN(nn.Module):
             for j in range(out_dim):
                 for i in range(in_dim):
                     fun_name = funs_name[j][i]
+                    if fun_name == '0':
+                        # a new layer already has zero functions everywhere
+                        continue
                     model_load.symbolic_fun[l].funs_name[j][i] = fun_name
                     model_load.symbolic_fun[l].funs[j][i] = SYMBOLIC_LIB[fun_name][0]
                     model_load.symbolic_fun[l].funs_sympy[j][i] = SYMBOLIC_LIB[fun_name][1]
                     model_load.symbolic_fun[l].funs_avoid_singularity[j][i] = SYMBOLIC_LIB[fun_name][3]
+            model_load.symbolic_fun[l].invalidate_plan()
         return model_load
     
     def copy(self):
         '''
-        deepcopy
+        deepcopy, in memory (no checkpoint files are written). Parameters and buffers are copied, cache_data is shared
+        (it is only ever replaced, never modified in place), symbolic functions are rebuilt from their names.
+        As with a checkpoint round trip, the copy starts a new round and carries no saved activations.
         
         Args:
         -----
-            path : str
-                the path where checkpoints are saved
+            None
 
         Returns:
         --------
@@ -630,9 +761,9 @@ class MultKAN(nn.Module):
         >>> print(model2.act_fun[0].coef.data)
         >>> print(model.act_fun[0].coef.data)
         '''
-        path='copy_temp'
-        self.saveckpt(path)
-        return KAN.loadckpt(path)
+        model_new = MultKAN.from_config(self.get_config(), self.state_dict(), self.cache_data)
+        model_new.input_id = self.input_id.clone()
+        return model_new
     
     def rewind(self, model_id):
         '''
@@ -655,10 +786,9 @@ class MultKAN(nn.Module):
         self.state_id = model_id.split('.')[-1]
         
         history_path = self.ckpt_path+'/history.txt'
-        with open(history_path, 'a') as file:
-            file.write(f'### Round {self.round} ###' + '\n')
+        checkpoint.writer.append(history_path, f'### Round {self.round} ###' + '\n')
 
-        self.saveckpt(path=self.ckpt_path+'/'+f'{self.round}.{self.state_id}')
+        self.saveckpt(path=self.ckpt_path+'/'+f'{self.round}.{self.state_id}', asynchronous=True)
         
         print('rewind to model version '+f'{self.round-1}.{self.state_id}'+', renamed as '+f'{self.round}.{self.state_id}')
 
@@ -684,14 +814,48 @@ class MultKAN(nn.Module):
         ''' 
         return MultKAN.loadckpt(path=self.ckpt_path+'/'+str(model_id))
     
+    def prune_ckpt(self, keep=None):
+        '''
+        delete checkpoints of versions that are no longer needed, and the objects (ckpt_format='objects') that no remaining version refers to
+        
+        Args:
+        -----
+            keep : None or list of str
+                model ids ('{a}.{b}') whose checkpoints are kept; the current version is always kept.
+                If None, all versions are kept and only unreferenced objects are deleted.
+
+        Returns:
+        --------
+            n_removed : int
+                number of deleted object files
+            
+        Example
+        -------
+        >>> from kan import *
+        >>> model = KAN(width=[2,5,1], grid=5, k=3, seed=0, ckpt_format='objects')
+        >>> model.prune()
+        >>> model.prune_ckpt(keep=['0.0'])
+        >>> model.checkout('0.0')
+        '''
+        checkpoint.flush()
+        if keep != None:
+            keep = set(keep) | set([f'{self.round}.{self.state_id}'])
+            suffixes = ['_config.yml', '_state', '_cache_data', '_manifest.yml', '.kan']
+            for name in os.listdir(self.ckpt_path):
+                for suffix in suffixes:
+                    if name.endswith(suffix) and name[:-len(suffix)] not in keep and re.fullmatch(r'\d+\.\d+', name[:-len(suffix)]):
+                        os.remove(os.path.join(self.ckpt_path, name))
+        return checkpoint.prune_objects(self.ckpt_path)
+    
     def update_grid_from_samples(self, x):
         '''
         update grid from samples
         
         Args:
         -----
-            x : 2D torch.tensor
-                inputs
+            x : 2D torch.tensor or None
+                inputs. If None, every layer reads its knots from the quantile sketch of its inputs 
+                (KANLayer.sketch, e.g. attached by fit(grid_sketch=True)) and no forward pass is needed.
 
         Returns:
         --------
@@ -707,10 +871,13 @@ class MultKAN(nn.Module):
         >>> print(model.act_fun[0].grid)
         ''' 
         for l in range(self.depth):
-            self.get_act(x)
-            self.act_fun[l].update_grid_from_samples(self.acts[l])
+            if x == None:
+                self.act_fun[l].update_grid_from_samples(None)
+            else:
+                self.get_act(x)
+                self.act_fun[l].update_grid_from_samples(self.acts[l])
             
-    def update_grid(self, x):
+    def update_grid(self, x=None):
         '''
         call update_grid_from_samples. This seems unnecessary but we retain it for the sake of classes that might inherit from MultKAN
         '''
@@ -797,13 +964,22 @@ class MultKAN(nn.Module):
         # self.neurons_scale = []
 
         self.acts.append(x)  # acts shape: (batch, width[l])
+        
+        capture = self.act_capture.mode if self.save_act else 'none'
+        if capture == 'full' and self.act_capture.max_samples != None and x.shape[0] > self.act_capture.max_samples:
+            # evenly spaced subsample for the 3D tensors
+            sample_id = torch.linspace(0, x.shape[0]-1, steps=self.act_capture.max_samples, device=x.device).long()
+        else:
+            sample_id = slice(None)
 
         for l in range(self.depth):
             
-            x_numerical, preacts, postacts_numerical, postspline = self.act_fun[l](x)
+            # saved activations need preacts/postacts, which the fused path does not produce
+            x_numerical, preacts, postacts_numerical, postspline = self.act_fun[l](x, fused=False if capture != 'none' else self.fused)
             #print(preacts, postacts_numerical, postspline)
             
-            if self.symbolic_enabled == True:
+            # layers without active symbolic edges are skipped
+            if self.symbolic_enabled == True and len(self.symbolic_fun[l].get_plan()) > 0:
                 x_symbolic, postacts_symbolic = self.symbolic_fun[l](x, singularity_avoiding=singularity_avoiding, y_th=y_th)
             else:
                 x_symbolic = 0.
@@ -811,29 +987,32 @@ class MultKAN(nn.Module):
 
             x = x_numerical + x_symbolic
             
-            if self.save_act:
+            if capture != 'none':
                 # save subnode_scale
                 self.subnode_actscale.append(torch.std(x, dim=0).detach())
             
             # subnode affine transform
             x = self.subnode_scale[l][None,:] * x + self.subnode_bias[l][None,:]
             
-            if self.save_act:
-                postacts = postacts_numerical + postacts_symbolic
-
-                # self.neurons_scale.append(torch.mean(torch.abs(x), dim=0))
-                #grid_reshape = self.act_fun[l].grid.reshape(self.width_out[l + 1], self.width_in[l], -1)
-                input_range = torch.std(preacts, dim=0) + 0.1
+            if capture != 'none':
+                # preacts is x expanded over the outputs, so its std is the std of x
+                input_range = (torch.std(preacts[:,0,:], dim=0) + 0.1)[None,:].expand_as(preacts[0])
                 output_range_spline = torch.std(postacts_numerical, dim=0) # for training, only penalize the spline part
-                output_range = torch.std(postacts, dim=0) # for visualization, include the contribution from both spline + symbolic
+                if isinstance(postacts_symbolic, torch.Tensor):
+                    postacts = postacts_numerical + postacts_symbolic
+                    output_range = torch.std(postacts, dim=0) # for visualization, include the contribution from both spline + symbolic
+                else:
+                    postacts = postacts_numerical
+                    output_range = output_range_spline
                 # save edge_scale
                 self.edge_actscale.append(output_range)
                 
                 self.acts_scale.append((output_range / input_range).detach())
                 self.acts_scale_spline.append(output_range_spline / input_range)
-                self.spline_preacts.append(preacts.detach())
-                self.spline_postacts.append(postacts.detach())
-                self.spline_postsplines.append(postspline.detach())
+                if capture == 'full':
+                    self.spline_preacts.append(preacts[sample_id].detach())
+                    self.spline_postacts.append(postacts[sample_id].detach())
+                    self.spline_postsplines.append(postspline[sample_id].detach())
 
                 self.acts_premult.append(x.detach())
             
@@ -947,7 +1126,9 @@ class MultKAN(nn.Module):
             self.symbolic_fun[l].fix_symbolic(i, j, fun_name, verbose=verbose, random=random)
             r2 = None
         else:
-            x = self.acts[l][:, i]
+            if len(self.spline_postacts) == 0:
+                raise Exception("activations are not saved. Set act_capture=ActCapture('full') and do a forward pass first")
+            x = self.spline_preacts[l][:, j, i]
             mask = self.act_fun[l].mask
             y = self.spline_postacts[l][:, j, i]
             #y = self.postacts[l][:, j, i]
@@ -1068,6 +1249,10 @@ class MultKAN(nn.Module):
                 raise Exception('model hasn\'t seen any data yet.')
             self.forward(self.cache_data)
             
+        if len(self.spline_postacts) == 0:
+            print('cannot plot since activations are not saved. Set act_capture=ActCapture(\'full\') first.')
+            return
+            
         if metric == 'backward':
             self.attribute()
             
@@ -1080,7 +1265,7 @@ class MultKAN(nn.Module):
             w_large = 2.0
             for i in range(self.width_in[l]):
                 for j in range(self.width_out[l+1]):
-                    rank = torch.argsort(self.acts[l][:, i])
+                    rank = torch.argsort(self.spline_preacts[l][:, j, i])
                     fig, ax = plt.subplots(figsize=(w_large, w_large))
 
                     num = rank.shape[0]
@@ -1119,9 +1304,9 @@ class MultKAN(nn.Module):
                     plt.gca().patch.set_linewidth(1.5)
                     # plt.axis('off')
 
-                    plt.plot(self.acts[l][:, i][rank].cpu().detach().numpy(), self.spline_postacts[l][:, j, i][rank].cpu().detach().numpy(), color=color, lw=5)
+                    plt.plot(self.spline_preacts[l][:, j, i][rank].cpu().detach().numpy(), self.spline_postacts[l][:, j, i][rank].cpu().detach().numpy(), color=color, lw=5)
                     if sample == True:
-                        plt.scatter(self.acts[l][:, i][rank].cpu().detach().numpy(), self.spline_postacts[l][:, j, i][rank].cpu().detach().numpy(), color=color, s=400 * scale ** 2)
+                        plt.scatter(self.spline_preacts[l][:, j, i][rank].cpu().detach().numpy(), self.spline_postacts[l][:, j, i][rank].cpu().detach().numpy(), color=color, s=400 * scale ** 2)
                     plt.gca().spines[:].set_color(color)
 
                     plt.savefig(f'{folder}/sp_{l}_{i}_{j}.png', bbox_inches="tight", dpi=400)
@@ -1291,7 +1476,7 @@ class MultKAN(nn.Module):
             n = self.width_in[0]
             for i in range(n):
                 if isinstance(in_vars[i], sympy.Expr):
-                    plt.gcf().get_axes()[0].text(1 / (2 * (n)) + i / (n), -0.1, f'${latex(in_vars[i])}$', fontsize=40 * scale * varscale, horizontalalignment='center', verticalalignment='center')
+                    plt.gcf().get_axes()[0].text(1 / (2 * (n)) + i / (n), -0.1, f'${sympy.latex(in_vars[i])}$', fontsize=40 * scale * varscale, horizontalalignment='center', verticalalignment='center')
                 else:
                     plt.gcf().get_axes()[0].text(1 / (2 * (n)) + i / (n), -0.1, in_vars[i], fontsize=40 * scale * varscale, horizontalalignment='center', verticalalignment='center')
                 
@@ -1301,7 +1486,7 @@ class MultKAN(nn.Module):
             n = self.width_in[-1]
             for i in range(n):
                 if isinstance(out_vars[i], sympy.Expr):
-                    plt.gcf().get_axes()[0].text(1 / (2 * (n)) + i / (n), (y0+z0) * (len(self.width) - 1) + 0.15, f'${latex(out_vars[i])}$', fontsize=40 * scale * varscale, horizontalalignment='center', verticalalignment='center')
+                    plt.gcf().get_axes()[0].text(1 / (2 * (n)) + i / (n), (y0+z0) * (len(self.width) - 1) + 0.15, f'${sympy.latex(out_vars[i])}$', fontsize=40 * scale * varscale, horizontalalignment='center', verticalalignment='center')
                 else:
                     plt.gcf().get_axes()[0].text(1 / (2 * (n)) + i / (n), (y0+z0) * (len(self.width) - 1) + 0.15, out_vars[i], fontsize=40 * scale * varscale, horizontalalignment='center', verticalalignment='center')
 
@@ -1409,14 +1594,15 @@ class MultKAN(nn.Module):
         
             
     def fit(self, dataset, opt="LBFGS", steps=100, log=1, lamb=0., lamb_l1=1., lamb_entropy=2., lamb_coef=0., lamb_coefdiff=0., update_grid=True, grid_update_num=10, loss_fn=None, lr=1.,start_grid_update_step=-1, stop_grid_update_step=50, batch=-1,
-              metrics=None, save_fig=False, in_vars=None, out_vars=None, beta=3, save_fig_freq=1, img_folder='./video', singularity_avoiding=False, y_th=1000., reg_metric='edge_forward_spline_n', display_metrics=None):
+              metrics=None, save_fig=False, in_vars=None, out_vars=None, beta=3, save_fig_freq=1, img_folder='./video', singularity_avoiding=False, y_th=1000., reg_metric='edge_forward_spline_n', display_metrics=None, prefetch=2, grid_sketch=False):
         '''
         training
 
         Args:
         -----
             dataset : dic
-                contains dataset['train_input'], dataset['train_label'], dataset['test_input'], dataset['test_label']
+                contains dataset['train_input'], dataset['train_label'], dataset['test_input'], dataset['test_label'],
+                or dataset['train'], dataset['test'] as data sources of BatchLoader (e.g. torch.utils.data.Dataset, or iterables streaming shards from disk)
             opt : str
                 "LBFGS" or "Adam"
             steps : int
@@ -1424,7 +1610,7 @@ class MultKAN(nn.Module):
             log : int
                 logging frequency
             lamb : float
-                overall penalty strength
+                overall penalty strength. If lamb > 0, training steps capture the 'stats' activations for reg(), so the layers run unfused (see fused in __init__)
             lamb_l1 : float
                 l1 penalty strength
             lamb_entropy : float
@@ -1446,7 +1632,14 @@ class MultKAN(nn.Module):
             lr : float
                 learning rate
             batch : int
-                batch size, if -1 then full.
+                batch size, if -1 then full. Samples are reshuffled at every epoch.
+            prefetch : int
+                the number of batches prepared ahead in a background thread (see BatchLoader)
+            grid_sketch : bool
+                If True, grid updates read knot positions from streaming quantile sketches of the layer inputs 
+                (utils.QuantileSketch), fed by every training forward pass, instead of sorting the current batch. 
+                Grids then adapt to all training batches seen since the previous grid update, not just one. 
+                Meant for mini-batch training (e.g. opt="Adam", batch>0); with LBFGS the line search evaluations are fed too.
             save_fig_freq : int
                 save figure every (save_fig_freq) steps
             singularity_avoiding : bool
@@ -1483,7 +1676,11 @@ class MultKAN(nn.Module):
             print('setting lamb=0. If you want to set lamb > 0, set self.save_act=True')
             
         old_save_act, old_symbolic_enabled = self.disable_symbolic_in_fit(lamb)
+        # intermediate steps only need the statistics for reg(); 3D activations are captured on the last step (and for figures)
+        act_capture = self.act_capture
+        act_capture_stats = ActCapture('stats') if act_capture.mode == 'full' else act_capture
 
+        from tqdm import tqdm
         pbar = tqdm(range(steps), desc='description', ncols=100)
 
         if loss_fn == None:
@@ -1506,21 +1703,30 @@ class MultKAN(nn.Module):
             for i in range(len(metrics)):
                 results[metrics[i].__name__] = []
 
-        if batch == -1 or batch > dataset['train_input'].shape[0]:
-            batch_size = dataset['train_input'].shape[0]
-            batch_size_test = dataset['test_input'].shape[0]
+        if 'train' in dataset:
+            train_source, test_source = dataset['train'], dataset['test']
         else:
-            batch_size = batch
-            batch_size_test = batch
+            train_source = (dataset['train_input'], dataset['train_label'])
+            test_source = (dataset['test_input'], dataset['test_label'])
+        train_loader = BatchLoader(train_source, batch=batch, device=self.device, prefetch=prefetch)
+        test_loader = BatchLoader(test_source, batch=batch, device=self.device, prefetch=prefetch)
+
+        # sketches attached here are removed after training; sketches attached by the user are kept (and fed)
+        sketched = []
+        if grid_sketch and update_grid:
+            for layer in self.act_fun:
+                if layer.sketch == None:
+                    layer.sketch = QuantileSketch(layer.in_dim)
+                    sketched.append(layer)
 
         global train_loss, reg_
 
         def closure():
             global train_loss, reg_
             optimizer.zero_grad()
-            pred = self.forward(dataset['train_input'][train_id], singularity_avoiding=singularity_avoiding, y_th=y_th)
-            train_loss = loss_fn(pred, dataset['train_label'][train_id])
-            if self.save_act:
+            pred = self.forward(train_input, singularity_avoiding=singularity_avoiding, y_th=y_th)
+            train_loss = loss_fn(pred, train_label)
+            if self.save_act and self.act_capture.mode != 'none':
                 if reg_metric == 'edge_backward':
                     self.attribute()
                 if reg_metric == 'node_backward':
@@ -1536,76 +1742,99 @@ class MultKAN(nn.Module):
             if not os.path.exists(img_folder):
                 os.makedirs(img_folder)
 
-        for _ in pbar:
-            
-            if _ == steps-1 and old_save_act:
-                self.save_act = True
-                
-            if save_fig and _ % save_fig_freq == 0:
-                save_act = self.save_act
-                self.save_act = True
-            
-            train_id = np.random.choice(dataset['train_input'].shape[0], batch_size, replace=False)
-            test_id = np.random.choice(dataset['test_input'].shape[0], batch_size_test, replace=False)
-
-            if _ % grid_update_freq == 0 and _ < stop_grid_update_step and update_grid and _ >= start_grid_update_step:
-                self.update_grid(dataset['train_input'][train_id])
-
-            if opt == "LBFGS":
-                optimizer.step(closure)
-
-            if opt == "Adam":
-                pred = self.forward(dataset['train_input'][train_id], singularity_avoiding=singularity_avoiding, y_th=y_th)
-                train_loss = loss_fn(pred, dataset['train_label'][train_id])
-                if self.save_act:
-                    if reg_metric == 'edge_backward':
-                        self.attribute()
-                    if reg_metric == 'node_backward':
-                        self.node_attribute()
-                    reg_ = self.get_reg(reg_metric, lamb_l1, lamb_entropy, lamb_coef, lamb_coefdiff)
-                else:
-                    reg_ = torch.tensor(0.)
-                loss = train_loss + lamb * reg_
-                optimizer.zero_grad()
-                loss.backward()
-                optimizer.step()
-
-            test_loss = loss_fn_eval(self.forward(dataset['test_input'][test_id]), dataset['test_label'][test_id])
+        try:
+            for _ in pbar:
             
+                if _ == steps-1 and old_save_act:
+                    self.save_act = True
             
-            if metrics != None:
-                for i in range(len(metrics)):
-                    results[metrics[i].__name__].append(metrics[i]().item())
-
-            results['train_loss'].append(torch.sqrt(train_loss).cpu().detach().numpy())
-            results['test_loss'].append(torch.sqrt(test_loss).cpu().detach().numpy())
-            results['reg'].append(reg_.cpu().detach().numpy())
-
-            if _ % log == 0:
-                if display_metrics == None:
-                    pbar.set_description("| train_loss: %.2e | test_loss: %.2e | reg: %.2e | " % (torch.sqrt(train_loss).cpu().detach().numpy(), torch.sqrt(test_loss).cpu().detach().numpy(), reg_.cpu().detach().numpy()))
+                if _ == steps-1 or (save_fig and _ % save_fig_freq == 0):
+                    self.act_capture = act_capture
                 else:
-                    string = ''
-                    data = ()
-                    for metric in display_metrics:
-                        string += f' {metric}: %.2e |'
-                        try:
-                            results[metric]
-                        except:
-                            raise Exception(f'{metric} not recognized')
-                        data += (results[metric][-1],)
-                    pbar.set_description(string % data)
+                    self.act_capture = act_capture_stats
+                
+                if save_fig and _ % save_fig_freq == 0:
+                    save_act = self.save_act
+                    self.save_act = True
+            
+                train_input, train_label = next(train_loader)
+                test_input, test_label = next(test_loader)
+
+                if _ % grid_update_freq == 0 and _ < stop_grid_update_step and update_grid and _ >= start_grid_update_step:
+                    if grid_sketch and all([layer.sketch.count > 0 for layer in self.act_fun]):
+                        self.update_grid(None)
+                        # the next update only sees inputs of the updated model
+                        for layer in self.act_fun:
+                            layer.sketch.reset()
+                    else:
+                        self.update_grid(train_input)
+
+                if opt == "LBFGS":
+                    optimizer.step(closure)
+
+                if opt == "Adam":
+                    pred = self.forward(train_input, singularity_avoiding=singularity_avoiding, y_th=y_th)
+                    train_loss = loss_fn(pred, train_label)
+                    if self.save_act and self.act_capture.mode != 'none':
+                        if reg_metric == 'edge_backward':
+                            self.attribute()
+                        if reg_metric == 'node_backward':
+                            self.node_attribute()
+                        reg_ = self.get_reg(reg_metric, lamb_l1, lamb_entropy, lamb_coef, lamb_coefdiff)
+                    else:
+                        reg_ = torch.tensor(0.)
+                    loss = train_loss + lamb * reg_
+                    optimizer.zero_grad()
+                    loss.backward()
+                    optimizer.step()
+
+                # eval mode: test inputs are not fed to the grid sketches
+                training = self.training
+                self.eval()
+                test_loss = loss_fn_eval(self.forward(test_input), test_label)
+                self.train(training)
+            
+            
+                if metrics != None:
+                    for i in range(len(metrics)):
+                        results[metrics[i].__name__].append(metrics[i]().item())
+
+                results['train_loss'].append(torch.sqrt(train_loss).cpu().detach().numpy())
+                results['test_loss'].append(torch.sqrt(test_loss).cpu().detach().numpy())
+                results['reg'].append(reg_.cpu().detach().numpy())
+
+                if _ % log == 0:
+                    if display_metrics == None:
+                        pbar.set_description("| train_loss: %.2e | test_loss: %.2e | reg: %.2e | " % (torch.sqrt(train_loss).cpu().detach().numpy(), torch.sqrt(test_loss).cpu().detach().numpy(), reg_.cpu().detach().numpy()))
+                    else:
+                        string = ''
+                        data = ()
+                        for metric in display_metrics:
+                            string += f' {metric}: %.2e |'
+                            try:
+                                results[metric]
+                            except:
+                                raise Exception(f'{metric} not recognized')
+                            data += (results[metric][-1],)
+                        pbar.set_description(string % data)
                     
             
-            if save_fig and _ % save_fig_freq == 0:
-                self.plot(folder=img_folder, in_vars=in_vars, out_vars=out_vars, title="Step {}".format(_), beta=beta)
-                plt.savefig(img_folder + '/' + str(_) + '.jpg', bbox_inches='tight', dpi=200)
-                plt.close()
-                self.save_act = save_act
+                if save_fig and _ % save_fig_freq == 0:
+                    self.plot(folder=img_folder, in_vars=in_vars, out_vars=out_vars, title="Step {}".format(_), beta=beta)
+                    plt.savefig(img_folder + '/' + str(_) + '.jpg', bbox_inches='tight', dpi=200)
+                    plt.close()
+                    self.save_act = save_act
+        finally:
+            # stop the prefetch threads (and detach the grid sketches) even if training is interrupted
+            train_loader.close()
+            test_loader.close()
+            for layer in sketched:
+                layer.sketch = None
 
         self.log_history('fit')
         # revert back to original state
         self.symbolic_enabled = old_symbolic_enabled
+        self.act_capture = act_capture
         return results
 
     def prune_node(self, threshold=1e-2, mode="auto", active_neurons_id=None, log_history=True):
@@ -1703,7 +1932,7 @@ class MultKAN(nn.Module):
                 if i not in active_neurons_down[l]:
                     self.remove_node(l + 1, i, mode='down',log_history=False)
 
-        model2 = MultKAN(copy.deepcopy(self.width), grid=self.grid, k=self.k, base_fun=self.base_fun_name, mult_arity=self.mult_arity, ckpt_path=self.ckpt_path, auto_save=True, first_init=False, state_id=self.state_id, round=self.round).to(self.device)
+        model2 = MultKAN(copy.deepcopy(self.width), grid=self.grid, k=self.k, base_fun=self.base_fun_name, mult_arity=self.mult_arity, ckpt_path=self.ckpt_path, auto_save=True, first_init=False, state_id=self.state_id, round=self.round, ckpt_format=self.ckpt_format, fused=self.fused).to(self.device)
         model2.load_state_dict(self.state_dict())
         
         width_new = [self.width[0]]
@@ -1864,7 +2093,7 @@ class MultKAN(nn.Module):
         else:
             input_id = torch.tensor(active_inputs, dtype=torch.long).to(self.device)
         
-        model2 = MultKAN(copy.deepcopy(self.width), grid=self.grid, k=self.k, base_fun=self.base_fun, mult_arity=self.mult_arity, ckpt_path=self.ckpt_path, auto_save=True, first_init=False, state_id=self.state_id, round=self.round).to(self.device)
+        model2 = MultKAN(copy.deepcopy(self.width), grid=self.grid, k=self.k, base_fun=self.base_fun, mult_arity=self.mult_arity, ckpt_path=self.ckpt_path, auto_save=True, first_init=False, state_id=self.state_id, round=self.round, ckpt_format=self.ckpt_format, fused=self.fused).to(self.device)
         model2.load_state_dict(self.state_dict())
 
         model2.act_fun[0] = model2.act_fun[0].get_subset(input_id, torch.arange(self.width_out[1]))
@@ -1948,30 +2177,6 @@ class MultKAN(nn.Module):
         if self.acts == None:
             self.get_act()
 
-        def score_node2subnode(node_score, width, mult_arity, out_dim):
-
-            assert np.sum(width) == node_score.shape[1]
-            if isinstance(mult_arity, int):
-                n_subnode = width[0] + mult_arity * width[1]
-            else:
-                n_subnode = width[0] + int(np.sum(mult_arity))
-
-            #subnode_score_leaf = torch.zeros(out_dim, n_subnode).requires_grad_(True)
-            #subnode_score = subnode_score_leaf.clone()
-            #subnode_score[:,:width[0]] = node_score[:,:width[0]]
-            subnode_score = node_score[:,:width[0]]
-            if isinstance(mult_arity, int):
-                #subnode_score[:,width[0]:] = node_score[:,width[0]:][:,:,None].expand(out_dim, node_score[width[0]:].shape[0], mult_arity).reshape(out_dim,-1)
-                subnode_score = torch.cat([subnode_score, node_score[:,width[0]:][:,:,None].expand(out_dim, node_score[:,width[0]:].shape[1], mult_arity).reshape(out_dim,-1)], dim=1)
-            else:
-                acml = width[0]
-                for i in range(len(mult_arity)):
-                    #subnode_score[:, acml:acml+mult_arity[i]] = node_score[:, width[0]+i]
-                    subnode_score = torch.cat([subnode_score, node_score[:, width[0]+i].expand(out_dim, mult_arity[i])], dim=1)
-                    acml += mult_arity[i]
-            return subnode_score
-
-
         node_scores = []
         subnode_scores = []
         edge_scores = []
@@ -1990,26 +2195,10 @@ class MultKAN(nn.Module):
             node_score = torch.diag(out_score).requires_grad_(True)
         node_scores.append(node_score)
         
-        device = self.act_fun[0].grid.device
-
         for l in range(l_end,0,-1):
-
-            # node to subnode 
-            if isinstance(self.mult_arity, int):
-                subnode_score = score_node2subnode(node_score, self.width[l], self.mult_arity, out_dim=out_dim)
-            else:
-                mult_arity = self.mult_arity[l]
-                #subnode_score = score_node2subnode(node_score, self.width[l], mult_arity)
-                subnode_score = score_node2subnode(node_score, self.width[l], mult_arity, out_dim=out_dim)
-
+            subnode_score, edge_score, node_score = self.attribute_layer(node_score, l)
             subnode_scores.append(subnode_score)
-            # subnode to edge
-            #print(self.edge_actscale[l-1].device, subnode_score.device, self.subnode_actscale[l-1].device)
-            edge_score = torch.einsum('ij,ki,i->kij', self.edge_actscale[l-1], subnode_score.to(device), 1/(self.subnode_actscale[l-1]+1e-4))
             edge_scores.append(edge_score)
-
-            # edge to node
-            node_score = torch.sum(edge_score, dim=1)
             node_scores.append(node_score)
 
         self.node_scores_all = list(reversed(node_scores))
@@ -2035,11 +2224,108 @@ class MultKAN(nn.Module):
 
                 return self.node_scores_all[0][i]
             
+    def score_node2subnode(self, node_score, width, mult_arity, out_dim):
+        '''
+        copy node scores to subnodes (a multiplication node passes its score to each of its mult_arity subnodes)
+        
+        Args:
+        -----
+            node_score : 2D torch.float
+                shape (out_dim, number of nodes)
+            width : list of two ints
+                [number of sum nodes, number of mult nodes] of the layer
+            mult_arity : int or list of int
+                arity of the mult nodes
+            out_dim : int
+                number of rows of node_score
+                
+        Returns:
+        --------
+            subnode_score : 2D torch.float
+                shape (out_dim, number of subnodes)
+        '''
+        assert np.sum(width) == node_score.shape[1]
+        subnode_score = node_score[:,:width[0]]
+        if isinstance(mult_arity, int):
+            subnode_score = torch.cat([subnode_score, node_score[:,width[0]:][:,:,None].expand(out_dim, node_score[:,width[0]:].shape[1], mult_arity).reshape(out_dim,-1)], dim=1)
+        else:
+            for i in range(len(mult_arity)):
+                subnode_score = torch.cat([subnode_score, node_score[:, [width[0]+i]].expand(out_dim, mult_arity[i])], dim=1)
+        return subnode_score
+    
+    def attribute_layer(self, node_score, l):
+        '''
+        propagate attribution scores from the nodes of layer l to the nodes of layer l-1 (through subnodes and edges), 
+        using the cached edge_actscale and subnode_actscale
+        
+        Args:
+        -----
+            node_score : 2D torch.float
+                shape (number of queries, width_in[l])
+            l : int
+                layer index, 1 <= l <= depth
+                
+        Returns:
+        --------
+            subnode_score : 2D torch.float
+                shape (number of queries, number of subnodes of layer l)
+            edge_score : 3D torch.float
+                shape (number of queries, number of subnodes of layer l, width_in[l-1])
+            node_score : 2D torch.float
+                shape (number of queries, width_in[l-1])
+        '''
+        out_dim = node_score.shape[0]
+        mult_arity = self.mult_arity if isinstance(self.mult_arity, int) else self.mult_arity[l]
+        # node to subnode
+        subnode_score = self.score_node2subnode(node_score, self.width[l], mult_arity, out_dim=out_dim)
+        # subnode to edge
+        device = self.act_fun[0].grid.device
+        edge_score = torch.einsum('ij,ki,i->kij', self.edge_actscale[l-1], subnode_score.to(device), 1/(self.subnode_actscale[l-1]+1e-4))
+        # edge to node
+        node_score = torch.sum(edge_score, dim=1)
+        return subnode_score, edge_score, node_score
+            
     def node_attribute(self):
+        '''
+        attribution scores of the nodes of every layer to the input features, node_attribute_scores[l-1] has shape (width_in[l], width_in[0]).
+        Used by reg_metric='node_backward'.
+        
+        The score of node j in layer l (self.node_scores[l][j], from attribute()) is propagated down to the inputs. Since 
+        propagation is linear, the maps of layers l, ..., 1 are accumulated in one upward sweep (chain_l = map_l @ chain_{l-1}) 
+        instead of one backward pass per layer.
+        
+        Returns:
+        --------
+            None
+            
+        Example
+        -------
+        >>> from kan import *
+        >>> model = KAN(width=[2,5,3,1], grid=5, k=3, seed=0)
+        >>> model.get_act(torch.rand(100,2))
+        >>> model.node_attribute()
+        >>> [s.shape for s in model.node_attribute_scores]
+        '''
+        # scores of all nodes with respect to the outputs
+        self.attribute()
+        
         self.node_attribute_scores = []
+        chain = None
+        device = self.act_fun[0].grid.device
         for l in range(1, self.depth+1):
-            node_attr = self.attribute(l)
-            self.node_attribute_scores.append(node_attr)
+            layer_map = self.attribute_layer(torch.eye(self.width_in[l], device=device), l)[2]
+            chain = layer_map if chain == None else layer_map @ chain
+            self.node_attribute_scores.append(self.node_scores[l][:,None] * chain)
+            
+        # leave the attribution state of the last query of the per-layer formulation, attribute(depth),
+        # whose output scores are all 1/out_dim (propagation is linear)
+        scale = 1 / self.width_in[self.depth]
+        self.node_scores_all = [score * scale for score in self.node_scores_all]
+        self.edge_scores_all = [score * scale for score in self.edge_scores_all]
+        self.subnode_scores_all = [score * scale for score in self.subnode_scores_all]
+        self.node_scores = [score * scale for score in self.node_scores]
+        self.edge_scores = [score * scale for score in self.edge_scores]
+        self.subnode_scores = [score * scale for score in self.subnode_scores]
             
     def feature_interaction(self, l, neuron_th = 1e-2, feature_th = 1e-2):
         '''
@@ -2083,7 +2369,7 @@ class MultKAN(nn.Module):
 
         return dic
 
-    def suggest_symbolic(self, l, i, j, a_range=(-10, 10), b_range=(-10, 10), lib=None, topk=5, verbose=True, r2_loss_fun=lambda x: np.log2(1+1e-5-x), c_loss_fun=lambda x: x, weight_simple = 0.8):
+    def suggest_symbolic(self, l, i, j, a_range=(-10, 10), b_range=(-10, 10), lib=None, topk=5, verbose=True, r2_loss_fun=lambda x: np.log2(1+1e-5-x), c_loss_fun=lambda x: x, weight_simple = 0.8, grid_number=101, lm_steps=0):
         '''
         suggest symbolic function
 
@@ -2111,6 +2397,10 @@ class MultKAN(nn.Module):
                 function : c -> 'bits'
             weight_simple : float
                 the simplifty weight: the higher, more prefer simplicity over performance
+            grid_number : int
+                number of grid points per dimension of the (a, b) search
+            lm_steps : int
+                number of Levenberg-Marquardt refinement steps after the grid search (see fit_params_batch)
             
             
         Returns:
@@ -2126,9 +2416,6 @@ class MultKAN(nn.Module):
         >>> model.fit(dataset, opt='LBFGS', steps=20, lamb=0.001);
         >>> model.suggest_symbolic(0,1,0)
         '''
-        r2s = []
-        cs = []
-        
         if lib == None:
             symbolic_lib = SYMBOLIC_LIB
         else:
@@ -2136,19 +2423,13 @@ class MultKAN(nn.Module):
             for item in lib:
                 symbolic_lib[item] = SYMBOLIC_LIB[item]
 
-        # getting r2 and complexities
-        for (name, content) in symbolic_lib.items():
-            r2 = self.fix_symbolic(l, i, j, name, a_range=a_range, b_range=b_range, verbose=False, log_history=False)
-            if r2 == -1e8: # zero function
-                r2s.append(-1e8)
-            else:
-                r2s.append(r2.item())
-                self.unfix_symbolic(l, i, j, log_history=False)
-            c = content[2]
-            cs.append(c)
-
-        r2s = np.array(r2s)
-        cs = np.array(cs)
+        # getting r2 and complexities (all candidates fitted at once, the model is not modified)
+        if self.act_fun[l].mask[i][j] == 0.: # zero function
+            r2s = np.full(len(symbolic_lib), -1e8)
+        else:
+            _, _, r2s = self.fit_symbolic_batch(l, [(i, j)], lib=list(symbolic_lib.keys()), a_range=a_range, b_range=b_range, grid_number=grid_number, lm_steps=lm_steps)
+            r2s = r2s[:,0].cpu().numpy()
+        cs = np.array([content[2] for content in symbolic_lib.values()])
         r2_loss = r2_loss_fun(r2s).astype('float')
         cs_loss = c_loss_fun(cs)
         
@@ -2183,7 +2464,94 @@ class MultKAN(nn.Module):
             
         return best_name, best_fun, best_r2, best_c;
 
-    def auto_symbolic(self, a_range=(-10, 10), b_range=(-10, 10), lib=None, verbose=1, weight_simple = 0.8, r2_threshold=0.0):
+    def fit_symbolic_batch(self, l, ids, lib=None, a_range=(-10, 10), b_range=(-10, 10), verbose=False, max_elements=2**20, grid_number=101, lm_steps=0, n_workers=1, use_cache=True):
+        '''
+        fit every candidate symbolic function to every given edge of layer l in one vectorized sweep (see fit_params_batch). The model is not modified.
+
+        Args:
+        -----
+            l : int
+                layer index
+            ids : list of (int, int)
+                edges (i, j): i is the neuron index in layer l, j is the neuron index in layer l+1
+            lib : list of str
+                library of candidate symbolic functions. If None, all functions in SYMBOLIC_LIB.
+            a_range : tuple
+                search range of a
+            b_range : tuple
+                search range of b
+            verbose : bool
+                if verbose = True, print more information
+            max_elements : int
+                memory budget of the (a, b) sweep, in elements (see fit_params_batch)
+            grid_number : int
+                number of grid points per dimension of the (a, b) search
+            lm_steps : int
+                number of Levenberg-Marquardt refinement steps after the grid search (see fit_params_batch)
+            n_workers : int
+                if n_workers > 1, the edges are split across a pool of n_workers processes (see fit_params_parallel). Opt-in; only used on cpu and with enough work (see min_work of fit_params_parallel), otherwise the fit runs in-process. Scripts need an `if __name__ == '__main__':` guard (the workers are spawned).
+            use_cache : bool
+                if True, fits are looked up in (and stored to) self.fit_cache, so only (edge, function) pairs whose samples, function or settings changed are refitted
+
+        Returns:
+        --------
+            names : list of str
+                candidate names
+            params : 3D torch.float
+                fitted affine parameters (a, b, c, d), shape (number of candidates, number of edges, 4)
+            r2 : 2D torch.float
+                r2 of each candidate on each edge, shape (number of candidates, number of edges)
+
+        Example
+        -------
+        >>> from kan import *
+        >>> model = KAN(width=[2,1,1], grid=5, k=3, noise_scale=0.0, seed=0)
+        >>> x = torch.normal(0,1,size=(100,2))
+        >>> model(x)
+        >>> names, params, r2 = model.fit_symbolic_batch(0, [(0,0),(1,0)], lib=['x','sin','x^2'])
+        >>> params.shape, r2.shape
+        '''
+        if len(self.spline_postacts) == 0:
+            raise Exception("activations are not saved. Set act_capture=ActCapture('full') and do a forward pass first")
+        if lib == None:
+            lib = list(SYMBOLIC_LIB.keys())
+        in_id = torch.tensor([i for (i, j) in ids], dtype=torch.long)
+        out_id = torch.tensor([j for (i, j) in ids], dtype=torch.long)
+        x = self.spline_preacts[l][:, out_id, in_id].permute(1,0)
+        y = self.spline_postacts[l][:, out_id, in_id].permute(1,0)
+        fit = lambda x, y, names: fit_params_parallel(x, y, names, n_workers=n_workers, a_range=a_range, b_range=b_range, verbose=verbose, device=self.device, max_elements=max_elements, grid_number=grid_number, lm_steps=lm_steps)
+        if not use_cache:
+            params, r2 = fit(x, y, lib)
+            return lib, params, r2
+        
+        settings = (tuple(a_range), tuple(b_range), grid_number, lm_steps)
+        keys = self.fit_cache.fingerprint(x, y)
+        fun_keys = [self.fit_cache.function_id(name) for name in lib]
+        params = torch.zeros(len(lib), len(ids), 4, device=self.device)
+        r2 = torch.zeros(len(lib), len(ids), device=self.device)
+        missing = []
+        for k, name in enumerate(lib):
+            for e, key in enumerate(keys):
+                entry = self.fit_cache.get(key, fun_keys[k], settings)
+                if entry == None:
+                    missing.append((k, e))
+                else:
+                    params[k, e], r2[k, e] = entry
+        
+        if len(missing) > 0:
+            # refit the missing functions on the edges where any of them is missing
+            fun_ids = sorted(set([k for (k, e) in missing]))
+            edge_ids = sorted(set([e for (k, e) in missing]))
+            if len(edge_ids) < len(keys):
+                x, y = x[edge_ids], y[edge_ids]
+            params_new, r2_new = fit(x, y, [lib[k] for k in fun_ids])
+            for kk, k in enumerate(fun_ids):
+                for ee, e in enumerate(edge_ids):
+                    params[k, e], r2[k, e] = params_new[kk, ee], r2_new[kk, ee]
+                    self.fit_cache.put(keys[e], fun_keys[k], settings, params_new[kk, ee].clone(), r2_new[kk, ee].clone())
+        return lib, params, r2
+
+    def auto_symbolic(self, a_range=(-10, 10), b_range=(-10, 10), lib=None, verbose=1, weight_simple = 0.8, r2_threshold=0.0, r2_loss_fun=lambda x: np.log2(1+1e-5-x), c_loss_fun=lambda x: x, grid_number=101, lm_steps=0, n_workers=1):
         '''
         automatic symbolic regression for all edges
 
@@ -2201,6 +2569,17 @@ class MultKAN(nn.Module):
                 a weight that prioritizies simplicity (low complexity) over performance (high r2) - set to 0.0 to ignore complexity
             r2_threshold : float
                 If r2 is below this threshold, the edge will not be fixed with any symbolic function - set to 0.0 to ignore this threshold
+            r2_loss_fun : functoon
+                function : r2 -> "bits"
+            c_loss_fun : fun
+                function : c -> 'bits'
+            grid_number : int
+                number of grid points per dimension of the (a, b) search
+            lm_steps : int
+                number of Levenberg-Marquardt refinement steps after the grid search (see fit_params_batch). grid_number=21, lm_steps=10 is much faster than the default 101x101 grid
+                and matches its r2 for smooth functions, but may miss narrow optima (e.g. gaussian with large a) that only the dense grid resolves
+            n_workers : int
+                number of processes the edges of each layer are split across (cpu only). The winning functions are fixed in the main process.
         Returns:
         --------
             None
@@ -2215,6 +2594,8 @@ class MultKAN(nn.Module):
         >>> model.auto_symbolic()
         '''
         for l in range(len(self.width_in) - 1):
+            # all numerical edges of the layer are fitted in one batch before any of them is fixed
+            ids = []
             for i in range(self.width_in[l]):
                 for j in range(self.width_out[l + 1]):
                     if self.symbolic_fun[l].mask[j, i] > 0. and self.act_fun[l].mask[i][j] == 0.:
@@ -2223,13 +2604,24 @@ class MultKAN(nn.Module):
                         self.fix_symbolic(l, i, j, '0', verbose=verbose > 1, log_history=False)
                         print(f'fixing ({l},{i},{j}) with 0')
                     else:
-                        name, fun, r2, c = self.suggest_symbolic(l, i, j, a_range=a_range, b_range=b_range, lib=lib, verbose=False, weight_simple=weight_simple)
-                        if r2 >= r2_threshold:
-                            self.fix_symbolic(l, i, j, name, verbose=verbose > 1, log_history=False)
-                            if verbose >= 1:
-                                print(f'fixing ({l},{i},{j}) with {name}, r2={r2}, c={c}')
-                        else:
-                            print(f'For ({l},{i},{j}) the best fit was {name}, but r^2 = {r2} and this is lower than {r2_threshold}. This edge was omitted, keep training or try a different threshold.')
+                        ids.append((i, j))
+            if len(ids) == 0:
+                continue
+                        
+            names, params, r2s = self.fit_symbolic_batch(l, ids, lib=lib, a_range=a_range, b_range=b_range, verbose=verbose > 1, grid_number=grid_number, lm_steps=lm_steps, n_workers=n_workers)
+            r2s = r2s.cpu().numpy()
+            cs = np.array([SYMBOLIC_LIB[name][2] for name in names])
+            for k, (i, j) in enumerate(ids):
+                loss = weight_simple * c_loss_fun(cs) + (1-weight_simple) * r2_loss_fun(r2s[:,k]).astype('float')
+                best_id = np.argsort(loss)[0]
+                name, r2, c = names[best_id], r2s[best_id, k], cs[best_id]
+                if r2 >= r2_threshold:
+                    self.fix_symbolic(l, i, j, name, fit_params_bool=False, verbose=verbose > 1, log_history=False)
+                    self.symbolic_fun[l].affine.data[j][i] = params[best_id, k]
+                    if verbose >= 1:
+                        print(f'fixing ({l},{i},{j}) with {name}, r2={r2}, c={c}')
+                else:
+                    print(f'For ({l},{i},{j}) the best fit was {name}, but r^2 = {r2} and this is lower than {r2_threshold}. This edge was omitted, keep training or try a different threshold.')
                             
         self.log_history('auto_symbolic')
 
@@ -2304,10 +2696,7 @@ class MultKAN(nn.Module):
                         print('make sure all activations need to be converted to symbolic formulas first!')
                         return
                 yj = self.subnode_scale[l][j] * yj + self.subnode_bias[l][j]
-                if simplify == True:
-                    y.append(sympy.simplify(yj))
-                else:
-                    y.append(yj)
+                y.append(yj)
                     
             symbolic_acts_premult.append(y)
                   
@@ -2350,10 +2739,7 @@ class MultKAN(nn.Module):
         out_dim = len(symbolic_acts[-1])
         #return [symbolic_acts[-1][i] for i in range(len(symbolic_acts[-1]))], x0
         
-        if simplify:
-            return [symbolic_acts[-1][i] for i in range(len(symbolic_acts[-1]))], x0
-        else:
-            return [symbolic_acts[-1][i] for i in range(len(symbolic_acts[-1]))], x0
+        return [symbolic_acts[-1][i] for i in range(len(symbolic_acts[-1]))], x0
         
         
     def expand_depth(self):
@@ -2662,6 +3048,7 @@ class MultKAN(nn.Module):
         '''
         turn KAN into a tree
         '''
+        from .hypothesis import plot_tree
         if x == None:
             x = self.cache_data
         plot_tree(self, x, in_var=in_var, style=style, sym_th=sym_th, sep_th=sep_th, skip_sep_test=skip_sep_test, verbose=verbose)
@@ -2679,6 +3066,35 @@ class MultKAN(nn.Module):
         else:
             return self
         
+    def export(self, engine='basis'):
+        '''
+        freeze the model into a lean inference module (KANInference): spline coefficients pre-multiplied by scale_sp * mask,
+        grids and weights as contiguous buffers, no cache data, saved activations or checkpointing, and no symbolic branch
+        in layers without active symbolic edges. The exported module does not change when the model is trained further.
+        
+        Args:
+        -----
+            engine : str
+                'basis': splines are evaluated from their B-spline bases (one matrix product per layer).
+                'poly': splines are converted to piecewise polynomials (one gather and a Horner chain per edge);
+                the conversion error is reported in the max_error attribute of the exported module.
+            
+        Returns:
+        --------
+            KANInference
+            
+        Example
+        -------
+        >>> from kan import *
+        >>> model = KAN(width=[2,5,1], grid=5, k=3, seed=0, auto_save=False)
+        >>> frozen = model.export()
+        >>> scripted = torch.jit.script(frozen) # only without active symbolic edges
+        >>> exported = torch.export.export(frozen, (torch.rand(10,2),))
+        >>> frozen_poly = model.export(engine='poly')
+        >>> frozen_poly.max_error
+        '''
+        return KANInference(self, engine=engine)
+        
     def get_act(self, x=None):
         '''
         collect intermidate activations
@@ -2714,6 +3130,7 @@ class MultKAN(nn.Module):
         '''
         get history
         '''
+        checkpoint.flush()
         with open(self.ckpt_path+'/history.txt', 'r') as f:
             data = f.readlines()
             n_line = len(data)
@@ -2736,7 +3153,8 @@ class MultKAN(nn.Module):
     
     def evaluate(self, dataset):
         evaluation = {}
-        evaluation['test_loss'] = torch.sqrt(torch.mean((self.forward(dataset['test_input']) - dataset['test_label'])**2)).item()
+        # dataset may live on another device (e.g. memory-mapped by load_dataset)
+        evaluation['test_loss'] = torch.sqrt(torch.mean((self.forward(dataset['test_input'].to(self.device)) - dataset['test_label'].to(self.device))**2)).item()
         evaluation['n_edge'] = self.n_edge
         evaluation['n_grid'] = self.grid
         # add other metrics (maybe accuracy)
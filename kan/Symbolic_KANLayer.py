@@ -1,7 +1,6 @@
 import torch
 import torch.nn as nn
 import numpy as np
-import sympy
 from .utils import *
 
 
@@ -25,6 +24,10 @@ class Symbolic_KANLayer(nn.Module):
             symbolic functions (sympy)
         affine : 3D array of floats
             affine transformations of inputs and outputs
+        plan : None or list
+            execution plan of forward: active edges (mask != 0) grouped by their (elementwise) symbolic functions, so that each distinct function is called once per forward. Built lazily (see get_plan), reset by invalidate_plan().
+        plan_active : None or 2D torch.bool
+            the active edges (mask != 0) the plan was built for
     '''
     def __init__(self, in_dim=3, out_dim=2, device='cpu'):
         '''
@@ -52,18 +55,22 @@ class Symbolic_KANLayer(nn.Module):
         self.out_dim = out_dim
         self.in_dim = in_dim
         self.mask = torch.nn.Parameter(torch.zeros(out_dim, in_dim, device=device)).requires_grad_(False)
-        # torch
-        self.funs = [[lambda x: x*0. for i in range(self.in_dim)] for j in range(self.out_dim)]
-        self.funs_avoid_singularity = [[lambda x, y_th: ((), x*0.) for i in range(self.in_dim)] for j in range(self.out_dim)]
+        # torch (one function object shared by all edges, so that they form a single group in the execution plan)
+        fun_zero = lambda x: x*0.
+        fun_zero_avoid_singularity = lambda x, y_th: ((), x*0.)
+        self.funs = [[fun_zero for i in range(self.in_dim)] for j in range(self.out_dim)]
+        self.funs_avoid_singularity = [[fun_zero_avoid_singularity for i in range(self.in_dim)] for j in range(self.out_dim)]
         # name
         self.funs_name = [['0' for i in range(self.in_dim)] for j in range(self.out_dim)]
         # sympy
-        self.funs_sympy = [[lambda x: x*0. for i in range(self.in_dim)] for j in range(self.out_dim)]
+        self.funs_sympy = [[fun_zero for i in range(self.in_dim)] for j in range(self.out_dim)]
         ### make funs_name the only parameter, and make others as the properties of funs_name?
         
         self.affine = torch.nn.Parameter(torch.zeros(out_dim, in_dim, 4, device=device))
         # c*f(a*x+b)+d
         
+        self.plan = None
+        self.plan_active = None
         self.device = device
         self.to(device)
         
@@ -73,8 +80,67 @@ class Symbolic_KANLayer(nn.Module):
         '''
         super(Symbolic_KANLayer, self).to(device)
         self.device = device    
+        self.invalidate_plan()
         return self
     
+    def invalidate_plan(self):
+        '''
+        reset the execution plan of forward. Needs to be called whenever funs or funs_avoid_singularity are changed.
+        '''
+        self.plan = None
+        self.plan_active = None
+        
+    def get_plan(self):
+        '''
+        the execution plan of forward, rebuilt if it has been invalidated or if the set of active edges (mask != 0) has changed
+        
+        Returns:
+        --------
+            plan : list
+                see build_plan. An empty list means the layer has no active edges.
+        '''
+        active = self.mask.data != 0
+        if self.plan == None or not torch.equal(active, self.plan_active):
+            self.plan = self.build_plan()
+            self.plan_active = active
+        return self.plan
+        
+    def build_plan(self):
+        '''
+        group active edges (mask != 0) by their functions (funs and funs_avoid_singularity, compared by identity). Masked edges are not computed at all.
+        
+        Returns:
+        --------
+            plan : list
+                each group is (fun, fun_avoid_singularity, in_id, out_id, flat_id) with flat_id = out_id * in_dim + in_id
+        
+        Example
+        -------
+        >>> sb = Symbolic_KANLayer(in_dim=3, out_dim=2)
+        >>> sb.fix_symbolic(2,1,'sin')
+        >>> sb.mask.data[1,2] = 1.
+        >>> len(sb.build_plan())
+        1
+        '''
+        active = (self.mask.data != 0).cpu()
+        groups = {}
+        for j in range(self.out_dim):
+            for i in range(self.in_dim):
+                if not active[j,i]:
+                    continue
+                key = (id(self.funs[j][i]), id(self.funs_avoid_singularity[j][i]))
+                if key not in groups:
+                    groups[key] = (self.funs[j][i], self.funs_avoid_singularity[j][i], [], [])
+                groups[key][2].append(i)
+                groups[key][3].append(j)
+        
+        plan = []
+        for fun, fun_avoid_singularity, in_id, out_id in groups.values():
+            in_id = torch.tensor(in_id, dtype=torch.long, device=self.affine.device)
+            out_id = torch.tensor(out_id, dtype=torch.long, device=self.affine.device)
+            plan.append((fun, fun_avoid_singularity, in_id, out_id, out_id * self.in_dim + in_id))
+        return plan
+    
     def forward(self, x, singularity_avoiding=False, y_th=10.):
         '''
         forward
@@ -105,20 +171,29 @@ class Symbolic_KANLayer(nn.Module):
         '''
         
         batch = x.shape[0]
-        postacts = []
+        
+        plan = self.get_plan()
 
-        for i in range(self.in_dim):
-            postacts_ = []
-            for j in range(self.out_dim):
-                if singularity_avoiding:
-                    xij = self.affine[j,i,2]*self.funs_avoid_singularity[j][i](self.affine[j,i,0]*x[:,[i]]+self.affine[j,i,1], torch.tensor(y_th))[1]+self.affine[j,i,3]
-                else:
-                    xij = self.affine[j,i,2]*self.funs[j][i](self.affine[j,i,0]*x[:,[i]]+self.affine[j,i,1])+self.affine[j,i,3]
-                postacts_.append(self.mask[j][i]*xij)
-            postacts.append(torch.stack(postacts_))
+        # each distinct function is applied once to all of its edges, shape (batch, number of edges in the group)
+        postacts_group = []
+        flat_ids = []
+        for fun, fun_avoid_singularity, in_id, out_id, flat_id in plan:
+            affine = self.affine[out_id, in_id]
+            x_group = affine[:,0]*x[:,in_id]+affine[:,1]
+            if singularity_avoiding:
+                y_group = affine[:,2]*fun_avoid_singularity(x_group, torch.tensor(y_th))[1]+affine[:,3]
+            else:
+                y_group = affine[:,2]*fun(x_group)+affine[:,3]
+            postacts_group.append(self.mask[out_id, in_id]*y_group)
+            flat_ids.append(flat_id)
 
-        postacts = torch.stack(postacts)
-        postacts = postacts.permute(2,1,0,3)[:,:,:,0]
+        if len(plan) > 0:
+            postacts_group = torch.cat(postacts_group, dim=1)
+            postacts = torch.zeros(batch, self.out_dim*self.in_dim, device=x.device, dtype=postacts_group.dtype)
+            postacts = postacts.index_copy(1, torch.cat(flat_ids), postacts_group)
+        else:
+            postacts = torch.zeros(batch, self.out_dim*self.in_dim, device=x.device, dtype=x.dtype)
+        postacts = postacts.reshape(batch, self.out_dim, self.in_dim)
         y = torch.sum(postacts, dim=2)
         
         return y, postacts
@@ -204,6 +279,7 @@ class Symbolic_KANLayer(nn.Module):
         >>> print(sb.funs_name)
         >>> print(sb.affine[1,2,:].data)
         '''
+        self.invalidate_plan()
         if isinstance(fun_name,str):
             fun = SYMBOLIC_LIB[fun_name][0]
             fun_sympy = SYMBOLIC_LIB[fun_name][1]
@@ -263,8 +339,10 @@ class Symbolic_KANLayer(nn.Module):
                 elif mode == 'out':
                     data[i1], data[i2] = data[i2].clone(), data[i1].clone()
 
+            swap_list_(self.funs,i1,i2,mode)
             swap_list_(self.funs_name,i1,i2,mode)
             swap_list_(self.funs_sympy,i1,i2,mode)
             swap_list_(self.funs_avoid_singularity,i1,i2,mode)
             swap_(self.affine.data,i1,i2,mode)
             swap_(self.mask.data,i1,i2,mode)
+            self.invalidate_plan()
@@ -1,3 +1,67 @@
+import importlib
 from .MultKAN import *
 from .utils import *
-#torch.use_deterministic_algorithms(True)
\ No newline at end of file
+#torch.use_deterministic_algorithms(True)
+
+# heavy dependencies (sympy, matplotlib, pandas, sklearn, ...) are loaded on first use, see utils.LazyModule.
+# submodules that need them are resolved on attribute access (PEP 562), e.g. kan.hypothesis.
+LAZY_SUBMODULES = ['hypothesis', 'compiler', 'feynman', 'experiment', 'MLP']
+
+
+# sympy names that `from kan import *` used to export (sympy's namespace was star-imported), used throughout the tutorials.
+# They are listed explicitly, so kan.<name> does not depend on whether sympy happens to be loaded already.
+LEGACY_SYMPY_NAMES = [
+    'Symbol', 'symbols', 'Function', 'Expr', 'Add', 'Mul', 'Pow', 'Number', 'Integer', 'Float', 'Rational', 'Eq',
+    'pi', 'E', 'I', 'oo', 'zoo', 'nan', 'S', 'N',
+    'sin', 'cos', 'tan', 'cot', 'asin', 'acos', 'atan', 'atan2', 'sinh', 'cosh', 'tanh', 'asinh', 'acosh', 'atanh',
+    'exp', 'log', 'sqrt', 'Abs', 'sign', 'floor', 'ceiling', 're', 'im', 'Max', 'Min', 'Piecewise', 'erf', 'gamma',
+    'simplify', 'expand', 'factor', 'collect', 'cancel', 'together', 'nsimplify', 'sympify', 'srepr', 'pprint', 'init_printing',
+    'diff', 'integrate', 'limit', 'series', 'solve', 'lambdify', 'latex', 'Matrix', 'preorder_traversal',
+]
+
+# names that `from kan import *` used to export when sympy, matplotlib, pandas, tqdm were imported eagerly: (module, attribute)
+LEGACY_NAMES = {name: ('sympy', name) for name in LEGACY_SYMPY_NAMES}
+LEGACY_NAMES.update({
+    'sympy': ('sympy', None),
+    'yaml': ('yaml', None),
+    'plt': ('matplotlib.pyplot', None),
+    'pd': ('pandas', None),
+    'tqdm': ('tqdm', 'tqdm'),
+})
+
+
+def load_legacy(name):
+    module, attribute = LEGACY_NAMES[name]
+    value = importlib.import_module(module, __name__)
+    if attribute != None:
+        value = getattr(value, attribute)
+    return value
+
+
+def plot_tree(*args, **kwargs):
+    '''
+    hypothesis.plot_tree, imported on first call (hypothesis loads sklearn and matplotlib)
+    '''
+    from .hypothesis import plot_tree
+    return plot_tree(*args, **kwargs)
+
+
+def __getattr__(name):
+    # only known names import anything; hasattr(kan, name) for any other name fails without loading a heavy dependency
+    if name in LAZY_SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    if name in LEGACY_NAMES:
+        value = load_legacy(name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(LAZY_SUBMODULES) | set(LEGACY_NAMES))
+
+
+# `from kan import *` exports kan's names and the legacy names. sympy, yaml, plt and pd are already bound to LazyModule
+# placeholders (see MultKAN and utils), but the sympy functions and classes cannot be deferred: a star import loads sympy
+# (not matplotlib, pandas or sklearn). `import kan` loads none of them.
+__all__ = sorted(set(name for name in globals() if not name.startswith('_')) | set(LEGACY_NAMES))
@@ -0,0 +1,555 @@
+import torch
+import copy
+import threading
+import queue
+import atexit
+import os
+import hashlib
+import json
+import struct
+import base64
+import numpy as np
+from .utils import LazyModule
+
+yaml = LazyModule('yaml')
+
+
+def snapshot(tensor):
+    '''
+    copy of a tensor on cpu, detached from the graph (None stays None)
+
+    Args:
+    -----
+        tensor : None or torch.tensor
+
+    Returns:
+    --------
+        None or torch.tensor
+
+    Example
+    -------
+    >>> from kan.checkpoint import snapshot
+    >>> x = torch.ones(3, requires_grad=True)
+    >>> snapshot(x)
+    '''
+    if tensor == None:
+        return None
+    return tensor.detach().to('cpu', copy=True)
+
+
+def tensor_hash(tensor):
+    '''
+    content hash of a tensor (dtype, shape and data)
+
+    Args:
+    -----
+        tensor : torch.tensor
+
+    Returns:
+    --------
+        digest : str
+
+    Example
+    -------
+    >>> from kan.checkpoint import tensor_hash
+    >>> tensor_hash(torch.zeros(3)) == tensor_hash(torch.zeros(3))
+    True
+    '''
+    tensor = tensor.detach().cpu().contiguous()
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f'{tensor.dtype}{tuple(tensor.shape)}'.encode())
+    h.update(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+    return h.hexdigest()
+
+
+def write_object(store, tensor):
+    '''
+    store the raw bytes of a tensor in a content-addressed object store ({store}/{digest[:2]}/{digest}); a tensor already in the store is not written again.
+    dtype and shape are not stored (see object_entry)
+
+    Args:
+    -----
+        store : str
+            object store directory
+        tensor : torch.tensor
+
+    Returns:
+    --------
+        digest : str
+    '''
+    digest = tensor_hash(tensor)
+    folder = os.path.join(store, digest[:2])
+    file = os.path.join(folder, digest)
+    if not os.path.exists(file):
+        os.makedirs(folder, exist_ok=True)
+        # write to a temporary file first so that a crash never leaves a truncated object behind
+        temp = f'{file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp, 'wb') as f:
+            f.write(tensor_bytes(tensor))
+        os.replace(temp, file)
+    return digest
+
+
+def tensor_bytes(tensor):
+    '''
+    raw (native byte order) data of a tensor
+    '''
+    return tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes()
+
+
+# tensors up to one file system block are stored in the manifest itself: a separate object file would take a whole block
+INLINE_BYTES = 4096
+
+
+def object_entry(store, tensor):
+    '''
+    manifest entry of a tensor: {'dtype', 'shape'} and either 'data' (base64 of the raw bytes, for tensors up to INLINE_BYTES)
+    or 'digest' (see write_object)
+
+    Args:
+    -----
+        store : str
+            object store directory
+        tensor : None or torch.tensor
+
+    Returns:
+    --------
+        entry : None or dict
+    '''
+    if tensor == None:
+        return None
+    entry = dict(dtype=str(tensor.dtype).split('.')[-1], shape=list(tensor.shape))
+    if tensor.numel() * tensor.element_size() <= INLINE_BYTES:
+        entry['data'] = base64.b64encode(tensor_bytes(tensor)).decode()
+    else:
+        entry['digest'] = write_object(store, tensor)
+    return entry
+
+
+def read_object(store, entry):
+    '''
+    tensor of a manifest entry (see object_entry). Entries that are a bare digest (older manifests) refer to torch.save files.
+    '''
+    if entry == None:
+        return None
+    if isinstance(entry, str):
+        return torch.load(os.path.join(store, entry[:2], entry))
+    dtype = getattr(torch, entry['dtype'])
+    if 'data' in entry:
+        data = bytearray(base64.b64decode(entry['data']))
+    else:
+        with open(os.path.join(store, entry['digest'][:2], entry['digest']), 'rb') as f:
+            data = bytearray(f.read())
+    if len(data) == 0:
+        return torch.empty(entry['shape'], dtype=dtype)
+    return torch.frombuffer(data, dtype=torch.uint8).view(dtype).reshape(entry['shape'])
+
+
+def prune_objects(folder):
+    '''
+    delete the objects of {folder}/objects that no manifest in folder refers to (e.g. after old versions were removed),
+    and temporary files left behind by interrupted writes. Flush pending writes first (see flush).
+
+    Args:
+    -----
+        folder : str
+            checkpoint directory (MultKAN.ckpt_path)
+
+    Returns:
+    --------
+        n_removed : int
+            number of deleted object files
+
+    Example
+    -------
+    >>> from kan.checkpoint import prune_objects
+    >>> prune_objects('./model')
+    '''
+    store = os.path.join(folder, 'objects')
+    if not os.path.isdir(store):
+        return 0
+    referenced = set()
+    for name in os.listdir(folder):
+        if not name.endswith('_manifest.yml'):
+            continue
+        with open(os.path.join(folder, name), 'r') as stream:
+            manifest = yaml.safe_load(stream)
+        for entry in list(manifest['state'].values()) + [manifest['cache_data']]:
+            if isinstance(entry, str):
+                referenced.add(entry)
+            elif entry != None and 'digest' in entry:
+                referenced.add(entry['digest'])
+    n_removed = 0
+    for prefix in os.listdir(store):
+        subfolder = os.path.join(store, prefix)
+        for name in os.listdir(subfolder):
+            if name not in referenced:
+                os.remove(os.path.join(subfolder, name))
+                n_removed += 1
+        if len(os.listdir(subfolder)) == 0:
+            os.rmdir(subfolder)
+    return n_removed
+
+
+def write_single(file, config, tensors, alignment=64):
+    '''
+    write config and tensors to a single file: an 8-byte little-endian header length, a json header
+    ({'config': config, 'tensors': {name: {'dtype', 'shape', 'offset', 'nbytes'}}}) and the raw tensor data,
+    each tensor aligned to alignment bytes (offsets are relative to the end of the header).
+
+    Args:
+    -----
+        file : str
+            file path
+        config : dict
+            json-serializable configuration
+        tensors : dict
+            name -> torch.tensor (None values are recorded as None)
+        alignment : int
+            alignment of tensor data in bytes
+
+    Returns:
+    --------
+        None
+    '''
+    index = {}
+    data = []
+    offset = 0
+    for name, tensor in tensors.items():
+        if tensor == None:
+            index[name] = None
+            continue
+        tensor = tensor.detach().cpu().contiguous()
+        offset = (offset + alignment - 1) // alignment * alignment
+        nbytes = tensor.numel() * tensor.element_size()
+        index[name] = dict(dtype=str(tensor.dtype).split('.')[-1], shape=list(tensor.shape), offset=offset, nbytes=nbytes)
+        data.append((offset, tensor))
+        offset += nbytes
+    
+    header = json.dumps(dict(config=config, tensors=index)).encode()
+    # pad the header so that the data section starts aligned
+    header += b' ' * ((-len(header) - 8) % alignment)
+    temp = f'{file}.tmp'
+    with open(temp, 'wb') as f:
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        start = f.tell()
+        for position, tensor in data:
+            f.seek(start + position)
+            f.write(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+        f.truncate(start + offset)
+    os.replace(temp, file)
+
+
+def read_single_header(file):
+    '''
+    read the json header of a file written by write_single (no tensor data is read)
+
+    Args:
+    -----
+        file : str
+            file path
+
+    Returns:
+    --------
+        header : dict
+            {'config': config, 'tensors': index}
+        start : int
+            byte position of the data section
+    '''
+    with open(file, 'rb') as f:
+        n = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(n))
+    return header, 8 + n
+
+
+def read_single(file):
+    '''
+    read a file written by write_single. Tensors are copy-on-write views of one memory map of the file,
+    so their data is only read from disk when accessed.
+
+    Args:
+    -----
+        file : str
+            file path
+
+    Returns:
+    --------
+        config : dict
+        tensors : dict
+            name -> torch.tensor (or None)
+    '''
+    header, start = read_single_header(file)
+    size = os.path.getsize(file)
+    buffer = torch.from_numpy(np.memmap(file, dtype=np.uint8, mode='c')) if size > start else torch.empty(0, dtype=torch.uint8)
+    tensors = {}
+    for name, entry in header['tensors'].items():
+        if entry == None:
+            tensors[name] = None
+            continue
+        dtype = getattr(torch, entry['dtype'])
+        if entry['nbytes'] == 0:
+            tensors[name] = torch.empty(entry['shape'], dtype=dtype)
+            continue
+        begin = start + entry['offset']
+        tensors[name] = buffer[begin:begin+entry['nbytes']].view(dtype).reshape(entry['shape'])
+    return header['config'], tensors
+
+
+def write_checkpoint(path, config, state, cache_data, format='files'):
+    '''
+    write a checkpoint.
+    format='files': {path}_config.yml, {path}_state and {path}_cache_data.
+    format='objects': {path}_manifest.yml (config, and dtype, shape and digest of every tensor); tensors are stored by content in the objects/ folder
+    next to the checkpoint (see write_object), so tensors that do not change between versions (cache_data, grids, masks, ...) are stored once.
+    Tensors of at most INLINE_BYTES are stored in the manifest instead. Objects of removed versions are deleted by prune_objects.
+    format='single': one file {path}.kan with the config and tensor index in a header, followed by the tensors (see write_single).
+
+    Args:
+    -----
+        path : str
+            path prefix of the checkpoint files
+        config : dict
+            model configuration (see MultKAN.get_config)
+        state : dict
+            state dict
+        cache_data : None or 2D torch.float
+            cache data
+        format : str
+            'files', 'objects' or 'single'
+
+    Returns:
+    --------
+        None
+
+    Example
+    -------
+    >>> from kan import *
+    >>> from kan.checkpoint import write_checkpoint
+    >>> model = KAN(width=[2,5,1], grid=5, k=3, seed=0, auto_save=False)
+    >>> write_checkpoint('./mark', model.get_config(), model.state_dict(), model.cache_data)
+    '''
+    if format == 'files':
+        with open(f'{path}_config.yml', 'w') as outfile:
+            yaml.dump(config, outfile, default_flow_style=False)
+
+        torch.save(state, f'{path}_state')
+        torch.save(cache_data, f'{path}_cache_data')
+    elif format == 'objects':
+        store = os.path.join(os.path.dirname(path), 'objects')
+        manifest = dict(config=config)
+        manifest['state'] = {key: object_entry(store, value) for key, value in state.items()}
+        manifest['cache_data'] = object_entry(store, cache_data)
+        temp = f'{path}_manifest.yml.tmp'
+        with open(temp, 'w') as outfile:
+            yaml.dump(manifest, outfile, default_flow_style=False)
+        os.replace(temp, f'{path}_manifest.yml')
+    elif format == 'single':
+        tensors = {f'state.{key}': value for key, value in state.items()}
+        tensors['cache_data'] = cache_data
+        write_single(f'{path}.kan', config, tensors)
+    else:
+        raise Exception(f'checkpoint format {format} not recognized')
+
+
+def read_checkpoint(path):
+    '''
+    read a checkpoint written by write_checkpoint (any format). Tensors of 'single' checkpoints are loaded lazily (memory-mapped).
+
+    Args:
+    -----
+        path : str
+            path prefix of the checkpoint files
+
+    Returns:
+    --------
+        config : dict
+        state : dict
+        cache_data : None or 2D torch.float
+
+    Example
+    -------
+    >>> from kan.checkpoint import read_checkpoint
+    >>> config, state, cache_data = read_checkpoint('./model/0.0')
+    '''
+    if os.path.exists(f'{path}.kan'):
+        config, tensors = read_single(f'{path}.kan')
+        state = {key[len('state.'):]: value for key, value in tensors.items() if key.startswith('state.')}
+        return config, state, tensors['cache_data']
+    
+    if os.path.exists(f'{path}_manifest.yml'):
+        with open(f'{path}_manifest.yml', 'r') as stream:
+            manifest = yaml.safe_load(stream)
+        store = os.path.join(os.path.dirname(path), 'objects')
+        state = {key: read_object(store, entry) for key, entry in manifest['state'].items()}
+        cache_data = read_object(store, manifest['cache_data'])
+        return manifest['config'], state, cache_data
+    
+    with open(f'{path}_config.yml', 'r') as stream:
+        config = yaml.safe_load(stream)
+
+    state = torch.load(f'{path}_state')
+    cache_data = torch.load(f'{path}_cache_data')
+    return config, state, cache_data
+
+
+def read_config(path):
+    '''
+    read only the configuration of a checkpoint (any format). For 'single' checkpoints only the header is read.
+
+    Args:
+    -----
+        path : str
+            path prefix of the checkpoint files
+
+    Returns:
+    --------
+        config : dict
+
+    Example
+    -------
+    >>> from kan.checkpoint import read_config
+    >>> read_config('./model/0.0')['width']
+    '''
+    if os.path.exists(f'{path}.kan'):
+        return read_single_header(f'{path}.kan')[0]['config']
+    if os.path.exists(f'{path}_manifest.yml'):
+        with open(f'{path}_manifest.yml', 'r') as stream:
+            return yaml.safe_load(stream)['config']
+    with open(f'{path}_config.yml', 'r') as stream:
+        return yaml.safe_load(stream)
+
+
+def write_text(path, text, mode='a'):
+    '''
+    write (append by default) text to a file
+    '''
+    with open(path, mode) as file:
+        file.write(text)
+
+
+class CheckpointWriter:
+    '''
+    background thread writing checkpoints in submission order. Tensors are snapshotted to cpu on submission,
+    so the model can keep changing while its checkpoint is written.
+
+    Attributes:
+    -----------
+        max_pending : int
+            maximal number of queued writes; submitting more blocks until the oldest one is written
+        error : None or Exception
+            first error raised by a write, re-raised by the next submit() or flush()
+
+    Example
+    -------
+    >>> from kan import *
+    >>> from kan.checkpoint import CheckpointWriter
+    >>> model = KAN(width=[2,5,1], grid=5, k=3, seed=0, auto_save=False)
+    >>> with CheckpointWriter() as writer:
+    >>>     writer.save('./mark', model.get_config(), model.state_dict(), model.cache_data)
+    >>> # the checkpoint files are written when the block exits
+    '''
+    def __init__(self, max_pending=4):
+        self.max_pending = max_pending
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    def run(self):
+        while True:
+            fun, args = self.queue.get()
+            try:
+                fun(*args)
+            except Exception as e:
+                if self.error == None:
+                    self.error = e
+            finally:
+                self.queue.task_done()
+
+    def raise_error(self):
+        if self.error != None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def submit(self, fun, *args):
+        '''
+        queue fun(*args) to be run by the writer thread (blocks if max_pending writes are already queued)
+        '''
+        self.raise_error()
+        with self.lock:
+            if self.thread == None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.queue.put((fun, args))
+
+    def save(self, path, config, state, cache_data, format='files'):
+        '''
+        queue a checkpoint write (see write_checkpoint). config and tensors are copied before returning.
+
+        Args:
+        -----
+            path : str
+                path prefix of the checkpoint files
+            config : dict
+                model configuration (see MultKAN.get_config)
+            state : dict
+                state dict
+            cache_data : None or 2D torch.float
+                cache data
+            format : str
+                'files', 'objects' or 'single' (see write_checkpoint)
+
+        Returns:
+        --------
+            None
+        '''
+        config = copy.deepcopy(config)
+        metadata = getattr(state, '_metadata', None)
+        state = state.__class__((key, snapshot(value)) for key, value in state.items())
+        if metadata != None:
+            state._metadata = metadata
+        self.submit(write_checkpoint, path, config, state, snapshot(cache_data), format)
+
+    def append(self, path, text, mode='a'):
+        '''
+        queue a text write (history file), ordered with the checkpoint writes
+        '''
+        self.submit(write_text, path, text, mode)
+
+    def flush(self):
+        '''
+        block until all queued writes are on disk; re-raise the first failed write, if any
+        '''
+        if self.thread != None:
+            self.queue.join()
+        self.raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
+# writer shared by all models (MultKAN.log_history)
+writer = CheckpointWriter()
+
+
+def flush():
+    '''
+    block until all checkpoints queued by MultKAN (auto_save=True) are written
+
+    Example
+    -------
+    >>> from kan import *
+    >>> from kan.checkpoint import flush
+    >>> model = KAN(width=[2,5,1], grid=5, k=3, seed=0)
+    >>> model.prune()
+    >>> flush()
+    '''
+    writer.flush()
+
+
+atexit.register(flush)
@@ -0,0 +1,311 @@
+import torch
+import torch.nn as nn
+from .spline import uniform_basis_table, extend_grid, coef2poly, poly_error
+
+
+class KANInferenceSymbolic(nn.Module):
+    '''
+    frozen active symbolic edges of a Symbolic_KANLayer: the execution plan (see Symbolic_KANLayer.build_plan) is fixed at export time,
+    and mask and subnode scale are folded into the affine parameters.
+
+    Attributes:
+    -----------
+        funs : list of functions
+            one function per group of edges
+        sizes : list of int
+            number of edges in each group
+        in_id : 1D torch.long
+            input neuron of every edge (grouped)
+        out_id : 1D torch.long
+            output subnode of every edge (grouped)
+        affine : 2D torch.float
+            (a, b, c, d) of every edge, c and d scaled by the mask and the subnode scale, shape (number of edges, 4)
+        out_dim : int
+            number of subnodes
+
+    Example
+    -------
+    >>> from kan import *
+    >>> model = KAN(width=[2,5,1], grid=5, k=3, seed=0, auto_save=False)
+    >>> model.fix_symbolic(0,0,0,'sin',fit_params_bool=False)
+    >>> sym = KANInferenceSymbolic(model.symbolic_fun[0], model.subnode_scale[0])
+    >>> sym(torch.rand(100,2)).shape
+    torch.Size([100, 5])
+    '''
+    def __init__(self, symbolic_fun, subnode_scale):
+        super(KANInferenceSymbolic, self).__init__()
+        self.out_dim = symbolic_fun.out_dim
+        plan = symbolic_fun.build_plan()
+        self.funs = [group[0] for group in plan]
+        self.sizes = [len(group[2]) for group in plan]
+        in_id = torch.cat([group[2] for group in plan])
+        out_id = torch.cat([group[3] for group in plan])
+        with torch.no_grad():
+            affine = symbolic_fun.affine[out_id, in_id].clone()
+            scale = symbolic_fun.mask[out_id, in_id] * subnode_scale[out_id]
+            affine[:,2] *= scale
+            affine[:,3] *= scale
+        self.register_buffer('in_id', in_id)
+        self.register_buffer('out_id', out_id)
+        self.register_buffer('affine', affine)
+
+    def forward(self, x):
+        y = torch.zeros(x.shape[0], self.out_dim, device=x.device, dtype=x.dtype)
+        start = 0
+        for fun, size in zip(self.funs, self.sizes):
+            in_id = self.in_id[start:start+size]
+            affine = self.affine[start:start+size]
+            y = y.index_add(1, self.out_id[start:start+size], affine[:,2]*fun(affine[:,0]*x[:,in_id]+affine[:,1])+affine[:,3])
+            start += size
+        return y
+
+
+class KANInferenceLayer(nn.Module):
+    '''
+    frozen layer l of a MultKAN for inference: numerical edges, (optional) active symbolic edges, subnode affine transform,
+    multiplication nodes and node affine transform. Spline coefficients are pre-multiplied by scale_sp * mask (and the subnode scale).
+    With engine='basis', the splines of the layer are one matrix product against the dense B-spline bases;
+    with engine='poly', they are piecewise polynomials (see spline.coef2poly): one bucketize, one gather and a Horner chain per edge.
+
+    Attributes:
+    -----------
+        in_dim : int
+            input dimension
+        out_dim : int
+            number of subnodes
+        k : int
+            spline order
+        base : str
+            base function, 'silu', 'identity' or 'zero'
+        engine : str
+            'basis' or 'poly'
+        uniform : bool
+            whether all grids are uniform. The k+1 non-zero bases of each sample are evaluated from a polynomial table on uniform grids
+            (as spline.B_batch_uniform), from the knots around the sample otherwise (as spline.B_batch_local)
+        grid : 2D torch.float
+            grids, shape (in_dim, number of grid points)
+        grid_pad : 2D torch.float
+            grids extended by k points on both sides, shape (in_dim, number of grid points + 2k)
+        grid_step : 1D torch.float
+            grid spacing (uniform grids), shape (in_dim,)
+        table : 2D torch.float
+            uniform B-spline polynomial coefficients (see spline.uniform_basis_table), shape (k+1, k+1)
+        spline_weight : 2D torch.float
+            shape (in_dim * number of coefficients, out_dim) (engine='basis')
+        poly : 4D torch.float
+            scaled piecewise polynomials, shape (in_dim, number of knot intervals, k+1, out_dim) (engine='poly')
+        inv_width : 2D torch.float
+            reciprocal widths of the knot intervals (0 for degenerate intervals), shape (in_dim, number of knot intervals)
+        max_error : float
+            maximum absolute error of the piecewise polynomials against coef2curve (engine='poly', 0 otherwise)
+        base_weight : 2D torch.float
+            shape (in_dim, out_dim)
+        bias : 1D torch.float
+            subnode bias, shape (out_dim,)
+        symbolic : None or KANInferenceSymbolic
+            symbolic branch, None if no symbolic edge is active
+        dim_sum : int
+            number of addition nodes
+        mult_ids : 2D torch.long
+            subnode ids multiplied by each multiplication node, padded with out_dim (the id of an extra column of ones), shape (number of mult nodes, max arity)
+        node_scale : 1D torch.float
+        node_bias : 1D torch.float
+
+    Example
+    -------
+    >>> from kan import *
+    >>> model = KAN(width=[2,5,1], grid=5, k=3, seed=0, auto_save=False)
+    >>> layer = KANInferenceLayer(model, 0)
+    >>> layer(torch.rand(100,2)).shape
+    torch.Size([100, 5])
+    '''
+    def __init__(self, model, l, engine='basis'):
+        super(KANInferenceLayer, self).__init__()
+        act_fun = model.act_fun[l]
+        symbolic_fun = model.symbolic_fun[l]
+        self.in_dim = act_fun.in_dim
+        self.out_dim = act_fun.out_dim
+        self.k = act_fun.k
+        self.uniform = bool(act_fun.grid_uniform)
+        if model.base_fun_name not in ['silu', 'identity', 'zero']:
+            raise Exception(f'base function {model.base_fun_name} cannot be exported')
+        self.base = model.base_fun_name
+        if engine not in ['basis', 'poly']:
+            raise Exception(f'engine {engine} not recognized')
+        self.engine = engine
+
+        with torch.no_grad():
+            grid = act_fun.grid.detach().clone().contiguous()
+
+            subnode_scale = model.subnode_scale[l].detach().clone()
+            # (in, out, n_coef) -> (in * n_coef, out), with scale_sp, mask and the subnode scale folded in
+            spline_weight = act_fun.coef * (act_fun.scale_sp * act_fun.mask)[:,:,None] * subnode_scale[None,:,None]
+            spline_weight = spline_weight.permute(0,2,1).reshape(-1, self.out_dim).contiguous()
+            base_weight = (act_fun.scale_base * act_fun.mask * subnode_scale[None,:]).contiguous()
+            width = grid[:,1:] - grid[:,:-1]
+            inv_width = torch.where(width > 0, 1 / torch.where(width > 0, width, torch.ones_like(width)), torch.zeros_like(width))
+            if engine == 'poly':
+                poly = coef2poly(grid, act_fun.coef, self.k)
+                self.max_error = poly_error(grid, act_fun.coef, self.k, poly)
+                poly = (poly * (act_fun.scale_sp * act_fun.mask * subnode_scale[None,:])[:,None,None,:]).contiguous()
+                spline_weight = torch.zeros(0, self.out_dim)
+            else:
+                poly = torch.zeros(0, 0, 0, 0)
+                self.max_error = 0.
+
+        self.register_buffer('grid', grid)
+        self.register_buffer('grid_step', (grid[:, -1] - grid[:, 0]) / (grid.shape[1] - 1))
+        self.register_buffer('table', uniform_basis_table(self.k).to(dtype=grid.dtype))
+        self.register_buffer('grid_pad', extend_grid(grid, k_extend=self.k).contiguous())
+        self.register_buffer('spline_weight', spline_weight)
+        self.register_buffer('poly', poly)
+        self.register_buffer('inv_width', inv_width)
+        self.register_buffer('base_weight', base_weight)
+        self.register_buffer('bias', model.subnode_bias[l].detach().clone())
+
+        if model.symbolic_enabled and torch.any(symbolic_fun.mask != 0):
+            self.symbolic = KANInferenceSymbolic(symbolic_fun, subnode_scale)
+        else:
+            self.symbolic = None
+
+        self.dim_sum = model.width[l+1][0]
+        dim_mult = model.width[l+1][1]
+        if model.mult_homo == True:
+            arity = [model.mult_arity] * dim_mult
+        else:
+            arity = model.mult_arity[l+1]
+        mult_ids = torch.full((dim_mult, max(arity) if dim_mult > 0 else 0), self.out_dim, dtype=torch.long)
+        start = self.dim_sum
+        for j in range(dim_mult):
+            mult_ids[j,:arity[j]] = torch.arange(start, start + arity[j])
+            start += arity[j]
+        self.register_buffer('mult_ids', mult_ids)
+        self.register_buffer('node_scale', model.node_scale[l].detach().clone())
+        self.register_buffer('node_bias', model.node_bias[l].detach().clone())
+
+    def basis(self, x):
+        '''
+        dense B-spline bases, shape (batch, in_dim, number of coefficients): the k+1 non-zero bases of each sample scattered into place
+        '''
+        n_knot = self.grid.shape[1]
+        n_coef = n_knot - self.k - 1
+        if self.uniform:
+            values, idx = self.basis_uniform(x)
+        else:
+            values, idx = self.basis_local(x)
+        
+        # padded basis index of value r is idx + r (basis id idx - k + r); bases outside [0, n_coef) fall into the padding
+        dense = torch.zeros(x.shape[0], x.shape[1], n_coef + 2 * self.k, dtype=x.dtype, device=x.device)
+        dense.scatter_(2, idx.unsqueeze(2) + torch.arange(self.k + 1, device=x.device), values)
+        return dense[:, :, self.k:self.k + n_coef]
+
+    def basis_local(self, x):
+        '''
+        the k+1 non-zero bases of each sample and the knot interval idx (as spline.B_batch_local)
+        '''
+        n_knot = self.grid.shape[1]
+        idx = torch.searchsorted(self.grid, x.t().contiguous(), right=True).t() - 1
+        inside = (idx >= 0) & (idx < n_knot - 1)
+        idx = torch.clamp(idx, 0, n_knot - 2)
+        values = inside.unsqueeze(2).to(x.dtype)
+        if self.k > 0:
+            knots = torch.gather(self.grid_pad.unsqueeze(0).expand(x.shape[0], -1, -1), 2, idx.unsqueeze(2) + torch.arange(1, 2 * self.k + 1, device=x.device))
+            x_ = x.unsqueeze(2)
+            zero = torch.zeros_like(x_)
+            for j in range(1, self.k + 1):
+                left = x_ - knots[:, :, self.k - j:self.k]
+                right = knots[:, :, self.k:self.k + j] - x_
+                temp = torch.nan_to_num(values / (right + left))
+                values = torch.cat([right * temp, zero], dim=2) + torch.cat([zero, left * temp], dim=2)
+        return values, idx
+
+    def basis_uniform(self, x):
+        '''
+        the k+1 non-zero bases of each sample and the knot interval idx on uniform grids (as spline.B_batch_uniform)
+        '''
+        n_knot = self.grid.shape[1]
+        pos = (x - self.grid[:, 0]) / self.grid_step
+        idx = torch.floor(pos).long()
+        inside = (idx >= 0) & (idx < n_knot - 1)
+        idx = torch.clamp(idx, 0, n_knot - 2)
+        # local coordinate from the knot of the interval, as in spline.B_batch_uniform
+        in_id = torch.arange(self.in_dim, device=x.device).unsqueeze(0)
+        u = ((x - self.grid[in_id, idx]) / self.grid_step).unsqueeze(2)
+        values = self.table[:, self.k].expand(x.shape[0], x.shape[1], self.k + 1)
+        for p in range(self.k - 1, -1, -1):
+            values = values * u + self.table[:, p]
+        values = values * inside.unsqueeze(2).to(x.dtype)
+        return values, idx
+
+    def spline_poly(self, x):
+        '''
+        sum of the scaled splines over inputs, evaluated from the piecewise polynomials (as spline.poly2curve), shape (batch, out_dim)
+        '''
+        n_knot = self.grid.shape[1]
+        idx = torch.searchsorted(self.grid, x.t().contiguous(), right=True).t() - 1
+        inside = (idx >= 0) & (idx < n_knot - 1)
+        idx = torch.clamp(idx, 0, n_knot - 2)
+        in_id = torch.arange(self.in_dim, device=x.device).unsqueeze(0)
+        u = ((x - self.grid[in_id, idx]) * self.inv_width[in_id, idx] * inside.to(x.dtype)).unsqueeze(2)
+        c = self.poly[in_id, idx] * inside.to(x.dtype).unsqueeze(2).unsqueeze(3) # (batch, in_dim, k+1, out_dim)
+        y = c[:, :, self.k]
+        for p in range(self.k - 1, -1, -1):
+            y = y * u + c[:, :, p]
+        return y.sum(dim=1)
+
+    def forward(self, x):
+        batch = x.shape[0]
+        if self.engine == 'poly':
+            y = self.spline_poly(x) + self.bias
+        else:
+            y = self.basis(x).reshape(batch, -1) @ self.spline_weight + self.bias
+        if self.base == 'silu':
+            y = y + torch.nn.functional.silu(x) @ self.base_weight
+        elif self.base == 'identity':
+            y = y + x @ self.base_weight
+        if self.symbolic is not None:
+            y = y + self.symbolic(x)
+        
+        # multiplication
+        if self.mult_ids.shape[0] > 0:
+            y_ext = torch.cat([y, torch.ones_like(y[:, :1])], dim=1)
+            y = torch.cat([y[:, :self.dim_sum], y_ext[:, self.mult_ids].prod(dim=2)], dim=1)
+        return self.node_scale * y + self.node_bias
+
+
+class KANInference(nn.Module):
+    '''
+    inference-only module exported from a MultKAN (see MultKAN.export): no cache_data, no saved activations, no checkpointing,
+    frozen buffers instead of parameters. Without active symbolic edges it can be compiled with torch.jit.script
+    (symbolic functions are python callables); torch.export and torch.compile work in both cases.
+
+    Attributes:
+    -----------
+        layers : nn.ModuleList of KANInferenceLayer
+        input_id : 1D torch.long
+            input columns used by the model
+        max_error : float
+            maximum absolute error of the piecewise polynomials against coef2curve over all layers (engine='poly')
+
+    Example
+    -------
+    >>> from kan import *
+    >>> model = KAN(width=[2,5,1], grid=5, k=3, seed=0, auto_save=False)
+    >>> frozen = model.export()
+    >>> x = torch.rand(100,2)
+    >>> torch.allclose(frozen(x), model(x), atol=1e-6)
+    True
+    >>> scripted = torch.jit.script(frozen)
+    '''
+    def __init__(self, model, engine='basis'):
+        super(KANInference, self).__init__()
+        self.layers = nn.ModuleList([KANInferenceLayer(model, l, engine=engine) for l in range(model.depth)])
+        self.max_error = max([layer.max_error for layer in self.layers])
+        self.register_buffer('input_id', model.input_id.detach().clone().long())
+        self.to(model.device)
+
+    def forward(self, x):
+        x = x[:, self.input_id]
+        for layer in self.layers:
+            x = layer(x)
+        return x
@@ -1,4 +1,5 @@
 import torch
+from functools import lru_cache
 
 
 def B_batch(x, grid, k=0, extend=True, device='cpu'):
@@ -47,11 +48,215 @@ def B_batch(x, grid, k=0, extend=True, device='cpu'):
     return value
 
 
+def B_batch_local(x, grid, k=0, derivative=False):
+    '''
+    evaluate x on the k+1 nonzero B-spline bases only (iterative Cox-de Boor, bottom-up). B_batch is kept as the reference implementation.
+    For degenerate grids (repeated knots), 0/0 terms are treated as zero.
+
+    Args:
+    -----
+        x : 2D torch.tensor
+            inputs, shape (batch, in_dim)
+        grid : 2D torch.tensor
+            grids, shape (in_dim, number of grid points)
+        k : int
+            the piecewise polynomial order of splines.
+        derivative : bool
+            If True, the derivatives of the k+1 bases with respect to x are returned as well. Default: False.
+
+    Returns:
+    --------
+        values : 3D torch.tensor
+            shape (batch, in_dim, k+1). values[:,:,r] is the value of basis idx-k+r; bases outside [0, G+k) are set to zero.
+        idx : 2D torch.long
+            shape (batch, in_dim). the knot interval index m such that grid[m] <= x < grid[m+1], clamped to [0, number of grid points-2].
+        dvalues : 3D torch.tensor
+            shape (batch, in_dim, k+1). only returned if derivative=True.
+
+    Example
+    -------
+    >>> from kan.spline import B_batch_local
+    >>> x = torch.rand(100,2)
+    >>> grid = torch.linspace(-1,1,steps=11)[None, :].expand(2, 11)
+    >>> values, idx = B_batch_local(x, grid, k=3)
+    >>> values.shape, idx.shape
+    (torch.Size([100, 2, 4]), torch.Size([100, 2]))
+    '''
+
+    batch = x.shape[0]
+    n_knot = grid.shape[1]
+    n_coef = n_knot - k - 1
+
+    # knot interval of each sample, O(log G) per sample
+    idx = torch.searchsorted(grid.contiguous(), x.permute(1,0).contiguous(), right=True).permute(1,0) - 1
+    inside = (idx >= 0) * (idx < n_knot - 1)
+    idx = torch.clamp(idx, 0, n_knot - 2)
+
+    values = inside[:,:,None].to(x.dtype)
+    dvalues = torch.zeros_like(values)
+
+    if k > 0:
+        # knots grid[m-k+1], ..., grid[m+k]; the grid is padded so that bases near the boundary are well defined
+        grid_pad = extend_grid(grid, k_extend=k)
+        offset = torch.arange(1, 2*k+1, device=x.device)
+        knots = torch.gather(grid_pad[None,:,:].expand(batch, -1, -1), 2, idx[:,:,None] + offset[None,None,:])
+        x_ = x[:,:,None]
+        for j in range(1, k+1):
+            left = x_ - knots[:,:,k-j:k]
+            right = knots[:,:,k:k+j] - x_
+            temp = torch.nan_to_num(values / (right + left))
+            values = torch.cat([right * temp, torch.zeros_like(x_)], dim=2) + torch.cat([torch.zeros_like(x_), left * temp], dim=2)
+        # N'_{s,k} = k * (N_{s,k-1}/(t_{s+k}-t_s) - N_{s+1,k-1}/(t_{s+k+1}-t_{s+1})), temp holds N_{.,k-1}/(t_{.+k}-t_.) from the last step
+        dvalues = k * (torch.cat([torch.zeros_like(x_), temp], dim=2) - torch.cat([temp, torch.zeros_like(x_)], dim=2))
+
+        # drop bases that fall outside [0, G+k)
+        basis_id = idx[:,:,None] - k + torch.arange(k+1, device=x.device)[None,None,:]
+        in_range = (basis_id >= 0) * (basis_id < n_coef)
+        values = values * in_range
+        dvalues = dvalues * in_range
+
+    if derivative:
+        return values, idx, dvalues
+    return values, idx
+
+
+def is_uniform_grid(grid, rtol=1e-5):
+    '''
+    check whether every row of a grid is uniformly spaced (up to floating point error)
+
+    B_batch_uniform evaluates the bases of ideal uniform knots, so its error relative to B_batch on the actual knots is
+    about the largest knot deviation / h. Fine float32 grids (e.g. linspace with G ~ 1000) deviate by more than rtol
+    and are evaluated with B_batch_local instead.
+
+    Args:
+    -----
+        grid : 2D torch.tensor
+            shape (in_dim, number of grid points)
+        rtol : float
+            tolerance on the deviation of knots, relative to the grid spacing
+
+    Returns:
+    --------
+        bool
+
+    Example
+    -------
+    >>> from kan.spline import is_uniform_grid, extend_grid
+    >>> grid = extend_grid(torch.linspace(-1,1,steps=11)[None, :].expand(2, 11), k_extend=3)
+    >>> is_uniform_grid(grid)
+    True
+    '''
+    n_knot = grid.shape[1]
+    if n_knot < 2:
+        return False
+    h = (grid[:, [-1]] - grid[:, [0]]) / (n_knot - 1)
+    if not torch.all(h > 0):
+        return False
+    deviation = torch.abs(grid - (grid[:, [0]] + h * torch.arange(n_knot, device=grid.device)[None, :]))
+    return bool(torch.all(deviation <= rtol * h))
+
+
+@lru_cache(maxsize=None)
+def uniform_basis_table(k):
+    '''
+    polynomial coefficients of the k+1 nonzero B-spline bases on a uniform grid
+
+    Args:
+    -----
+        k : int
+            the piecewise polynomial order of splines.
+
+    Returns:
+    --------
+        table : 2D torch.float64
+            shape (k+1, k+1). On the knot interval [t_m, t_m+h), basis m-k+r equals sum_p table[r,p] * u**p with u = (x-t_m)/h.
+    '''
+    # Cox-de Boor recursion carried out on polynomials in u (uniform knots: left = u+j-1-r, right = r+1-u, left+right = j)
+    table = torch.ones(1, 1, dtype=torch.float64)
+    for j in range(1, k+1):
+        new = torch.zeros(j+1, j+1, dtype=torch.float64)
+        for r in range(j):
+            # (r+1-u) * N_r / j
+            new[r, :j] += (r + 1) * table[r] / j
+            new[r, 1:] -= table[r] / j
+            # (u+j-1-r) * N_r / j contributes to basis r+1
+            new[r+1, :j] += (j - 1 - r) * table[r] / j
+            new[r+1, 1:] += table[r] / j
+        table = new
+    return table
+
+
+def B_batch_uniform(x, grid, k=0, derivative=False):
+    '''
+    evaluate x on the k+1 nonzero B-spline bases of a uniform grid. Same outputs as B_batch_local, but the knot interval is
+    computed as floor((x-grid[:,0])/h) and the bases are read from fixed polynomial tables (uniform_basis_table), evaluated at
+    the local coordinate u = (x-grid[:,idx])/h.
+
+    Args:
+    -----
+        x : 2D torch.tensor
+            inputs, shape (batch, in_dim)
+        grid : 2D torch.tensor
+            uniform grids, shape (in_dim, number of grid points)
+        k : int
+            the piecewise polynomial order of splines.
+        derivative : bool
+            If True, the derivatives of the k+1 bases with respect to x are returned as well. Default: False.
+
+    Returns:
+    --------
+        values : 3D torch.tensor
+            shape (batch, in_dim, k+1)
+        idx : 2D torch.long
+            shape (batch, in_dim)
+        dvalues : 3D torch.tensor
+            shape (batch, in_dim, k+1). only returned if derivative=True.
+
+    Example
+    -------
+    >>> from kan.spline import B_batch_uniform
+    >>> x = torch.rand(100,2)
+    >>> grid = torch.linspace(-1,1,steps=11)[None, :].expand(2, 11)
+    >>> values, idx = B_batch_uniform(x, grid, k=3)
+    >>> values.shape, idx.shape
+    (torch.Size([100, 2, 4]), torch.Size([100, 2]))
+    '''
+    n_knot = grid.shape[1]
+    n_coef = n_knot - k - 1
+    h = (grid[:, -1] - grid[:, 0]) / (n_knot - 1)
+    pos = (x - grid[None, :, 0]) / h[None, :]
+    idx = torch.floor(pos.detach()).long()
+    inside = (idx >= 0) * (idx < n_knot - 1)
+    idx = torch.clamp(idx, 0, n_knot - 2)
+    # local coordinate from the knot of the interval (pos - idx loses precision as the number of intervals grows)
+    knot = grid[torch.arange(x.shape[1], device=x.device)[None, :], idx]
+    u = (x - knot) / h[None, :]
 
-def coef2curve(x_eval, grid, coef, k, device="cpu"):
+    # Horner evaluation of the basis polynomials
+    table = uniform_basis_table(k).to(device=x.device, dtype=x.dtype)
+    values = table[None, None, :, k].expand(x.shape[0], x.shape[1], k+1)
+    for p in range(k-1, -1, -1):
+        values = values * u[:, :, None] + table[None, None, :, p]
+    values = values * inside[:, :, None]
+
+    basis_id = idx[:, :, None] - k + torch.arange(k+1, device=x.device)[None, None, :]
+    in_range = (basis_id >= 0) * (basis_id < n_coef)
+    values = values * in_range
+
+    if derivative:
+        # d/dx = (d/du) / h
+        dvalues = torch.zeros_like(values)
+        for p in range(k, 0, -1):
+            dvalues = dvalues * u[:, :, None] + p * table[None, None, :, p]
+        dvalues = dvalues / h[None, :, None] * inside[:, :, None] * in_range
+        return values, idx, dvalues
+    return values, idx
+
+
+def coef2curve(x_eval, grid, coef, k, device="cpu", sparse=False, uniform=False):
     '''
     converting B-spline coefficients to B-spline curves. Evaluate x on B-spline curves (summing up B_batch results over B-spline basis).
-    
+
     Args:
     -----
         x_eval : 2D torch.tensor
@@ -64,24 +269,234 @@ def coef2curve(x_eval, grid, coef, k, device="cpu"):
             the piecewise polynomial order of splines.
         device : str
             devicde
-        
+        sparse : bool
+            If True, only the k+1 coefficients whose bases are nonzero at each sample are gathered (local support),
+            so the cost does not grow with G. If False, all G+k bases are evaluated. Default: False.
+        uniform : bool
+            If True, the grid is assumed to be uniform (see is_uniform_grid) and bases are computed with B_batch_uniform. Default: False.
+
+    Returns:
+    --------
+        y_eval : 3D torch.tensor
+            shape (batch, in_dim, out_dim)
+
+    '''
+
+    if uniform:
+        values, idx = B_batch_uniform(x_eval, grid, k=k)
+    elif sparse:
+        values, idx = B_batch_local(x_eval, grid, k=k)
+
+    if sparse:
+        return local2curve(values, idx, coef.to(values.device), k)
+
+    if uniform:
+        b_splines = local2dense(values, idx, k, coef.shape[2])
+    else:
+        b_splines = B_batch(x_eval, grid, k=k)
+    y_eval = torch.einsum('ijk,jlk->ijl', b_splines, coef.to(b_splines.device))
+
+    return y_eval
+
+
+def local2curve(values, idx, coef, k):
+    '''
+    sum up local B-spline bases (from B_batch_local) against the k+1 active coefficients
+
+    Args:
+    -----
+        values : 3D torch.tensor
+            shape (batch, in_dim, k+1)
+        idx : 2D torch.long
+            shape (batch, in_dim)
+        coef : 3D torch.tensor
+            shape (in_dim, out_dim, G+k)
+        k : int
+            the piecewise polynomial order of splines.
+
     Returns:
     --------
         y_eval : 3D torch.tensor
             shape (batch, in_dim, out_dim)
+    '''
+    in_dim = coef.shape[0]
+    n_coef = coef.shape[2]
+    # bases outside [0, G+k) have zero values, so clamping their ids is harmless
+    basis_id = torch.clamp(idx[:,:,None] - k + torch.arange(k+1, device=idx.device)[None,None,:], 0, n_coef - 1)
+    coef_active = coef.permute(0,2,1)[torch.arange(in_dim, device=idx.device)[None,:,None], basis_id] # (batch, in_dim, k+1, out_dim)
+    y_eval = torch.einsum('ijk,ijkl->ijl', values, coef_active)
+    return y_eval
+
+
+def local2dense(values, idx, k, n_coef):
+    '''
+    scatter local B-spline bases (from B_batch_local) into the dense layout of B_batch
+
+    Args:
+    -----
+        values : 3D torch.tensor
+            shape (batch, in_dim, k+1)
+        idx : 2D torch.long
+            shape (batch, in_dim)
+        k : int
+            the piecewise polynomial order of splines.
+        n_coef : int
+            the number of bases G+k
+
+    Returns:
+    --------
+        spline values : 3D torch.tensor
+            shape (batch, in_dim, G+k)
+    '''
+    batch, in_dim = idx.shape
+    # bases outside [0, G+k) land in the k+1 padding slots on each side and are dropped
+    basis_id = idx[:,:,None] + 1 + torch.arange(k+1, device=idx.device)[None,None,:]
+    dense = torch.zeros(batch, in_dim, n_coef + 2*k + 2, device=values.device, dtype=values.dtype)
+    dense = dense.scatter_add(2, basis_id, values)
+    return dense[:,:,k+1:k+1+n_coef]
+
+
+def coef2poly(grid, coef, k):
+    '''
+    convert B-spline coefficients to piecewise polynomials: on knot interval m of input i, the spline is
+    sum_p poly[i,m,p,:] * u**p with u = (x - grid[i,m]) / (grid[i,m+1] - grid[i,m]) in [0, 1).
+    The conversion is exact up to rounding (computed in float64 from k+1 samples per interval).
+    
+    Args:
+    -----
+        grid : 2D torch.tensor
+            shape (in_dim, G+2k+1)
+        coef : 3D torch.tensor
+            shape (in_dim, out_dim, G+k)
+        k : int
+            the piecewise polynomial order of splines.
         
+    Returns:
+    --------
+        poly : 4D torch.tensor
+            shape (in_dim, G+2k, k+1, out_dim), same dtype as coef. Degenerate (zero width) intervals have zero polynomials.
+      
+    Example
+    -------
+    >>> from kan.spline import coef2poly
+    >>> in_dim = 3; out_dim = 2; G = 5; k = 3
+    >>> grid = torch.linspace(-1,1,steps=G+2*k+1)[None,:].expand(in_dim, G+2*k+1)
+    >>> coef = torch.normal(0,1,size=(in_dim, out_dim, G+k))
+    >>> coef2poly(grid, coef, k).shape
+    torch.Size([3, 11, 4, 2])
     '''
+    in_dim, out_dim, _ = coef.shape
+    n_interval = grid.shape[1] - 1
+    grid64 = grid.to(torch.float64)
+    width = grid64[:,1:] - grid64[:,:-1]
     
-    b_splines = B_batch(x_eval, grid, k=k)
-    y_eval = torch.einsum('ijk,jlk->ijl', b_splines, coef.to(b_splines.device))
+    # k+1 interior sample points per interval, u_j = (j + 1/2) / (k+1)
+    u = (torch.arange(k+1, dtype=torch.float64, device=grid.device) + 0.5) / (k+1)
+    x_eval = grid64[:,:-1,None] + width[:,:,None] * u[None,None,:] # (in_dim, n_interval, k+1)
+    y_eval = coef2curve(x_eval.reshape(in_dim, -1).permute(1,0), grid64, coef.to(torch.float64), k) # (n_interval*(k+1), in_dim, out_dim)
+    y_eval = y_eval.permute(1,0,2).reshape(in_dim, n_interval, k+1, out_dim)
     
-    return y_eval
+    # solve the Vandermonde system V @ poly = y for every interval at once
+    vander_inv = torch.linalg.inv(u[:,None] ** torch.arange(k+1, dtype=torch.float64, device=grid.device)[None,:])
+    poly = torch.einsum('pj,imjo->impo', vander_inv, y_eval)
+    poly = poly * (width > 0)[:,:,None,None]
+    return poly.to(coef.dtype)
+
+
+def poly2curve(x_eval, grid, poly):
+    '''
+    evaluate piecewise polynomials (from coef2poly): one bucketize and one Horner chain per edge. Zero outside [grid[:,0], grid[:,-1]), as coef2curve.
+    
+    Args:
+    -----
+        x_eval : 2D torch.tensor
+            shape (batch, in_dim)
+        grid : 2D torch.tensor
+            shape (in_dim, G+2k+1)
+        poly : 4D torch.tensor
+            shape (in_dim, G+2k, k+1, out_dim)
+        
+    Returns:
+    --------
+        y_eval : 3D torch.tensor
+            shape (batch, in_dim, out_dim)
+      
+    Example
+    -------
+    >>> from kan.spline import coef2poly, poly2curve
+    >>> in_dim = 3; out_dim = 2; G = 5; k = 3
+    >>> grid = torch.linspace(-1,1,steps=G+2*k+1)[None,:].expand(in_dim, G+2*k+1)
+    >>> coef = torch.normal(0,1,size=(in_dim, out_dim, G+k))
+    >>> x = torch.rand(100, in_dim)
+    >>> torch.allclose(poly2curve(x, grid, coef2poly(grid, coef, k)), coef2curve(x, grid, coef, k), atol=1e-5)
+    True
+    '''
+    in_dim = grid.shape[0]
+    n_knot = grid.shape[1]
+    k = poly.shape[2] - 1
+    
+    idx = torch.searchsorted(grid.contiguous(), x_eval.permute(1,0).contiguous(), right=True).permute(1,0) - 1
+    inside = (idx >= 0) * (idx < n_knot - 1)
+    idx = torch.clamp(idx, 0, n_knot - 2)
+    
+    width = grid[:,1:] - grid[:,:-1]
+    inv_width = torch.where(width > 0, 1 / torch.where(width > 0, width, torch.ones_like(width)), torch.zeros_like(width))
+    in_id = torch.arange(in_dim, device=x_eval.device)[None,:]
+    u = ((x_eval - grid[in_id, idx]) * inv_width[in_id, idx])[:,:,None]
+    
+    c = poly[in_id, idx] # (batch, in_dim, k+1, out_dim)
+    y_eval = c[:,:,k]
+    for p in range(k-1, -1, -1):
+        y_eval = y_eval * u + c[:,:,p]
+    return y_eval * inside[:,:,None]
+
+
+def poly_error(grid, coef, k, poly, x_eval=None, n_sample=8):
+    '''
+    maximum absolute difference between poly2curve and coef2curve
+    
+    Args:
+    -----
+        grid : 2D torch.tensor
+            shape (in_dim, G+2k+1)
+        coef : 3D torch.tensor
+            shape (in_dim, out_dim, G+k)
+        k : int
+            the piecewise polynomial order of splines.
+        poly : 4D torch.tensor
+            shape (in_dim, G+2k, k+1, out_dim)
+        x_eval : None or 2D torch.tensor
+            points to compare on, shape (batch, in_dim). If None, n_sample evenly spaced points in every knot interval.
+        n_sample : int
+            number of points per interval if x_eval is None
+        
+    Returns:
+    --------
+        max_error : float
+      
+    Example
+    -------
+    >>> from kan.spline import coef2poly, poly_error
+    >>> in_dim = 3; out_dim = 2; G = 5; k = 3
+    >>> grid = torch.linspace(-1,1,steps=G+2*k+1)[None,:].expand(in_dim, G+2*k+1)
+    >>> coef = torch.normal(0,1,size=(in_dim, out_dim, G+k))
+    >>> poly_error(grid, coef, k, coef2poly(grid, coef, k)) < 1e-5 # float32 rounding
+    True
+    '''
+    if x_eval == None:
+        u = torch.arange(n_sample, dtype=grid.dtype, device=grid.device) / n_sample
+        x_eval = (grid[:,:-1,None] + (grid[:,1:,None] - grid[:,:-1,None]) * u[None,None,:]).reshape(grid.shape[0], -1).permute(1,0)
+    error = poly2curve(x_eval, grid, poly) - coef2curve(x_eval, grid, coef, k)
+    return torch.max(torch.abs(error)).item()
 
 
-def curve2coef(x_eval, y_eval, grid, k):
+def curve2coef(x_eval, y_eval, grid, k, solver='lstsq', lamb=1e-8):
     '''
     converting B-spline curves to B-spline coefficients using least squares.
     
+    The design matrix only depends on the input dimension, so it is factorized once per input dimension 
+    and all out_dim right-hand sides are solved together.
+    
     Args:
     -----
         x_eval : 2D torch.tensor
@@ -92,43 +507,156 @@ def curve2coef(x_eval, y_eval, grid, k):
             shape (in_dim, grid+2*k)
         k : int
             spline order
+        solver : str
+            'lstsq': QR based least squares (torch.linalg.lstsq) of the (batch, G+k) design matrices.
+            'cholesky': normal equations B^T B c = B^T y with a ridge lamb, solved by Cholesky. B^T B is banded (bandwidth k), but is stored and
+                factorized as a dense (G+k, G+k) matrix, which is cheap for the usual grid sizes.
+            If lstsq fails, the cholesky solver is used.
         lamb : float
-            regularized least square lambda
+            regularized least square lambda (relative to the mean diagonal of B^T B, 'cholesky' only)
             
     Returns:
     --------
         coef : 3D torch.tensor
             shape (in_dim, out_dim, G+k)
+            
+    Example
+    -------
+    >>> grid = extend_grid(torch.linspace(-1,1,steps=6)[None,:].expand(2,-1), k_extend=3)
+    >>> x = torch.rand(100,2)*2-1
+    >>> y = torch.stack([torch.sin(3*x), x**2], dim=2)
+    >>> curve2coef(x, y, grid, 3).shape
+    torch.Size([2, 2, 8])
     '''
     #print('haha', x_eval.shape, y_eval.shape, grid.shape)
-    batch = x_eval.shape[0]
-    in_dim = x_eval.shape[1]
-    out_dim = y_eval.shape[2]
-    n_coef = grid.shape[1] - k - 1
-    mat = B_batch(x_eval, grid, k)
-    mat = mat.permute(1,0,2)[:,None,:,:].expand(in_dim, out_dim, batch, n_coef)
-    #print('mat', mat.shape)
-    y_eval = y_eval.permute(1,2,0).unsqueeze(dim=3)
-    #print('y_eval', y_eval.shape)
-    device = mat.device
-    
-    #coef = torch.linalg.lstsq(mat, y_eval, driver='gelsy' if device == 'cpu' else 'gels').solution[:,:,:,0]
-    try:
-        coef = torch.linalg.lstsq(mat, y_eval).solution[:,:,:,0]
-    except:
-        print('lstsq failed')
-    
-    # manual psuedo-inverse
-    '''lamb=1e-8
-    XtX = torch.einsum('ijmn,ijnp->ijmp', mat.permute(0,1,3,2), mat)
-    Xty = torch.einsum('ijmn,ijnp->ijmp', mat.permute(0,1,3,2), y_eval)
-    n1, n2, n = XtX.shape[0], XtX.shape[1], XtX.shape[2]
-    identity = torch.eye(n,n)[None, None, :, :].expand(n1, n2, n, n).to(device)
-    A = XtX + lamb * identity
-    B = Xty
-    coef = (A.pinverse() @ B)[:,:,:,0]'''
-    
-    return coef
+    mat = B_batch(x_eval, grid, k).permute(1,0,2) # (in_dim, batch, n_coef)
+    y_eval = y_eval.permute(1,0,2) # (in_dim, batch, out_dim)
+    
+    coef = None
+    if solver == 'lstsq':
+        try:
+            coef = torch.linalg.lstsq(mat, y_eval).solution
+        except Exception:
+            print('lstsq failed, using cholesky')
+    
+    if coef == None:
+        n_coef = mat.shape[2]
+        XtX = mat.permute(0,2,1) @ mat
+        Xty = mat.permute(0,2,1) @ y_eval
+        scale = torch.diagonal(XtX, dim1=1, dim2=2).mean(dim=1)[:,None,None].clamp(min=1e-12)
+        identity = torch.eye(n_coef, device=mat.device, dtype=mat.dtype)[None,:,:]
+        L, info = torch.linalg.cholesky_ex(XtX + lamb * scale * identity)
+        if torch.any(info > 0):
+            # numerically indefinite (e.g. float32 with empty intervals): solve the regularized system directly
+            coef = torch.linalg.pinv(XtX + lamb * scale * identity) @ Xty
+        else:
+            coef = torch.cholesky_solve(Xty, L)
+    
+    return coef.permute(0,2,1)
+
+
+def insert_knots(grid, coef, k, knots):
+    '''
+    Boehm knot insertion: express the same B-spline curves on a finer knot vector (no data, no least squares).
+
+    Args:
+    -----
+        grid : 2D torch.tensor
+            shape (in_dim, G+2k+1), sorted knots
+        coef : 3D torch.tensor
+            shape (in_dim, out_dim, G+k)
+        k : int
+            spline order
+        knots : 2D torch.tensor
+            shape (in_dim, number of knots to insert). Each knot should lie in [grid[:,0], grid[:,-1]].
+
+    Returns:
+    --------
+        grid : 2D torch.tensor
+            shape (in_dim, G+2k+1+r), r = knots.shape[1]
+        coef : 3D torch.tensor
+            shape (in_dim, out_dim, G+k+r)
+
+    Example
+    -------
+    >>> grid = extend_grid(torch.linspace(-1,1,steps=6)[None,:], k_extend=3)
+    >>> coef = torch.normal(0,1,size=(1,2,8))
+    >>> grid_fine, coef_fine = insert_knots(grid, coef, 3, torch.tensor([[0.1,0.5]]))
+    >>> x = torch.rand(100,1)*2-1
+    >>> (coef2curve(x, grid, coef, 3) - coef2curve(x, grid_fine, coef_fine, 3)).abs().max() # ~1e-7
+    '''
+    for j in range(knots.shape[1]):
+        x = knots[:, [j]]
+        n_coef = coef.shape[2]
+        # t_l <= x < t_{l+1}
+        l = torch.searchsorted(grid.contiguous(), x.contiguous(), right=True) - 1
+        i = torch.arange(n_coef + 1, device=grid.device)[None, :]
+        t_i = grid[:, :n_coef+1]
+        t_ik = grid[:, k:n_coef+k+1]
+        alpha = (x - t_i) / torch.where(t_ik > t_i, t_ik - t_i, torch.ones_like(t_i))
+        # c'_i = c_i for i <= l-k, c'_i = c_{i-1} for i > l, convex combination in between
+        alpha = torch.where(i <= l - k, torch.ones_like(alpha), torch.where(i > l, torch.zeros_like(alpha), alpha))[:, None, :]
+        coef = alpha * torch.nn.functional.pad(coef, (0, 1)) + (1 - alpha) * torch.nn.functional.pad(coef, (1, 0))
+        grid = torch.sort(torch.cat([grid, x], dim=1), dim=1)[0]
+    return grid, coef
+
+
+def refine_coef(grid, coef, k, new_grid, rtol=1e-4):
+    '''
+    exact B-spline coefficients on new_grid for the curves given by (grid, coef), using knot insertion.
+
+    This requires nested grids: every knot of grid lying inside new_grid has to be a knot of new_grid (up to rtol),
+    e.g. refining G -> m*G intervals with the interpolated grids of KANLayer.initialize_grid_from_parent.
+    The curves are then reproduced exactly on [new_grid[:,k], new_grid[:,-k-1]] (the region covered by samples
+    in curve2coef), without any samples.
+
+    Args:
+    -----
+        grid : 2D torch.tensor
+            shape (in_dim, G+2k+1)
+        coef : 3D torch.tensor
+            shape (in_dim, out_dim, G+k)
+        k : int
+            spline order (same for both grids)
+        new_grid : 2D torch.tensor
+            shape (in_dim, G'+2k+1)
+        rtol : float
+            knots closer than rtol * (smallest knot spacing of grid) are treated as the same knot
+
+    Returns:
+    --------
+        coef : 3D torch.tensor or None
+            shape (in_dim, out_dim, G'+k); None if the grids are not nested
+
+    Example
+    -------
+    >>> grid = extend_grid(torch.linspace(-1,1,steps=6)[None,:], k_extend=3)
+    >>> new_grid = extend_grid(torch.linspace(-1,1,steps=11)[None,:], k_extend=3)
+    >>> coef = torch.normal(0,1,size=(1,2,8))
+    >>> new_coef = refine_coef(grid, coef, 3, new_grid)
+    >>> x = torch.rand(100,1)*2-1
+    >>> (coef2curve(x, grid, coef, 3) - coef2curve(x, new_grid, new_coef, 3)).abs().max() # ~1e-7
+    '''
+    tol = rtol * (grid[:, 1:] - grid[:, :-1]).min(dim=1, keepdim=True)[0]
+    if torch.any(new_grid[:, [0]] < grid[:, [0]] - tol) or torch.any(new_grid[:, [-1]] > grid[:, [-1]] + tol):
+        return None
+
+    close = (new_grid[:, :, None] - grid[:, None, :]).abs() <= tol[:, :, None]
+    matched_new = close.any(dim=2)
+    matched_old = close.any(dim=1)
+    inside = (grid > new_grid[:, [0]] + tol) & (grid < new_grid[:, [-1]] - tol)
+    n_insert = (~matched_new).sum(dim=1)
+    if torch.any(inside & ~matched_old) or torch.any(n_insert != n_insert[0]):
+        return None
+
+    knots = new_grid[~matched_new].reshape(grid.shape[0], -1)
+    grid_fine, coef_fine = insert_knots(grid, coef, k, knots)
+
+    # new_grid is a contiguous window of grid_fine; its B-splines are the ones active on [new_grid[:,k], new_grid[:,-k-1]]
+    start = ((grid_fine - new_grid[:, [0]]).abs() <= tol).int().argmax(dim=1)
+    n_coef = new_grid.shape[1] - k - 1
+    idx = start[:, None] + torch.arange(n_coef, device=grid.device)[None, :]
+    return torch.gather(coef_fine, 2, idx[:, None, :].expand(-1, coef.shape[1], -1))
 
 
 def extend_grid(grid, k_extend=0):
@@ -1,10 +1,48 @@
 import numpy as np
 import torch
-from sklearn.linear_model import LinearRegression
-import sympy
-import yaml
-from sympy.utilities.lambdify import lambdify
 import re
+import threading
+import os
+import queue
+import hashlib
+import importlib
+import types
+from collections import OrderedDict
+
+
+class LazyModule(types.ModuleType):
+    '''
+    module placeholder that imports the real module on first attribute access.
+    
+    Heavy optional dependencies (sympy, matplotlib, pandas, yaml, sklearn) are bound through LazyModule, 
+    so that importing kan and running the numeric path (KANLayer, MultKAN.forward, fit) only loads torch and numpy.
+    
+    Args:
+    -----
+        name : str
+            absolute module name, e.g. 'matplotlib.pyplot'
+            
+    Example
+    -------
+    >>> plt = LazyModule('matplotlib.pyplot')
+    >>> 'matplotlib.pyplot' in sys.modules # not imported yet (unless someone else did)
+    >>> plt.figure() # imports matplotlib.pyplot here
+    '''
+    def __init__(self, name):
+        super().__init__(name)
+
+    def __getattr__(self, attr):
+        # only reached for names missing from __dict__, i.e. before the module was loaded
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __dir__(self):
+        return dir(importlib.import_module(self.__name__))
+
+
+sympy = LazyModule('sympy')
+yaml = LazyModule('yaml')
 
 # sigmoid = sympy.Function('sigmoid')
 # name: (torch implementation, sympy implementation)
@@ -59,6 +97,9 @@ SYMBOLIC_LIB = {'x': (lambda x: x, lambda x: x, 1, lambda x, y_th: ((), x)),
                  #'relu': (lambda x: torch.relu(x), relu),
 }
 
+# the functions SYMBOLIC_LIB is created with; a process started with 'spawn' (see fit_params_parallel) only knows these
+BUILTIN_SYMBOLIC_FUNS = {name: entry[0] for name, entry in SYMBOLIC_LIB.items()}
+
 def create_dataset(f, 
                    n_var=2, 
                    f_mode = 'col',
@@ -160,7 +201,7 @@ def create_dataset(f,
 
 
 
-def fit_params(x, y, fun, a_range=(-10,10), b_range=(-10,10), grid_number=101, iteration=3, verbose=True, device='cpu'):
+def fit_params(x, y, fun, a_range=(-10,10), b_range=(-10,10), grid_number=101, iteration=3, verbose=True, device='cpu', max_elements=2**20, lm_steps=0):
     '''
     fit a, b, c, d such that
     
@@ -189,6 +230,10 @@ def fit_params(x, y, fun, a_range=(-10,10), b_range=(-10,10), grid_number=101, i
             print extra information if True
         device : str
             device
+        max_elements : int
+            memory budget of the (a, b) sweep, in elements (see fit_params_batch)
+        lm_steps : int
+            number of Levenberg-Marquardt refinement steps after the sweep (see fit_params_batch). Default: 0.
         
     Returns:
     --------
@@ -214,57 +259,616 @@ def fit_params(x, y, fun, a_range=(-10,10), b_range=(-10,10), grid_number=101, i
     (tensor([2.9982, 1.9996, 5.0053, 0.7011]), tensor(1.0000))
     '''
     # fit a, b, c, d such that y=c*fun(a*x+b)+d; both x and y are 1D array.
-    # sweep a and b, choose the best fitted model   
-    for _ in range(iteration):
-        a_ = torch.linspace(a_range[0], a_range[1], steps=grid_number, device=device)
-        b_ = torch.linspace(b_range[0], b_range[1], steps=grid_number, device=device)
-        a_grid, b_grid = torch.meshgrid(a_, b_, indexing='ij')
-        post_fun = fun(a_grid[None,:,:] * x[:,None,None] + b_grid[None,:,:])
-        x_mean = torch.mean(post_fun, dim=[0], keepdim=True)
-        y_mean = torch.mean(y, dim=[0], keepdim=True)
-        numerator = torch.sum((post_fun - x_mean)*(y-y_mean)[:,None,None], dim=0)**2
-        denominator = torch.sum((post_fun - x_mean)**2, dim=0)*torch.sum((y - y_mean)[:,None,None]**2, dim=0)
-        r2 = numerator/(denominator+1e-4)
-        r2 = torch.nan_to_num(r2)
-        
-        
-        best_id = torch.argmax(r2)
-        a_id, b_id = torch.div(best_id, grid_number, rounding_mode='floor'), best_id % grid_number
-        
-        
-        if a_id == 0 or a_id == grid_number - 1 or b_id == 0 or b_id == grid_number - 1:
-            if _ == 0 and verbose==True:
-                print('Best value at boundary.')
-            if a_id == 0:
-                a_range = [a_[0], a_[1]]
-            if a_id == grid_number - 1:
-                a_range = [a_[-2], a_[-1]]
-            if b_id == 0:
-                b_range = [b_[0], b_[1]]
-            if b_id == grid_number - 1:
-                b_range = [b_[-2], b_[-1]]
-            
-        else:
-            a_range = [a_[a_id-1], a_[a_id+1]]
-            b_range = [b_[b_id-1], b_[b_id+1]]
-            
-    a_best = a_[a_id]
-    b_best = b_[b_id]
-    post_fun = fun(a_best * x + b_best)
-    r2_best = r2[a_id, b_id]
+    params, r2 = fit_params_batch(x[None,:], y[None,:], [fun], a_range=a_range, b_range=b_range, grid_number=grid_number, iteration=iteration, verbose=verbose, device=device, max_elements=max_elements, lm_steps=lm_steps)
+    r2_best = r2[0,0]
     
     if verbose == True:
         print(f"r2 is {r2_best}")
         if r2_best < 0.9:
             print(f'r2 is not very high, please double check if you are choosing the correct symbolic function.')
 
-    post_fun = torch.nan_to_num(post_fun)
-    reg = LinearRegression().fit(post_fun[:,None].detach().cpu().numpy(), y.detach().cpu().numpy())
-    c_best = torch.from_numpy(reg.coef_)[0].to(device)
-    d_best = torch.from_numpy(np.array(reg.intercept_)).to(device)
-    return torch.stack([a_best, b_best, c_best, d_best]), r2_best
+    return params[0,0], r2_best
 
 
+def fit_params_batch(x, y, funs, a_range=(-10,10), b_range=(-10,10), grid_number=101, iteration=3, verbose=False, device='cpu', max_elements=2**20, lm_steps=0, lm_starts=4):
+    '''
+    fit a, b, c, d such that
+    
+    .. math::
+        |y-(cf(ax+b)+d)|^2
+        
+    is minimized, for every function in funs and every row (edge) of x and y, without sklearn. For each edge, (a, b) are swept on a grid_number x grid_number grid
+    (zoomed in iteration times, as in fit_params), and c, d are then given by closed-form least squares.
+    
+    Args:
+    -----
+        x : 2D array
+            x values, shape (number of edges, number of samples)
+        y : 2D array
+            y values, shape (number of edges, number of samples)
+        funs : list of functions
+            candidate symbolic functions (elementwise)
+        a_range : tuple
+            sweeping range of a
+        b_range : tuple
+            sweeping range of b
+        grid_number : int
+            number of steps along a and b
+        iteration : int
+            number of zooming in
+        verbose : bool
+            print extra information if True
+        device : str
+            device
+        max_elements : int
+            memory budget: the sweep is evaluated in tiles (edges, samples, a values, b values) of at most max_elements elements (but at least one sample and one a row per tile).
+            Edges are batched first; if a single edge does not fit, the a values are tiled; if a single row of a still does not fit, the samples are tiled too and
+            the r2 statistics are accumulated with pairwise (Chan et al.) updates, so peak memory does not scale with grid_number**2 * number of samples.
+        lm_steps : int
+            if positive, (a, b, c, d) are refined from the best grid point with lm_steps Levenberg-Marquardt steps (see refine_params); the refined
+            parameters are kept only where they improve r2, so r2 is never below the grid search with the same grid_number. With a coarse grid (e.g. grid_number=21)
+            this matches the default 101x101 sweep for smooth functions; optima narrower than the coarse grid spacing may still be missed. Default: 0.
+        lm_starts : int
+            with lm_steps > 0, LM also starts from the lm_starts best local maxima of the first (coarsest) grid, and the best result is kept.
+            On a coarse grid of a multimodal function (e.g. sin) the single best grid point may lie in the wrong basin. Default: 4.
+        
+    Returns:
+    --------
+        params : 3D torch.float
+            fitted (a, b, c, d), shape (number of functions, number of edges, 4)
+        r2 : 2D torch.float
+            best r2 (coefficient of determination), shape (number of functions, number of edges)
+    
+    Example
+    -------
+    >>> num = 100
+    >>> x = torch.linspace(-1,1,steps=num)[None,:].expand(2, num)
+    >>> y = torch.stack([5.0*torch.sin(3.0*x[0] + 2.0) + 0.7, x[1]**2])
+    >>> params, r2 = fit_params_batch(x, y, [torch.sin, lambda x: x**2])
+    >>> params.shape, r2.shape
+    (torch.Size([2, 2, 4]), torch.Size([2, 2]))
+    '''
+    x = x.to(device)
+    y = y.to(device)
+    n_edge, n_sample = x.shape
+    # tile sizes: edges first, then rows of a, then samples
+    chunk = max(1, max_elements // (n_sample * grid_number**2))
+    a_tile = min(grid_number, max(1, max_elements // (n_sample * grid_number)))
+    sample_tile = min(n_sample, max(1, max_elements // (a_tile * grid_number)))
+    t = torch.linspace(0, 1, steps=grid_number, device=device)
+    
+    y_mean = torch.mean(y, dim=1, keepdim=True)
+    y_center = y - y_mean
+    y_ss = torch.sum(y_center**2, dim=1)
+    
+    params = torch.zeros(len(funs), n_edge, 4, device=device)
+    r2_best = torch.zeros(len(funs), n_edge, device=device)
+    at_boundary = False
+    
+    for k, fun in enumerate(funs):
+        for start in range(0, n_edge, chunk):
+            x_ = x[start:start+chunk]
+            y_center_ = y_center[start:start+chunk]
+            n = x_.shape[0]
+            edge_id = torch.arange(n, device=device)
+            a_lo = torch.full((n,), float(a_range[0]), device=device)
+            a_hi = torch.full((n,), float(a_range[1]), device=device)
+            b_lo = torch.full((n,), float(b_range[0]), device=device)
+            b_hi = torch.full((n,), float(b_range[1]), device=device)
+            
+            for _ in range(iteration):
+                a_ = a_lo[:,None] + (a_hi - a_lo)[:,None] * t[None,:]
+                b_ = b_lo[:,None] + (b_hi - b_lo)[:,None] * t[None,:]
+                r2 = torch.zeros(n, grid_number, grid_number, device=device)
+                for a_start in range(0, grid_number, a_tile):
+                    a_tile_ = a_[:, a_start:a_start+a_tile]
+                    # running sums over sample tiles: count, mean of f, sum of squared deviations of f, co-moment of f and y
+                    count = 0
+                    for s_start in range(0, n_sample, sample_tile):
+                        x_tile = x_[:, s_start:s_start+sample_tile]
+                        y_tile = y_center_[:, s_start:s_start+sample_tile]
+                        n_tile = x_tile.shape[1]
+                        post_fun = fun(torch.addcmul(b_[:,None,None,:], a_tile_[:,None,:,None], x_tile[:,:,None,None])) # a*x+b, shape (n, n_tile, a_tile, grid_number)
+                        mean_tile = torch.mean(post_fun, dim=1, keepdim=True)
+                        if post_fun.is_contiguous() and post_fun.shape == (n, n_tile, a_tile_.shape[1], grid_number):
+                            post_fun = post_fun.sub_(mean_tile)
+                        else:
+                            post_fun = post_fun - mean_tile
+                        mean_tile = mean_tile[:,0]
+                        y_mean_tile = torch.mean(y_tile, dim=1)
+                        ss_tile = torch.sum(post_fun*post_fun, dim=1)
+                        cov_tile = torch.bmm((y_tile - y_mean_tile[:,None])[:,None,:], post_fun.reshape(n, n_tile, -1)).reshape(mean_tile.shape)
+                        if count == 0:
+                            mean, y_mean_, ss, cov = mean_tile, y_mean_tile, ss_tile, cov_tile
+                        else:
+                            delta = mean_tile - mean
+                            delta_y = (y_mean_tile - y_mean_)[:,None,None]
+                            weight = count * n_tile / (count + n_tile)
+                            ss = ss + ss_tile + delta**2 * weight
+                            cov = cov + cov_tile + delta * delta_y * weight
+                            mean = mean + delta * n_tile / (count + n_tile)
+                            y_mean_ = y_mean_ + (y_mean_tile - y_mean_) * n_tile / (count + n_tile)
+                        count += n_tile
+                    numerator = cov**2
+                    denominator = ss * y_ss[start:start+chunk,None,None]
+                    r2[:, a_start:a_start+a_tile] = torch.nan_to_num(numerator/(denominator+1e-4))
+                
+                best_id = torch.argmax(r2.reshape(n, -1), dim=1)
+                a_id, b_id = torch.div(best_id, grid_number, rounding_mode='floor'), best_id % grid_number
+                
+                if _ == 0 and lm_steps > 0 and lm_starts > 1:
+                    # the lm_starts best local maxima of the coarse grid: other basins of a multimodal fun that zooming in would discard
+                    r2_max = torch.nn.functional.max_pool2d(r2[:,None], 3, stride=1, padding=1)[:,0]
+                    peak = torch.where(r2 >= r2_max, r2, torch.full_like(r2, -1.)).reshape(n, -1)
+                    start_id = torch.topk(peak, min(lm_starts, grid_number**2), dim=1).indices
+                    a_start_ = torch.gather(a_, 1, torch.div(start_id, grid_number, rounding_mode='floor'))
+                    b_start_ = torch.gather(b_, 1, start_id % grid_number)
+                
+                # at the boundary, only the boundary directions are zoomed in; otherwise zoom in around the best value
+                boundary = (a_id == 0) + (a_id == grid_number - 1) + (b_id == 0) + (b_id == grid_number - 1) > 0
+                if _ == 0 and torch.any(boundary):
+                    at_boundary = True
+                a_lo_in, a_hi_in = a_[edge_id, torch.clamp(a_id-1, min=0)], a_[edge_id, torch.clamp(a_id+1, max=grid_number-1)]
+                b_lo_in, b_hi_in = b_[edge_id, torch.clamp(b_id-1, min=0)], b_[edge_id, torch.clamp(b_id+1, max=grid_number-1)]
+                a_lo_bd = torch.where(a_id == 0, a_[:,0], torch.where(a_id == grid_number - 1, a_[:,-2], a_lo))
+                a_hi_bd = torch.where(a_id == 0, a_[:,1], torch.where(a_id == grid_number - 1, a_[:,-1], a_hi))
+                b_lo_bd = torch.where(b_id == 0, b_[:,0], torch.where(b_id == grid_number - 1, b_[:,-2], b_lo))
+                b_hi_bd = torch.where(b_id == 0, b_[:,1], torch.where(b_id == grid_number - 1, b_[:,-1], b_hi))
+                a_lo, a_hi = torch.where(boundary, a_lo_bd, a_lo_in), torch.where(boundary, a_hi_bd, a_hi_in)
+                b_lo, b_hi = torch.where(boundary, b_lo_bd, b_lo_in), torch.where(boundary, b_hi_bd, b_hi_in)
+            
+            a_best = a_[edge_id, a_id]
+            b_best = b_[edge_id, b_id]
+            r2_chunk = r2[edge_id, a_id, b_id]
+            
+            def linear_fit(a, b, x_, y_center_, y_ss_, y_mean_):
+                # closed-form least squares for c, d (c = 0 if fun(a*x+b) is constant), and r2 as in the sweep
+                post_fun = fun(a[:,None] * x_ + b[:,None])
+                post_fun_center = post_fun - torch.mean(post_fun, dim=1, keepdim=True)
+                r2 = torch.nan_to_num(torch.sum(post_fun_center * y_center_, dim=1)**2 / (torch.sum(post_fun_center**2, dim=1) * y_ss_ + 1e-4))
+                post_fun = torch.nan_to_num(post_fun)
+                post_fun_mean = torch.mean(post_fun, dim=1)
+                post_fun_center = post_fun - post_fun_mean[:,None]
+                var = torch.sum(post_fun_center**2, dim=1)
+                cov = torch.sum(post_fun_center * y_center_, dim=1)
+                c = torch.where(var > 0, cov / torch.where(var > 0, var, torch.ones_like(var)), torch.zeros_like(var))
+                d = y_mean_[:,0] - c * post_fun_mean
+                return c, d, r2
+            
+            c_best, d_best, _ = linear_fit(a_best, b_best, x_, y_center_, y_ss[start:start+chunk], y_mean[start:start+chunk])
+            
+            if lm_steps > 0:
+                # continuous refinement from the best grid point (and from the other coarse peaks), kept only where it improves r2
+                a_start_all, b_start_all = a_best[:,None], b_best[:,None]
+                if lm_starts > 1:
+                    a_start_all, b_start_all = torch.cat([a_start_all, a_start_], dim=1), torch.cat([b_start_all, b_start_], dim=1)
+                n_start = a_start_all.shape[1]
+                a_start_all, b_start_all = a_start_all.reshape(-1), b_start_all.reshape(-1)
+                x_start = x_.repeat_interleave(n_start, dim=0)
+                y_start = y[start:start+chunk].repeat_interleave(n_start, dim=0)
+                y_center_start = y_center_.repeat_interleave(n_start, dim=0)
+                y_ss_start = y_ss[start:start+chunk].repeat_interleave(n_start, dim=0)
+                y_mean_start = y_mean[start:start+chunk].repeat_interleave(n_start, dim=0)
+                c_start, d_start, _ = linear_fit(a_start_all, b_start_all, x_start, y_center_start, y_ss_start, y_mean_start)
+                refined = refine_params(x_start, y_start, fun, torch.stack([a_start_all, b_start_all, c_start, d_start], dim=1), steps=lm_steps)
+                c_lm, d_lm, r2_lm = linear_fit(refined[:,0], refined[:,1], x_start, y_center_start, y_ss_start, y_mean_start)
+                best_start = torch.argmax(torch.nan_to_num(r2_lm.reshape(n, n_start), nan=-1.), dim=1) + edge_id * n_start
+                refined, c_lm, d_lm, r2_lm = refined[best_start], c_lm[best_start], d_lm[best_start], r2_lm[best_start]
+                better = r2_lm > r2_chunk
+                a_best, b_best = torch.where(better, refined[:,0], a_best), torch.where(better, refined[:,1], b_best)
+                c_best, d_best = torch.where(better, c_lm, c_best), torch.where(better, d_lm, d_best)
+                r2_chunk = torch.where(better, r2_lm, r2_chunk)
+            
+            params[k, start:start+chunk] = torch.stack([a_best, b_best, c_best, d_best], dim=1)
+            r2_best[k, start:start+chunk] = r2_chunk
+    
+    if at_boundary and verbose == True:
+        print('Best value at boundary.')
+    
+    return params, r2_best
+
+
+def refine_params(x, y, fun, params, steps=10, lamb=1e-3):
+    '''
+    refine (a, b, c, d) of y = c*fun(a*x+b)+d with batched Levenberg-Marquardt steps (one independent problem per row of x and y).
+    The steps are taken in (a, b) only, with c, d given by closed-form least squares at every point (variable projection, Kaufman's Jacobian):
+    this follows the flat valley along which a and c trade off (e.g. sin with small a) much better than a joint step in (a, b, c, d).
+    fun'(x) is obtained with autograd. Steps that do not increase r2 as defined by the sweep of fit_params_batch (or produce NaN) are rejected, so the
+    refinement cannot drift towards a -> 0, |c| -> inf, where fun is fitted by its Taylor expansion and the sweep's r2 drops.
+    
+    Args:
+    -----
+        x : 2D torch.float
+            x values, shape (number of edges, number of samples)
+        y : 2D torch.float
+            y values, shape (number of edges, number of samples)
+        fun : function
+            symbolic function (elementwise)
+        params : 2D torch.float
+            initial (a, b, c, d), shape (number of edges, 4). Only a, b are used as the starting point.
+        steps : int
+            number of LM steps
+        lamb : float
+            initial damping
+        
+    Returns:
+    --------
+        params : 2D torch.float
+            refined (a, b, c, d), shape (number of edges, 4)
+    
+    Example
+    -------
+    >>> x = torch.linspace(-1,1,steps=100)[None,:]
+    >>> y = 5.0*torch.sin(3.0*x + 2.0) + 0.7
+    >>> refine_params(x, y, torch.sin, torch.tensor([[2.9, 2.1, 4.8, 0.5]]))
+    '''
+    y_mean = torch.mean(y, dim=1, keepdim=True)
+    y_center = y - y_mean
+    y_ss = torch.sum(y_center**2, dim=1)
+    
+    def residual(ab):
+        a, b = ab[:,[0]], ab[:,[1]]
+        with torch.enable_grad():
+            z = (a * x + b).detach().requires_grad_(True)
+            post_fun = fun(z)
+            if post_fun.requires_grad:
+                grad = torch.autograd.grad(post_fun.sum(), z)[0]
+            else:
+                grad = torch.zeros_like(z)
+        post_fun = post_fun.detach()
+        # closed-form c, d (c = 0 if fun(a*x+b) is constant)
+        post_fun_mean = torch.mean(post_fun, dim=1, keepdim=True)
+        post_fun_center = post_fun - post_fun_mean
+        var = torch.sum(post_fun_center**2, dim=1, keepdim=True)
+        safe_var = torch.where(var > 0, var, torch.ones_like(var))
+        c = torch.where(var > 0, torch.sum(post_fun_center * y_center, dim=1, keepdim=True) / safe_var, torch.zeros_like(var))
+        d = y_mean - c * post_fun_mean
+        r2 = torch.sum(post_fun_center * y_center, dim=1)**2 / (var[:,0] * y_ss + 1e-4)
+        r2 = torch.where(torch.isfinite(r2), r2, torch.full_like(r2, -1.))
+        res = c * post_fun + d - y
+        # Jacobian of the residual in (a, b), projected onto the complement of span(fun(a*x+b), 1)
+        jac = torch.stack([c * grad * x, c * grad], dim=2)
+        jac = jac - torch.mean(jac, dim=1, keepdim=True)
+        jac = jac - post_fun_center[:,:,None] * torch.einsum('in,ink->ik', post_fun_center, jac)[:,None,:] / safe_var[:,:,None]
+        return torch.cat([ab, c, d], dim=1), res, jac, r2
+    
+    params, res, jac, r2 = residual(params[:,:2])
+    damping = torch.full((params.shape[0],), lamb, device=params.device, dtype=params.dtype)
+    for _ in range(steps):
+        jtj = torch.einsum('ink,inl->ikl', jac, jac)
+        jtr = torch.einsum('ink,in->ik', jac, res)
+        A = jtj + damping[:,None,None] * torch.diag_embed(torch.diagonal(jtj, dim1=1, dim2=2) + 1e-6)
+        delta = torch.linalg.solve_ex(A, -jtr[:,:,None])[0][:,:,0]
+        delta = torch.nan_to_num(delta, nan=0., posinf=0., neginf=0.)
+        params_new, res_new, jac_new, r2_new = residual(params[:,:2] + delta)
+        accept = r2_new > r2
+        params = torch.where(accept[:,None], params_new, params)
+        res = torch.where(accept[:,None], res_new, res)
+        jac = torch.where(accept[:,None,None], jac_new, jac)
+        r2 = torch.where(accept, r2_new, r2)
+        damping = torch.where(accept, damping / 10, damping * 10)
+    return params
+
+
+def fit_params_worker(args):
+    '''
+    process pool entry point of fit_params_parallel: fits one slice of edges. Functions are passed by name and looked up in SYMBOLIC_LIB.
+    '''
+    x, y, names, n_threads, kwargs = args
+    torch.set_num_threads(n_threads)
+    return fit_params_batch(x, y, [SYMBOLIC_LIB[name][0] for name in names], **kwargs)
+
+
+def fit_params_parallel(x, y, names, n_workers=1, min_work=2**30, **kwargs):
+    '''
+    fit_params_batch with the edges split across a pool of n_workers processes. Opt-in: with the default n_workers=1 everything runs in-process.
+    
+    The workers are started with 'spawn' (fresh interpreters), since forking a process whose torch (OpenMP/MKL) thread pools are already
+    running can deadlock. Functions are passed by name and looked up in the workers' SYMBOLIC_LIB, so only the built-in functions are fitted
+    in the pool; functions added with add_symbolic (or redefined) are fitted in-process. As with any 'spawn' pool, a script calling this
+    with n_workers > 1 needs an `if __name__ == '__main__':` guard.
+    
+    Starting the pool costs about 2-3 s (every worker imports torch and kan), while the sweep of fit_params_batch runs at about 1e8 elements
+    per second and thread, so each worker needs min_work elements (about 8 s) to pay off; n_workers is reduced accordingly and small layers
+    are fitted in-process.
+    
+    Args:
+    -----
+        x : 2D torch.float
+            x values, shape (number of edges, number of samples)
+        y : 2D torch.float
+            y values, shape (number of edges, number of samples)
+        names : list of str
+            names of candidate symbolic functions (keys of SYMBOLIC_LIB)
+        n_workers : int
+            number of worker processes. If n_workers <= 1, x is not on cpu or there is a single edge, fit_params_batch is called directly.
+        min_work : int
+            minimum work per worker, in elements of the (a, b) sweep: edges * functions * samples * grid_number**2 * iteration.
+        kwargs : dict
+            passed to fit_params_batch (a_range, b_range, grid_number, iteration, max_elements, lm_steps, ...)
+        
+    Returns:
+    --------
+        params : 3D torch.float
+            shape (number of functions, number of edges, 4)
+        r2 : 2D torch.float
+            shape (number of functions, number of edges)
+    
+    Example
+    -------
+    >>> x = torch.linspace(-1,1,steps=100)[None,:].repeat(8,1)
+    >>> y = torch.sin(3*x+torch.arange(8)[:,None])
+    >>> params, r2 = fit_params_parallel(x, y, ['sin','x^2'], n_workers=4, min_work=1)
+    '''
+    n_edges, n_samples = x.shape
+    pool_names = [name for name in names if SYMBOLIC_LIB[name][0] is BUILTIN_SYMBOLIC_FUNS.get(name, None)]
+    work = n_edges * len(pool_names) * n_samples * kwargs.get('grid_number', 101)**2 * kwargs.get('iteration', 3)
+    n_workers = min(n_workers, n_edges, work // max(1, min_work))
+    if n_workers <= 1 or x.device.type != 'cpu':
+        return fit_params_batch(x, y, [SYMBOLIC_LIB[name][0] for name in names], **kwargs)
+    
+    import torch.multiprocessing as mp
+    x = x.detach().contiguous().share_memory_()
+    y = y.detach().contiguous().share_memory_()
+    n_threads = max(1, torch.get_num_threads() // n_workers)
+    bounds = np.linspace(0, n_edges, num=n_workers+1).astype(int)
+    jobs = [(x[bounds[w]:bounds[w+1]], y[bounds[w]:bounds[w+1]], pool_names, n_threads, kwargs) for w in range(n_workers)]
+    
+    with mp.get_context('spawn').Pool(n_workers) as pool:
+        pending = pool.map_async(fit_params_worker, jobs)
+        # the remaining functions are fitted here while the pool runs
+        local_names = [name for name in names if name not in pool_names]
+        if len(local_names) > 0:
+            params_local, r2_local = fit_params_batch(x, y, [SYMBOLIC_LIB[name][0] for name in local_names], **kwargs)
+        results = pending.get()
+    
+    params_pool = torch.cat([result[0] for result in results], dim=1)
+    r2_pool = torch.cat([result[1] for result in results], dim=1)
+    params = torch.zeros(len(names), n_edges, 4, dtype=params_pool.dtype)
+    r2 = torch.zeros(len(names), n_edges, dtype=r2_pool.dtype)
+    for k, name in enumerate(names):
+        if name in pool_names:
+            params[k], r2[k] = params_pool[pool_names.index(name)], r2_pool[pool_names.index(name)]
+        else:
+            params[k], r2[k] = params_local[local_names.index(name)], r2_local[local_names.index(name)]
+    return params, r2
+
+
+class FitCache:
+    '''
+    LRU cache of symbolic fits (params, r2), keyed by a fingerprint of an edge's (x, y) samples, the identity of the function and the fit settings.
+    Since the key hashes the samples themselves, entries of an edge whose activations changed (e.g. after training) are never hit again.
+    Likewise, the function identity (see function_id) changes when a name of SYMBOLIC_LIB is redefined with add_symbolic.
+
+    Attributes:
+    -----------
+        maxsize : int
+            maximal number of cached (edge, function) fits. If 0, nothing is cached.
+        hits : int
+            number of cache hits
+        misses : int
+            number of cache misses
+
+    Example
+    -------
+    >>> from kan.utils import FitCache
+    >>> cache = FitCache(maxsize=1000)
+    >>> x = torch.linspace(-1,1,steps=100)[None,:]
+    >>> keys = cache.fingerprint(x, torch.sin(x))
+    >>> cache.get(keys[0], cache.function_id('sin'), ((-10,10), (-10,10)))
+    None
+    '''
+    def __init__(self, maxsize=2**16):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, x, y):
+        '''
+        blake2b digests of the samples of every edge
+
+        Args:
+        -----
+            x : 2D torch.float
+                x values, shape (number of edges, number of samples)
+            y : 2D torch.float
+                y values, shape (number of edges, number of samples)
+
+        Returns:
+        --------
+            keys : list of str
+                one digest per edge
+        '''
+        x = x.detach().cpu().contiguous().numpy()
+        y = y.detach().cpu().contiguous().numpy()
+        keys = []
+        for e in range(x.shape[0]):
+            h = hashlib.blake2b(digest_size=16)
+            h.update(str((x.dtype, x.shape[1])).encode())
+            h.update(x[e].tobytes())
+            h.update(y[e].tobytes())
+            keys.append(h.hexdigest())
+        return keys
+
+    def function_id(self, name):
+        '''
+        identity of the function SYMBOLIC_LIB[name]: the name, the id of the function object and a digest of its code
+        (bytecode, constants and closure), so that redefining name with add_symbolic does not hit fits of the old function.
+
+        Args:
+        -----
+            name : str
+                key of SYMBOLIC_LIB
+
+        Returns:
+        --------
+            function_id : tuple
+                (name, id, digest)
+        '''
+        fun = SYMBOLIC_LIB[name][0]
+        h = hashlib.blake2b(digest_size=16)
+        code = getattr(fun, '__code__', None)
+        if code == None:
+            h.update(repr(fun).encode())
+        else:
+            h.update(code.co_code)
+            h.update(repr(code.co_consts).encode())
+            h.update(repr([cell.cell_contents for cell in (fun.__closure__ or ())]).encode())
+        return (name, id(fun), h.hexdigest())
+
+    def get(self, key, name, settings):
+        '''
+        cached (params, r2) of function name (as returned by function_id) on the edge with fingerprint key, or None
+        '''
+        entry = self.entries.get((key, name, settings), None)
+        if entry == None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end((key, name, settings))
+        self.hits += 1
+        return entry
+
+    def put(self, key, name, settings, params, r2):
+        '''
+        store (params, r2) of function name (as returned by function_id) on the edge with fingerprint key, evicting the least recently used entries
+        '''
+        if self.maxsize <= 0:
+            return
+        self.entries[(key, name, settings)] = (params, r2)
+        self.entries.move_to_end((key, name, settings))
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        '''
+        drop all entries
+        '''
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class QuantileSketch:
+    '''
+    streaming per-dimension quantile sketch (fixed-size histogram) of the inputs of a KANLayer.
+    
+    Each update is O(batch * dim) (one scatter_add, no sorting); quantile queries are O(n_bin) per dimension.
+    The bin range grows (with a margin) when new samples fall outside it, re-binning the accumulated counts.
+    Quantiles are resolved to within one bin width, i.e. (range of the data) / n_bin.
+    
+    Attributes:
+    -----------
+        dim : int
+            number of dimensions (the layer's in_dim)
+        n_bin : int
+            number of histogram bins per dimension
+        decay : float
+            accumulated counts are multiplied by decay before each update (1: plain accumulation, <1: older samples fade out)
+        count : float
+            (decayed) number of samples seen
+        x_min, x_max : 1D torch.float
+            smallest and largest sample seen in every dimension, shape (dim,)
+    
+    Example
+    -------
+    >>> from kan.utils import QuantileSketch
+    >>> sketch = QuantileSketch(dim=2)
+    >>> for i in range(10):
+    >>>     sketch.update(torch.randn(1000, 2))
+    >>> sketch.quantile(torch.tensor([0.1, 0.5, 0.9])) # about [-1.28, 0, 1.28] in each dimension
+    '''
+    def __init__(self, dim, n_bin=2048, decay=1.):
+        self.dim = dim
+        self.n_bin = n_bin
+        self.decay = decay
+        self.reset()
+        
+    def reset(self):
+        '''
+        forget all samples
+        '''
+        self.count = 0.
+        self.counts = None
+        self.lo = None
+        self.hi = None
+        self.x_min = None
+        self.x_max = None
+        
+    def rebin(self, lo, hi):
+        '''
+        move the accumulated counts to the bin range [lo, hi] (which contains the current one)
+        '''
+        if self.lo != None:
+            centers = self.lo[:,None] + (torch.arange(self.n_bin, device=lo.device)[None,:] + 0.5) * ((self.hi - self.lo) / self.n_bin)[:,None]
+            idx = ((centers - lo[:,None]) / (hi - lo)[:,None] * self.n_bin).long().clamp(0, self.n_bin-1)
+            self.counts = torch.zeros_like(self.counts).scatter_add_(1, idx, self.counts)
+        self.lo, self.hi = lo, hi
+        
+    def update(self, x):
+        '''
+        add samples
+        
+        Args:
+        -----
+            x : 2D torch.float
+                shape (batch, dim)
+        '''
+        x = x.detach()
+        x_min, x_max = torch.min(x, dim=0)[0], torch.max(x, dim=0)[0]
+        if self.counts == None:
+            self.counts = torch.zeros(self.dim, self.n_bin, device=x.device, dtype=x.dtype)
+            self.x_min, self.x_max = x_min, x_max
+            lo, hi = x_min, x_max
+            grow = torch.ones(self.dim, dtype=torch.bool, device=x.device)
+        else:
+            if self.counts.device != x.device:
+                self.counts, self.lo, self.hi, self.x_min, self.x_max = [t.to(x.device) for t in [self.counts, self.lo, self.hi, self.x_min, self.x_max]]
+            self.counts *= self.decay
+            self.x_min, self.x_max = torch.minimum(self.x_min, x_min), torch.maximum(self.x_max, x_max)
+            lo, hi = torch.minimum(self.lo, x_min), torch.maximum(self.hi, x_max)
+            grow = (lo < self.lo) | (hi > self.hi)
+        if torch.any(grow):
+            # leave a margin so that a slowly drifting range does not re-bin on every update
+            margin = 0.1 * (hi - lo) + 1e-6 * (torch.abs(lo) + torch.abs(hi) + 1.)
+            lo = torch.where(grow, lo - margin, lo)
+            hi = torch.where(grow, hi + margin, hi)
+            self.rebin(lo, hi)
+        idx = ((x - self.lo) / (self.hi - self.lo) * self.n_bin).long().clamp(0, self.n_bin-1)
+        self.counts.scatter_add_(1, idx.permute(1,0), torch.ones_like(x).permute(1,0))
+        self.count = self.count * self.decay + x.shape[0]
+        
+    def quantile(self, q):
+        '''
+        approximate quantiles of every dimension
+        
+        Args:
+        -----
+            q : 1D torch.float
+                quantile levels in [0,1]
+                
+        Returns:
+        --------
+            values : 2D torch.float
+                shape (dim, number of levels), non-decreasing along the last axis; levels 0 and 1 give x_min and x_max
+        '''
+        if self.counts == None:
+            raise Exception('QuantileSketch is empty, call update() first')
+        q = q.to(self.counts.device, self.counts.dtype)
+        cdf = torch.cumsum(self.counts, dim=1)
+        target = q[None,:].expand(self.dim, -1) * cdf[:,[-1]]
+        j = torch.searchsorted(cdf, target.contiguous()).clamp(max=self.n_bin-1)
+        cdf_prev = torch.gather(torch.nn.functional.pad(cdf, (1,0)), 1, j)
+        mass = torch.gather(self.counts, 1, j)
+        frac = torch.where(mass > 0, (target - cdf_prev) / mass.clamp(min=1e-30), torch.zeros_like(mass))
+        values = self.lo[:,None] + (j + frac) * ((self.hi - self.lo) / self.n_bin)[:,None]
+        values = torch.minimum(torch.maximum(values, self.x_min[:,None]), self.x_max[:,None])
+        values[:, q <= 0] = self.x_min[:,None]
+        values[:, q >= 1] = self.x_max[:,None]
+        return values
+    
+    
 def sparse_mask(in_dim, out_dim):
     '''
     get sparse mask
@@ -370,7 +974,7 @@ def augment_input(orig_vars, aux_vars, x):
         aux_values = torch.tensor([]).to(x.device)
 
         for aux_var in aux_vars:
-            func = lambdify(orig_vars, aux_var,'numpy') # returns a numpy-ready function
+            func = sympy.lambdify(orig_vars, aux_var,'numpy') # returns a numpy-ready function
             aux_value = torch.from_numpy(func(*[x[:,[i]].numpy() for i in range(len(orig_vars))]))
             aux_values = torch.cat([aux_values, aux_value], dim=1)
             
@@ -477,6 +1081,246 @@ def create_dataset_from_data(inputs, labels, train_ratio=0.8, device='cpu'):
     return dataset
 
 
+def save_dataset(dataset, path):
+    '''
+    save a dataset as one .npy file per field (train_input, train_label, test_input, test_label) plus a manifest (manifest.yml), so that it can be memory-mapped by load_dataset
+    
+    Args:
+    -----
+        dataset : dic
+            contains dataset['train_input'], dataset['train_label'], dataset['test_input'], dataset['test_label']
+        path : str
+            the folder to store the dataset
+        
+    Returns:
+    --------
+        None
+    
+    Example
+    -------
+    >>> from kan.utils import create_dataset, save_dataset
+    >>> f = lambda x: torch.exp(torch.sin(torch.pi*x[:,[0]]) + x[:,[1]]**2)
+    >>> dataset = create_dataset(f, n_var=2)
+    >>> save_dataset(dataset, './data/exp_sin')
+    '''
+    os.makedirs(path, exist_ok=True)
+    manifest = {}
+    for key in ['train_input', 'train_label', 'test_input', 'test_label']:
+        data = dataset[key]
+        if isinstance(data, torch.Tensor):
+            data = data.detach().cpu().numpy()
+        data = np.ascontiguousarray(data)
+        np.save(f'{path}/{key}.npy', data)
+        manifest[key] = {'file': f'{key}.npy', 'shape': list(data.shape), 'dtype': str(data.dtype)}
+        
+    with open(f'{path}/manifest.yml', 'w') as outfile:
+        yaml.dump(manifest, outfile, default_flow_style=False)
+
+
+def load_dataset(path, mmap=True, device='cpu'):
+    '''
+    load a dataset saved by save_dataset. With mmap=True (and device='cpu'), tensors are zero-copy views of the memory-mapped files,
+    so several processes training on the same dataset share one copy through the page cache.
+    Pages are mapped copy-on-write: in-place changes to the tensors are private to the process and never written back to disk.
+    
+    Args:
+    -----
+        path : str
+            the folder of the dataset
+        mmap : bool
+            If True, files are memory-mapped; if False, they are read into memory. Default: True.
+        device : str
+            device. On devices other than cpu, data are copied to the device.
+        
+    Returns:
+    --------
+        dataset : dic
+            Train/test inputs/labels are dataset['train_input'], dataset['train_label'],
+                        dataset['test_input'], dataset['test_label']
+    
+    Example
+    -------
+    >>> from kan.utils import load_dataset
+    >>> dataset = load_dataset('./data/exp_sin')
+    >>> dataset['train_input'].shape
+    '''
+    with open(f'{path}/manifest.yml', 'r') as stream:
+        manifest = yaml.safe_load(stream)
+        
+    dataset = {}
+    for key in manifest:
+        data = np.load(f'{path}/{manifest[key]["file"]}', mmap_mode='c' if mmap else None)
+        if list(data.shape) != manifest[key]['shape'] or str(data.dtype) != manifest[key]['dtype']:
+            raise Exception(f'{key} does not match the manifest in {path}')
+        dataset[key] = torch.from_numpy(data).to(device)
+    return dataset
+
+
+class BatchLoader:
+    '''
+    endless iterator of (inputs, labels) mini-batches, prefetched in a background thread
+
+    Attributes:
+    -----------
+        source : tuple of 2D torch.float, torch.utils.data.Dataset or iterable
+            (inputs, labels) tensors; a map-style dataset whose items are (input, label); or a re-iterable source (e.g. a torch.utils.data.IterableDataset reading shards from disk) yielding (inputs, labels) chunks or single samples
+        batch : int
+            batch size, if -1 then full (only for sized sources)
+        shuffle : bool
+            if True, samples are reshuffled at every epoch (for iterable sources, rows are shuffled within each chunk)
+        drop_last : bool
+            for sized sources, if True the last incomplete batch of every epoch is dropped (all batches have the same size); 
+            if False it is returned as a smaller batch. For iterable sources the remainder is carried over to the next pass.
+        device : str
+            device of the returned batches
+        prefetch : int
+            number of batches prepared ahead by the background thread. If 0, batches are prepared in the calling thread.
+        pin_memory : bool
+            if True (default when device is cuda), CPU batches are pinned so that the copy to device is asynchronous
+
+    Example
+    -------
+    >>> from kan.utils import BatchLoader
+    >>> x = torch.normal(0,1,size=(100,2))
+    >>> y = torch.normal(0,1,size=(100,1))
+    >>> loader = BatchLoader((x, y), batch=32)
+    >>> inputs, labels = next(loader)
+    >>> inputs.shape, labels.shape
+    (torch.Size([32, 2]), torch.Size([32, 1]))
+    >>> loader.close()
+    '''
+    def __init__(self, source, batch=-1, shuffle=True, device='cpu', prefetch=2, pin_memory=None, drop_last=True):
+        self.source = source
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.device = device
+        self.prefetch = prefetch
+        if pin_memory == None:
+            pin_memory = torch.cuda.is_available() and str(device).startswith('cuda')
+        self.pin_memory = pin_memory
+
+        if isinstance(source, (tuple, list)):
+            self.num = source[0].shape[0]
+        elif hasattr(source, '__len__') and hasattr(source, '__getitem__'):
+            self.num = len(source)
+        else:
+            self.num = None
+        if batch == -1 or (self.num != None and batch > self.num):
+            if self.num == None:
+                raise Exception('batch size is required for iterable sources')
+            batch = self.num
+        self.batch = batch
+
+        self.full_batch = isinstance(source, (tuple, list)) and batch == self.num
+        # private generator seeded from the global one: shuffling stays reproducible however far the thread runs ahead.
+        # The global RNG is only consumed when batches are actually shuffled.
+        self.generator = torch.Generator()
+        if shuffle and not self.full_batch:
+            self.generator.manual_seed(int(torch.randint(0, 2**62, (1,))))
+        self.batches = self.generate()
+        self.queue = None
+        self.thread = None
+        self.stop = threading.Event()
+        if prefetch > 0 and not self.full_batch:
+            self.queue = queue.Queue(maxsize=prefetch)
+            self.thread = threading.Thread(target=self.worker, daemon=True)
+            self.thread.start()
+
+    def generate(self):
+        '''
+        endless generator of CPU (or source device) batches, epoch after epoch
+        '''
+        if self.full_batch:
+            # the whole dataset at every step: no shuffling or copying needed
+            while True:
+                yield self.source[0], self.source[1]
+
+        elif isinstance(self.source, (tuple, list)) or self.num != None:
+            while True:
+                ids = torch.randperm(self.num, generator=self.generator) if self.shuffle else torch.arange(self.num)
+                end = self.num - self.batch + 1 if self.drop_last else self.num
+                for start in range(0, end, self.batch):
+                    batch_id = ids[start:start+self.batch]
+                    if isinstance(self.source, (tuple, list)):
+                        yield self.source[0][batch_id.to(self.source[0].device)], self.source[1][batch_id.to(self.source[1].device)]
+                    else:
+                        if hasattr(self.source, '__getitems__'):
+                            items = self.source.__getitems__(batch_id.tolist())
+                        else:
+                            items = [self.source[i] for i in batch_id.tolist()]
+                        yield torch.stack([item[0] for item in items]), torch.stack([item[1] for item in items])
+
+        else:
+            while True:
+                inputs, labels, n = [], [], 0
+                empty = True
+                for x, y in self.source:
+                    empty = False
+                    if x.dim() == 1:
+                        x, y = x[None,:], y.reshape(1,-1)
+                    if self.shuffle:
+                        perm = torch.randperm(x.shape[0], generator=self.generator)
+                        x, y = x[perm.to(x.device)], y[perm.to(y.device)]
+                    inputs.append(x)
+                    labels.append(y)
+                    n += x.shape[0]
+                    if n >= self.batch:
+                        x, y = torch.cat(inputs), torch.cat(labels)
+                        for start in range(0, n - self.batch + 1, self.batch):
+                            yield x[start:start+self.batch], y[start:start+self.batch]
+                        rest = n % self.batch
+                        inputs, labels, n = [x[n-rest:]], [y[n-rest:]], rest
+                if empty:
+                    raise Exception('iterable source is empty')
+
+    def prepare(self, x, y):
+        if self.pin_memory and x.device.type == 'cpu':
+            x, y = x.pin_memory(), y.pin_memory()
+        return x, y
+
+    def worker(self):
+        try:
+            for x, y in self.batches:
+                item = self.prepare(x, y)
+                while not self.stop.is_set():
+                    try:
+                        self.queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if self.stop.is_set():
+                    return
+        except Exception as e:
+            while not self.stop.is_set():
+                try:
+                    self.queue.put(e, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.queue == None:
+            x, y = self.prepare(*next(self.batches))
+        else:
+            item = self.queue.get()
+            if isinstance(item, Exception):
+                raise item
+            x, y = item
+        return x.to(self.device, non_blocking=self.pin_memory), y.to(self.device, non_blocking=self.pin_memory)
+
+    def close(self):
+        '''
+        stop the background thread and wait for it to exit
+        '''
+        self.stop.set()
+        if self.thread != None:
+            self.thread.join()
+            self.thread = None
+
+
 def get_derivative(model, inputs, labels, derivative='hessian', loss_mode='pred', reg_metric='w', lamb=0., lamb_l1=1., lamb_entropy=0.):
     '''
     compute the jacobian/hessian of loss wrt to model parameters
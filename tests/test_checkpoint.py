@@ -0,0 +1,69 @@
+import os
+
+import pytest
+import torch
+
+from kan import KAN
+from kan import checkpoint
+from kan.utils import create_dataset
+
+
+def count_objects(folder):
+    store = os.path.join(folder, 'objects')
+    if not os.path.isdir(store):
+        return 0
+    return sum(len(files) for _, _, files in os.walk(store))
+
+
+@pytest.mark.parametrize('format', ['files', 'objects', 'single'])
+def test_checkpoint_roundtrip(tmp_path, format):
+    state = {'small': torch.arange(6, dtype=torch.float32).reshape(2, 3), 'large': torch.rand(64, 64, dtype=torch.float64),
+             'long': torch.arange(5), 'empty': torch.zeros(0, 3), 'flag': torch.tensor([True, False])}
+    cache_data = torch.rand(100, 2)
+    path = str(tmp_path / '0.0')
+    checkpoint.write_checkpoint(path, {'width': [2, 1]}, state, cache_data, format=format)
+    config, state_read, cache_data_read = checkpoint.read_checkpoint(path)
+    assert config == {'width': [2, 1]}
+    for key, value in state.items():
+        assert state_read[key].dtype == value.dtype and torch.equal(state_read[key], value)
+    assert torch.equal(cache_data_read, cache_data)
+
+
+def test_objects_store_raw_bytes_and_inlines_small_tensors(tmp_path):
+    path = str(tmp_path / '0.0')
+    checkpoint.write_checkpoint(path, {}, {'small': torch.zeros(10), 'large': torch.rand(2048)}, None, format='objects')
+    # only the large tensor gets an object file, holding exactly its bytes
+    store = tmp_path / 'objects'
+    files = [os.path.join(root, name) for root, _, names in os.walk(store) for name in names]
+    assert len(files) == 1 and os.path.getsize(files[0]) == 2048 * 4
+
+
+def test_prune_keeps_checkout_and_rewind_working(tmp_path):
+    dataset = create_dataset(lambda x: torch.sin(x[:,[0]]) + x[:,[1]]**2, n_var=4, train_num=100, test_num=100, seed=0)
+    ckpt_path = str(tmp_path / 'model')
+    # the first layer's coef (4*16*23 floats) is above INLINE_BYTES, so every version writes an object
+    model = KAN(width=[4,16,1], grid=20, k=3, seed=0, ckpt_path=ckpt_path, ckpt_format='objects')
+    model_0 = model.copy()
+    for _ in range(3):
+        model.fit(dataset, steps=2, update_grid=False)
+    model_2 = model.checkout('0.2')
+    checkpoint.flush()
+    n_objects = count_objects(ckpt_path)
+
+    # nothing to prune while every version is kept
+    assert model.prune_ckpt() == 0
+    assert count_objects(ckpt_path) == n_objects
+
+    removed = model.prune_ckpt(keep=['0.0', '0.2'])
+    assert removed > 0 and count_objects(ckpt_path) == n_objects - removed
+    assert not os.path.exists(os.path.join(ckpt_path, '0.1_manifest.yml'))
+    # the current version is always kept
+    assert os.path.exists(os.path.join(ckpt_path, '0.3_manifest.yml'))
+
+    x = dataset['test_input']
+    assert torch.allclose(model.checkout('0.0')(x), model_0(x))
+    assert torch.allclose(model.checkout('0.2')(x), model_2(x))
+    rewound = model.rewind('0.2')
+    assert torch.allclose(rewound(x), model_2(x))
+    checkpoint.flush()
+    assert os.path.exists(os.path.join(ckpt_path, '1.2_manifest.yml'))
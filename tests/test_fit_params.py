@@ -0,0 +1,72 @@
+import torch
+
+from kan.utils import SYMBOLIC_LIB, add_symbolic, fit_params_batch, fit_params_parallel
+
+
+def sin_targets(seed, n_edge=64, n_sample=100):
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.rand(n_edge, n_sample, generator=generator) * 2 - 1
+    a = torch.rand(n_edge, 1, generator=generator) * 8 + 1
+    b = torch.rand(n_edge, 1, generator=generator) * 6 - 3
+    c = torch.rand(n_edge, 1, generator=generator) * 4 + 0.5
+    y = c * torch.sin(a * x + b) + 0.2 + 0.02 * torch.randn(n_edge, n_sample, generator=generator)
+    return x, y
+
+
+def test_coarse_grid_with_lm_matches_dense_grid():
+    # sin is multimodal in (a, b): LM from the single best point of a 21x21 grid can stall in the wrong basin
+    for seed in range(3):
+        x, y = sin_targets(seed)
+        _, r2_dense = fit_params_batch(x, y, [torch.sin], grid_number=101)
+        _, r2_coarse = fit_params_batch(x, y, [torch.sin], grid_number=21, lm_steps=10)
+        # up to float32 rounding of r2
+        assert torch.all(r2_coarse >= r2_dense - 1e-5)
+
+
+def test_lm_never_lowers_r2():
+    x, y = sin_targets(0)
+    names = [torch.sin, torch.tanh, lambda x: x**2, lambda x: torch.exp(-x**2)]
+    _, r2_grid = fit_params_batch(x, y, names, grid_number=21)
+    _, r2_lm = fit_params_batch(x, y, names, grid_number=21, lm_steps=10)
+    assert torch.all(r2_lm >= r2_grid)
+
+
+def test_lm_recovers_curve():
+    x = torch.linspace(-1, 1, steps=100)[None,:]
+    y = 5.0 * torch.sin(3.0 * x + 2.0) + 0.7
+    params, r2 = fit_params_batch(x, y, [torch.sin], grid_number=21, lm_steps=10)
+    assert r2[0,0] > 0.9999
+    # (a, b, c, d) and (-a, -b, -c, d) describe the same curve
+    a, b, c, d = params[0,0]
+    assert torch.allclose(c * torch.sin(a * x + b) + d, y, atol=1e-3)
+
+
+def test_parallel_matches_batch():
+    x, y = sin_targets(1, n_edge=6)
+    names = ['sin', 'x^2', 'tanh']
+    params, r2 = fit_params_batch(x, y, [SYMBOLIC_LIB[name][0] for name in names], grid_number=21)
+    params_parallel, r2_parallel = fit_params_parallel(x, y, names, n_workers=2, min_work=1, grid_number=21)
+    assert torch.equal(r2_parallel, r2) and torch.equal(params_parallel, params)
+
+
+def test_parallel_fits_added_functions_in_process():
+    # spawned workers do not know functions added with add_symbolic
+    add_symbolic('sin_test', lambda x: torch.sin(2*x))
+    try:
+        x, y = sin_targets(2, n_edge=4)
+        names = ['sin_test', 'sin']
+        params, r2 = fit_params_batch(x, y, [SYMBOLIC_LIB[name][0] for name in names], grid_number=21)
+        params_parallel, r2_parallel = fit_params_parallel(x, y, names, n_workers=2, min_work=1, grid_number=21)
+        assert torch.equal(r2_parallel, r2) and torch.equal(params_parallel, params)
+    finally:
+        del SYMBOLIC_LIB['sin_test']
+
+
+def test_parallel_small_work_runs_in_process(monkeypatch):
+    import torch.multiprocessing as mp
+    def no_pool(method):
+        raise AssertionError('no pool expected below min_work')
+    monkeypatch.setattr(mp, 'get_context', no_pool)
+    x, y = sin_targets(0, n_edge=2)
+    params, r2 = fit_params_parallel(x, y, ['sin'], n_workers=2, grid_number=21)
+    assert r2.shape == (1, 2)
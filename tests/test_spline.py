@@ -0,0 +1,184 @@
+import pytest
+import torch
+
+from kan import KAN
+from kan.KANLayer import KANLayer, KANLayerFunction
+from kan.spline import B_batch, B_batch_local, B_batch_uniform, coef2curve, coef2poly, curve2coef, extend_grid, insert_knots, is_uniform_grid, local2dense, poly2curve, refine_coef
+
+
+def make_grid(in_dim, G, k, uniform, dtype=torch.float64, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    if uniform:
+        grid = torch.linspace(-1, 1, steps=G+1, dtype=dtype)[None,:].expand(in_dim, G+1)
+    else:
+        inner = torch.sort(torch.rand(in_dim, G-1, generator=generator, dtype=dtype) * 2 - 1, dim=1)[0]
+        grid = torch.cat([-torch.ones(in_dim, 1, dtype=dtype), inner, torch.ones(in_dim, 1, dtype=dtype)], dim=1)
+    return extend_grid(grid, k_extend=k)
+
+
+def make_data(in_dim, out_dim, G, k, dtype=torch.float64, seed=0, batch=200):
+    generator = torch.Generator().manual_seed(seed)
+    # slightly beyond [-1, 1] so the extended intervals and the outside of the grid are covered too
+    x = (torch.rand(batch, in_dim, generator=generator, dtype=dtype) * 2 - 1) * 1.2
+    coef = torch.normal(0, 1, size=(in_dim, out_dim, G+k), generator=generator, dtype=dtype)
+    return x, coef
+
+
+@pytest.mark.parametrize('k', [1, 2, 3, 4, 5])
+@pytest.mark.parametrize('uniform', [True, False])
+def test_B_batch_local_matches_B_batch(k, uniform):
+    grid = make_grid(3, 7, k, uniform)
+    x, _ = make_data(3, 1, 7, k)
+    values, idx = B_batch_local(x, grid, k=k)
+    dense = local2dense(values, idx, k, grid.shape[1] - k - 1)
+    assert torch.allclose(dense, B_batch(x, grid, k=k), atol=1e-12)
+
+
+@pytest.mark.parametrize('k', [1, 2, 3, 4, 5])
+def test_B_batch_local_derivative(k):
+    grid = make_grid(2, 6, k, False)
+    x, _ = make_data(2, 1, 6, k)
+    values, idx, dvalues = B_batch_local(x, grid, k=k, derivative=True)
+    eps = 1e-6
+    values_p, idx_p = B_batch_local(x + eps, grid, k=k)
+    values_m, idx_m = B_batch_local(x - eps, grid, k=k)
+    # central differences within the same knot interval
+    same = (idx_p == idx) * (idx_m == idx)
+    numeric = (values_p - values_m) / (2 * eps)
+    assert torch.allclose((dvalues * same[:,:,None]), (numeric * same[:,:,None]), atol=1e-5)
+
+
+@pytest.mark.parametrize('k', [1, 2, 3, 4, 5])
+def test_B_batch_uniform_matches_B_batch(k):
+    grid = make_grid(3, 9, k, True)
+    assert is_uniform_grid(grid)
+    x, _ = make_data(3, 1, 9, k)
+    values, idx, dvalues = B_batch_uniform(x, grid, k=k, derivative=True)
+    values_local, idx_local, dvalues_local = B_batch_local(x, grid, k=k, derivative=True)
+    assert torch.equal(idx, idx_local)
+    assert torch.allclose(values, values_local, atol=1e-12)
+    assert torch.allclose(dvalues, dvalues_local, atol=1e-10)
+
+
+def test_is_uniform_grid():
+    assert is_uniform_grid(make_grid(2, 5, 3, True))
+    assert not is_uniform_grid(make_grid(2, 5, 3, False))
+
+
+@pytest.mark.parametrize('k', [1, 2, 3, 4, 5])
+@pytest.mark.parametrize('uniform', [True, False])
+@pytest.mark.parametrize('dtype, atol', [(torch.float64, 1e-12), (torch.float32, 1e-5)])
+def test_coef2curve_paths_match_dense(k, uniform, dtype, atol):
+    grid = make_grid(3, 8, k, uniform, dtype=dtype)
+    x, coef = make_data(3, 2, 8, k, dtype=dtype)
+    reference = coef2curve(x, grid, coef, k)
+    assert torch.allclose(coef2curve(x, grid, coef, k, sparse=True), reference, atol=atol)
+    if uniform:
+        assert torch.allclose(coef2curve(x, grid, coef, k, uniform=True), reference, atol=atol)
+        assert torch.allclose(coef2curve(x, grid, coef, k, sparse=True, uniform=True), reference, atol=atol)
+
+
+@pytest.mark.parametrize('k', [1, 2, 3, 4, 5])
+@pytest.mark.parametrize('uniform', [True, False])
+def test_coef2poly_matches_coef2curve(k, uniform):
+    grid = make_grid(3, 8, k, uniform)
+    x, coef = make_data(3, 2, 8, k)
+    poly = coef2poly(grid, coef, k)
+    assert torch.allclose(poly2curve(x, grid, poly), coef2curve(x, grid, coef, k), atol=1e-10)
+
+
+@pytest.mark.parametrize('k', [1, 2, 3, 4, 5])
+@pytest.mark.parametrize('uniform', [True, False])
+def test_insert_knots_keeps_curves(k, uniform):
+    grid = make_grid(2, 6, k, uniform)
+    x, coef = make_data(2, 2, 6, k)
+    x = x.clamp(-1, 1)
+    knots = torch.tensor([[-0.55, 0.1, 0.7], [-0.2, 0.35, 0.9]], dtype=grid.dtype)
+    grid_fine, coef_fine = insert_knots(grid, coef, k, knots)
+    assert grid_fine.shape[1] == grid.shape[1] + 3 and coef_fine.shape[2] == coef.shape[2] + 3
+    assert torch.allclose(coef2curve(x, grid_fine, coef_fine, k), coef2curve(x, grid, coef, k), atol=1e-10)
+
+
+@pytest.mark.parametrize('k', [1, 2, 3, 4, 5])
+def test_refine_coef_keeps_curves(k):
+    grid = make_grid(2, 5, k, True)
+    new_grid = make_grid(2, 10, k, True)
+    x, coef = make_data(2, 2, 5, k)
+    x = x.clamp(-1, 1)
+    new_coef = refine_coef(grid, coef, k, new_grid)
+    assert new_coef.shape == (2, 2, 10+k)
+    assert torch.allclose(coef2curve(x, new_grid, new_coef, k), coef2curve(x, grid, coef, k), atol=1e-10)
+    # not nested: 5 -> 7 intervals
+    assert refine_coef(grid, coef, k, make_grid(2, 7, k, True)) == None
+
+
+@pytest.mark.parametrize('k', [1, 2, 3, 4, 5])
+@pytest.mark.parametrize('uniform', [True, False])
+@pytest.mark.parametrize('solver, lamb, atol', [('lstsq', 1e-8, 1e-10), ('cholesky', 0., 1e-10), ('cholesky', 1e-8, 1e-3)])
+def test_curve2coef_recovers_curves(k, uniform, solver, lamb, atol):
+    grid = make_grid(2, 6, k, uniform)
+    _, coef = make_data(2, 3, 6, k)
+    # samples in the region where all G+k bases are determined
+    x = torch.linspace(0, 1, steps=500, dtype=grid.dtype)[:,None] * (grid[None,:,-k-1] - grid[None,:,k]) + grid[None,:,k]
+    y = coef2curve(x, grid, coef, k)
+    # the default ridge of the cholesky solver biases the fit slightly
+    fitted = curve2coef(x, y, grid, k, solver=solver, lamb=lamb)
+    assert torch.allclose(coef2curve(x, grid, fitted, k), y, atol=atol)
+
+
+@pytest.mark.parametrize('uniform', [True, False])
+def test_KANLayerFunction_gradcheck(uniform):
+    torch.manual_seed(0)
+    layer = KANLayer(in_dim=3, out_dim=2, num=5, k=3).to(torch.float64)
+    if not uniform:
+        layer.grid.data = make_grid(3, 5, 3, False)
+    layer.grid_uniform = is_uniform_grid(layer.grid)
+    assert layer.grid_uniform == uniform
+    x = (torch.rand(20, 3, dtype=torch.float64) * 2 - 1).requires_grad_(True)
+    coef = layer.coef.detach().clone().requires_grad_(True)
+    scale_base = layer.scale_base.detach().clone().requires_grad_(True)
+    scale_sp = layer.scale_sp.detach().clone().requires_grad_(True)
+    fun = lambda x, coef, scale_base, scale_sp: KANLayerFunction.apply(x, layer.grid, coef, scale_base, scale_sp, layer.mask, layer.k, layer.base_fun, layer.grid_uniform)
+    assert torch.autograd.gradcheck(fun, (x, coef, scale_base, scale_sp))
+    # same outputs as the unfused layer
+    assert torch.allclose(layer(x, fused=True)[0], layer(x, fused=False)[0], atol=1e-12)
+
+
+@pytest.mark.parametrize('engine', ['basis', 'poly'])
+@pytest.mark.parametrize('uniform', [True, False])
+def test_export_matches_model(engine, uniform):
+    model = KAN(width=[2,5,3,1], grid=7, k=3, seed=0, auto_save=False)
+    x = torch.rand(100, 2) * 2 - 1
+    if not uniform:
+        model.update_grid_from_samples(torch.normal(0, 0.5, size=(200, 2)))
+    assert all(layer.grid_uniform == uniform for layer in model.act_fun)
+    frozen = model.export(engine=engine)
+    with torch.no_grad():
+        assert torch.allclose(frozen(x), model(x), atol=1e-6)
+
+
+def test_model_fused_matches_unfused(monkeypatch):
+    dataset = {'train_input': torch.rand(100, 2) * 2 - 1, 'test_input': torch.rand(100, 2) * 2 - 1}
+    dataset['train_label'] = torch.sin(dataset['train_input'][:,[0]]) + dataset['train_input'][:,[1]]**2
+    dataset['test_label'] = torch.sin(dataset['test_input'][:,[0]]) + dataset['test_input'][:,[1]]**2
+    calls = []
+    apply = KANLayerFunction.apply
+    monkeypatch.setattr(KANLayerFunction, 'apply', lambda *args: calls.append(1) or apply(*args))
+
+    model = KAN(width=[2,5,1], grid=5, k=3, seed=0, auto_save=False)
+    model_fused = KAN(width=[2,5,1], grid=5, k=3, seed=0, auto_save=False, fused=True)
+    results = model.fit(dataset, opt='Adam', steps=5, lr=1e-2, update_grid=False)
+    assert len(calls) == 0
+    results_fused = model_fused.fit(dataset, opt='Adam', steps=5, lr=1e-2, update_grid=False)
+    # lamb = 0: no activations are captured before the last step
+    assert len(calls) > 0
+    assert all(abs(loss_fused - loss) < 1e-5 for loss_fused, loss in zip(results_fused['train_loss'], results['train_loss']))
+
+    # captured activations need the unfused path
+    n_calls = len(calls)
+    model_fused(dataset['test_input'])
+    assert len(calls) == n_calls and len(model_fused.spline_preacts) == model_fused.depth
+    model_fused.save_act = False
+    model_fused(dataset['test_input'])
+    assert len(calls) == n_calls + model_fused.depth
+    assert KAN.from_config(model_fused.get_config(), model_fused.state_dict(), model_fused.cache_data).fused == True